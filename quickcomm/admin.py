@@ -1,13 +1,17 @@
 from pyexpat.errors import messages
+from django import forms
 from django.contrib import admin
 from django.http import HttpResponseRedirect
+from django.utils import timezone
 from django.utils.html import format_html
 
 from quickcomm.external_host_deserializers import sync_authors, sync_comment_likes, sync_comments, sync_post_likes, sync_posts, sync_followers
+from quickcomm.host_health import probe_hosts
+from quickcomm.inbound import replay_inbox_items
 
 # Register your models here.
 
-from .models import Author, CommentLike, Host, HostAuthenticator, ImageFile, Post, Comment, Follow, Like, RegistrationSettings, Inbox
+from .models import Author, CommentLike, GitHubFeed, Host, HostAuthenticator, ImageFile, OutboxItem, Post, Comment, Follow, Like, RegistrationSettings, Inbox, RawInboxItem, SyncSchedule, SyncState
 from .models import Author, Post, Comment, Follow, Like, RegistrationSettings, Inbox,FollowRequest
 
 admin.site.register(Follow)
@@ -18,6 +22,44 @@ admin.site.register(CommentLike)
 admin.site.register(ImageFile)
 admin.site.register(FollowRequest)
 
+@admin.register(OutboxItem)
+class OutboxItemAdmin(admin.ModelAdmin):
+    list_display = ('inbox', 'host', 'status', 'attempts', 'next_attempt')
+    list_filter = ('status', 'host')
+    readonly_fields = ('inbox', 'host', 'payload', 'attempts', 'last_error', 'created', 'delivered')
+    actions_on_top = True
+    actions = ['retry']
+
+    @admin.action(description='Retry now')
+    def retry(self, request, queryset):
+        queryset.update(status=OutboxItem.OutboxStatus.PENDING, next_attempt=timezone.now())
+        self.message_user(request, f"Queued {queryset.count()} items for delivery")
+
+@admin.register(RawInboxItem)
+class RawInboxItemAdmin(admin.ModelAdmin):
+    list_display = ('endpoint', 'origin', 'status', 'attempts', 'received', 'last_error')
+    list_filter = ('status', 'direction')
+    readonly_fields = ('endpoint', 'direction', 'data', 'author', 'targets', 'origin', 'attempts', 'last_error', 'received', 'processed')
+    actions_on_top = True
+    actions = ['replay']
+
+    @admin.action(description='Import again')
+    def replay(self, request, queryset):
+        queued = replay_inbox_items(queryset)
+        self.message_user(request, f"Queued {queued} failed items for import")
+
+@admin.register(GitHubFeed)
+class GitHubFeedAdmin(admin.ModelAdmin):
+    list_display = ('username', 'last_polled', 'next_poll', 'last_error')
+    readonly_fields = ('etag', 'last_modified', 'last_polled', 'last_error')
+    actions_on_top = True
+    actions = ['poll']
+
+    @admin.action(description='Poll now')
+    def poll(self, request, queryset):
+        queryset.update(next_poll=timezone.now())
+        self.message_user(request, f"Queued {queryset.count()} feeds for polling")
+
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ('comment', 'author', 'post')
@@ -61,8 +103,22 @@ class CommentAdmin(admin.ModelAdmin):
         return HttpResponseRedirect(".")
 
 
+class PostAdminForm(forms.ModelForm):
+    # the content is kept in its own table, so it is not a field of the post
+    content = forms.CharField(widget=forms.Textarea(), required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.instance._state.adding:
+            self.fields['content'].initial = self.instance.content
+
+    class Meta:
+        model = Post
+        fields = '__all__'
+
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
+    form = PostAdminForm
     list_display = ('title', 'author', 'published', 'visibility', 'unlisted')
     readonly_fields = ('external_url',)
     actions_on_top = True
@@ -98,6 +154,11 @@ class PostAdmin(admin.ModelAdmin):
 
         return False
 
+    def save_model(self, request, obj: Post, form, change):
+        if not change or 'content' in form.changed_data:
+            obj.content = form.cleaned_data['content']
+        super().save_model(request, obj, form, change)
+
     @admin.action(description='Sync Likes')
     def sync_likes(self, request, queryset):
         for post in queryset:
@@ -137,6 +198,36 @@ class PostAdmin(admin.ModelAdmin):
 
         self.message_user(request, "Comments cleared successfully")
         return HttpResponseRedirect(".")
+@admin.register(SyncState)
+class SyncStateAdmin(admin.ModelAdmin):
+    list_display = ('resource', 'host', 'last_published', 'last_synced')
+    list_filter = ('host',)
+    readonly_fields = ('resource', 'host', 'etag', 'last_modified', 'page_hashes', 'last_published', 'last_synced')
+    actions_on_top = True
+    actions = ['forget']
+
+    @admin.action(description='Sync in full next time')
+    def forget(self, request, queryset):
+        count = queryset.count()
+        queryset.delete()
+        self.message_user(request, f"{count} lists will be synced in full next time")
+        return HttpResponseRedirect(".")
+
+@admin.register(SyncSchedule)
+class SyncScheduleAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'kind', 'interval', 'next_run', 'last_run', 'last_duration', 'last_changed', 'last_error')
+    list_filter = ('kind', 'host')
+    readonly_fields = ('kind', 'host', 'author', 'last_run', 'last_duration', 'last_changed', 'last_error')
+    ordering = ('next_run',)
+    actions_on_top = True
+    actions = ['run_now']
+
+    @admin.action(description='Sync now')
+    def run_now(self, request, queryset):
+        queryset.update(next_run=timezone.now())
+        self.message_user(request, f"Queued {queryset.count()} syncs")
+        return HttpResponseRedirect(".")
+
 @admin.register(HostAuthenticator)
 class HostAuthenticatorAdmin(admin.ModelAdmin):
     list_display = ('username', 'nickname')
@@ -145,7 +236,14 @@ class HostAuthenticatorAdmin(admin.ModelAdmin):
 
     @admin.display(description='Base64 Encoded Username:Password')
     def base64(self, obj: HostAuthenticator):
-        return obj.base64string
+        return obj.base64string or 'Only shown when the password is set'
+
+    def save_model(self, request, obj: HostAuthenticator, form, change):
+        super().save_model(request, obj, form, change)
+
+        # the password is hashed now, so this is the last time it is known
+        if 'password' in form.changed_data:
+            self.message_user(request, f"Give this to the host, it will not be shown again: {obj.base64string}")
 class PostInlineForAuthor(admin.TabularInline):
     model = Post
     extra = 0
@@ -319,8 +417,8 @@ class AuthorInlineForHost(admin.TabularInline):
 
 @admin.register(Host)
 class HostAdmin(admin.ModelAdmin):
-    list_display = ('nickname_or_url', 'url', 'last_ping_result')
-    readonly_fields = ('last_successful_ping', 'last_ping', 'last_ping_result')
+    list_display = ('nickname_or_url', 'url', 'last_ping_result', 'circuit_state', 'latency_p50', 'latency_p95')
+    readonly_fields = ('last_successful_ping', 'last_ping', 'last_ping_result', 'circuit_state', 'circuit_changed', 'latency_p50', 'latency_p95', 'latency_p99')
     actions_on_top = True
     actions = ['ping']
     inlines = [AuthorInlineForHost]
@@ -334,8 +432,8 @@ class HostAdmin(admin.ModelAdmin):
         }),
         ('Ping Details', {
             'classes': ('collapse'),
-            'description': 'These fields are automatically updated when the host is pinged. The host is pinged occasionally in the background to check if it is still online, and when it is added or edited.',
-            'fields': ('last_successful_ping', 'last_ping', 'last_ping_result')
+            'description': 'These fields are automatically updated when the host is pinged. The API root of the host is called regularly by the sync worker to check if it is still online. While the circuit is open, nothing is sent to or fetched from the host.',
+            'fields': ('last_successful_ping', 'last_ping', 'last_ping_result', 'circuit_state', 'circuit_changed', 'latency_p50', 'latency_p95', 'latency_p99')
         }),
     )
 
@@ -343,13 +441,22 @@ class HostAdmin(admin.ModelAdmin):
     def nickname_or_url(self, obj: Host):
         return obj.nickname_or_url
 
+    @admin.display(description='p50 latency (ms)')
+    def latency_p50(self, obj: Host):
+        return obj.latency_percentile(50)
+
+    @admin.display(description='p95 latency (ms)')
+    def latency_p95(self, obj: Host):
+        return obj.latency_percentile(95)
+
+    @admin.display(description='p99 latency (ms)')
+    def latency_p99(self, obj: Host):
+        return obj.latency_percentile(99)
+
     @admin.action(description='Ping')
     def ping(self, request, queryset):
-        for host in queryset:
-            host.ping()
-        # save the hosts
-        queryset.update()
-        self.message_user(request, f"Pinged {queryset.count()} hosts")
+        online = probe_hosts(queryset)
+        self.message_user(request, f"Pinged {queryset.count()} hosts, {online} online")
 
     @admin.action(description='Sync author details')
     def sync_author_details(self, request, queryset):
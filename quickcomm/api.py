@@ -2,10 +2,13 @@
 # This file houses the API views.
 
 
-import base64
-from django.http import FileResponse
+import datetime
+import hashlib
+from django.db.models import Count, Max
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django.shortcuts import get_object_or_404
-from django.urls import reverse
 from rest_framework import viewsets
 from rest_framework.response import Response
 from rest_framework.authentication import SessionAuthentication
@@ -13,14 +16,17 @@ from rest_framework import exceptions
 from django.contrib.auth.models import User
 import urllib.parse
 import logging
-import tempfile
+import io
+import re
 
 
+from quickcomm.api_cache import API_CACHE_TIMEOUT, cache, page_key
 from quickcomm.authenticators import APIBasicAuthentication
-from quickcomm.external_host_deserializers import import_http_inbox_item
+from quickcomm.inbound import get_activity_key, get_new_activity_keys, get_shared_inbox_targets, is_duplicate_activity
 from quickcomm.pagination import AuthorLikedPagination, AuthorsPagination, CommentLikesPagination, CommentsPagination, FollowersPagination, PostLikesPagination, PostsPagination
+from quickcomm.urlbuilder import api_url
 
-from .models import Author, CommentLike, Host, Inbox, Post, Comment, Like, ImageFile, RegistrationSettings
+from .models import Author, CommentLike, Host, Inbox, Post, Comment, Like, ImageFile, PostContent, PostImage, RawInboxItem, RegistrationSettings
 from .serializers import AuthorSerializer, CommentLikeActivitySerializer, LikeActivitySerializer, PostSerializer, CommentSerializer, get_paginated_serializer
 from .models import Author, Post, Comment, Like
 from .serializers import AuthorSerializer, PostSerializer, CommentSerializer
@@ -41,7 +47,7 @@ from drf_yasg.utils import swagger_auto_schema
 def authAPI(view):
     def wrapper(self, request, *args, **kwargs):
         # get the settings object
-        settings, _ = RegistrationSettings.objects.get_or_create()
+        settings = RegistrationSettings.get_cached()
         # check if api authentication is required
         if settings.allow_api_access_without_login:
             # if it's not required, then just call the view
@@ -73,6 +79,104 @@ def authAuthor(view):
 
     return wrapper
 
+# create a decorator that answers conditional GET requests. The validators
+# are a fingerprint of the objects the view returns: how many there are and
+# when the last of them (and the objects embedded in them) changed. Peers that
+# already have the latest response get an empty 304 instead.
+def conditionalAPI(*fields):
+    def decorator(view):
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(self, request, *args, **kwargs)
+
+            queryset = self.get_queryset()
+            if 'pk' in kwargs:
+                queryset = queryset.filter(pk=kwargs['pk'])
+            fingerprint = queryset.order_by().aggregate(count=Count('pk', distinct=True), **{field: Max(field) for field in fields})
+
+            # the response also depends on the page asked for
+            key = request.get_full_path() + '|' + '|'.join(str(value) for value in fingerprint.values())
+            etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+            last_modified = max((value for value in fingerprint.values() if isinstance(value, datetime.datetime)), default=None)
+            last_modified = int(last_modified.timestamp()) if last_modified is not None else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(self, request, *args, **kwargs)
+
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                if last_modified is not None:
+                    response['Last-Modified'] = http_date(last_modified)
+            return response
+
+        return wrapper
+    return decorator
+
+# create a decorator that caches the serialized data of a response. The key
+# has the version of the resource the response shows (formatted from the URL
+# kwargs), which is bumped whenever an object in it changes.
+def cachedAPI(resource):
+    def decorator(view):
+        def wrapper(self, request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(self, request, *args, **kwargs)
+
+            key = page_key(request, resource.format(**kwargs))
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+
+            response = view(self, request, *args, **kwargs)
+            if response.status_code == 200 and getattr(response, 'data', None) is not None:
+                cache.set(key, response.data, API_CACHE_TIMEOUT)
+            return response
+
+        return wrapper
+    return decorator
+
+# a single byte range, which is all browsers ask for when loading images
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def image_response(request, image):
+    """Returns a response with the given post image. The response has an ETag
+    so clients can revalidate their copy, and supports single byte ranges."""
+
+    etag = f'"{image.etag}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+
+    data = image.data
+    size = len(data)
+    start, end = 0, size - 1
+    status = 200
+
+    match = RANGE_PATTERN.match(request.headers.get('Range', ''))
+    if match and any(match.groups()):
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            # a suffix range, like bytes=-500 for the last 500 bytes
+            start = max(size - int(last), 0)
+
+        if start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        status = 206
+
+    # the blob is sent in chunks without copying it to a temporary file
+    response = FileResponse(io.BytesIO(memoryview(data)[start:end + 1]), content_type=image.content_type, status=status)
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
 class AuthorViewSet(viewsets.ModelViewSet):
     """This is a viewset that allows us to interact with the Author model."""
 
@@ -84,7 +188,7 @@ class AuthorViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         self.paginator.url = self.request.build_absolute_uri()
-        return super().get_queryset()
+        return AuthorSerializer.prefetch(super().get_queryset())
 
 
     @swagger_auto_schema(
@@ -98,6 +202,8 @@ class AuthorViewSet(viewsets.ModelViewSet):
 
     )
     @authAPI
+    @conditionalAPI('updated_at')
+    @cachedAPI('authors')
     def list(self, request):
         return super(AuthorViewSet, self).list(request)
 
@@ -120,59 +226,51 @@ class AuthorViewSet(viewsets.ModelViewSet):
             responses={200: AuthorSerializer, 404: "Author not found"},
     )
     @authAPI
+    @conditionalAPI('updated_at')
+    @cachedAPI('authors')
     def retrieve(self, *args, **kwargs):
         return super(AuthorViewSet, self).retrieve(*args, **kwargs)
 
     @swagger_auto_schema(
             request_body=LikeActivitySerializer(),
             operation_summary="Send an item to an inbox.",
-            operation_description="This endpoint allows you to send an item to an inbox of a specific author. The item must be a valid inbox item.",
-            responses={200: "Success", 404: "Author not found"},
+            operation_description="This endpoint allows you to send an item to an inbox of a specific author. The item must be a valid inbox item. It is accepted straight away and added to the inbox shortly after.",
+            responses={202: "Accepted, the item is added to the inbox shortly", 400: "Not an inbox item", 404: "Author not found"},
             security=[{"BasicAuth": []}],
     )
     @authAPI
     def inbox(self, request, pk=None):
 
-        host = None
-
-        # Determine which host is making the response
-        origin = request.headers.get('Origin')
-        if origin is None:
-            logging.warning('No origin header found for request, using default')
-        else:
-            try:
-                host = Host.objects.get(url=origin)
-                logging.info('Incoming request from host: ' + host.url)
-            except Exception as e:
-                logging.warning(f'No host found for origin header {origin}, using default', exc_info=True)
-
         # Determine who's inbox we want to add an item to
         try:
-            author = Author.objects.get(pk=pk)
+            exists = Author.objects.filter(pk=pk).exists()
         except Exception:
+            exists = False
+        if not exists:
             raise exceptions.NotFound('Author not found')
 
-        try:
-            logging.info(f'Attempting to parse inbox item {str(request.data)}')
-            item, inbox_type = import_http_inbox_item(author, request.data, host)
-        except exceptions.APIException as e:
-            raise e
-        # except Exception as e:
-        #     raise exceptions.ParseError('Could not parse inbox item')
-
-        # save item to inbox
-
-        if inbox_type != Inbox.InboxType.FOLLOW:
-            inbox = Inbox.objects.create(
-                author=author,
-                content_object=item,
-                inbox_type=inbox_type
-            )
-
-            inbox.save()
-
+        if not isinstance(request.data, dict) or not isinstance(request.data.get('type'), str):
+            raise exceptions.ParseError('Expected an inbox item with a type')
+
+        # Items that were already received are dropped. Their key is only
+        # remembered once they are imported, so items that fail can be sent
+        # again.
+        key = get_activity_key(request.data, pk)
+        if is_duplicate_activity(key):
+            return Response(status=200, data={'detail': 'Already received.'})
+
+        # The item is written to the journal as it is, and the process_inbox
+        # worker imports it into the inbox later
+        RawInboxItem.objects.create(
+            endpoint=request.build_absolute_uri(),
+            direction=RawInboxItem.RawInboxDirection.IN,
+            data=request.data,
+            author_id=pk,
+            origin=request.headers.get('Origin'),
+            key=key,
+        )
 
-        return Response(status=200, data={'detail': 'Success.'})
+        return Response(status=202, data={'detail': 'Accepted.'})
 
 
 class FollowerViewSet(viewsets.ModelViewSet):
@@ -195,10 +293,10 @@ class FollowerViewSet(viewsets.ModelViewSet):
             return Author.objects.none()
 
         self.paginator.upper_response_param = 'author'
-        self.paginator.upper_url = self.request.build_absolute_uri(reverse('api:author-detail', kwargs={'pk': self.kwargs['authors_pk']}))
+        self.paginator.upper_url = api_url('api:author-detail', self.request, pk=self.kwargs['authors_pk'])
 
         try:
-            return Author.objects.filter(follower__following=self.kwargs['authors_pk'])
+            return AuthorSerializer.prefetch(Author.objects.filter(follower__following=self.kwargs['authors_pk']))
         except:
             raise exceptions.NotFound('Author not found')
         # return Follow.objects.filter(following=self.kwargs['authors_pk'])
@@ -214,6 +312,8 @@ class FollowerViewSet(viewsets.ModelViewSet):
     )
 
     @authAPI
+    @conditionalAPI('updated_at')
+    @cachedAPI('followers:{authors_pk}')
     def list(self, request, authors_pk=None):
         return super(FollowerViewSet, self).list(request)
 
@@ -272,9 +372,9 @@ class PostViewSet(viewsets.ModelViewSet):
             return Post.objects.none()
 
         self.paginator.upper_response_param = 'author'
-        self.paginator.upper_url = self.request.build_absolute_uri(reverse('api:author-detail', kwargs={'pk': self.kwargs['authors_pk']}))
+        self.paginator.upper_url = api_url('api:author-detail', self.request, pk=self.kwargs['authors_pk'])
         try:
-            return Post.objects.filter(author=self.kwargs['authors_pk'], visibility='PUBLIC', unlisted=False)
+            return PostSerializer.prefetch(Post.objects.filter(author=self.kwargs['authors_pk'], visibility='PUBLIC', unlisted=False))
         except:
             raise exceptions.NotFound('Author not found')
 
@@ -288,6 +388,8 @@ class PostViewSet(viewsets.ModelViewSet):
     )
 
     @authAPI
+    @conditionalAPI('updated_at', 'author__updated_at', 'comment__updated_at')
+    @cachedAPI('posts:{authors_pk}')
     def list(self, request, authors_pk=None):
         return super(PostViewSet, self).list(request)
 
@@ -340,30 +442,17 @@ class PostViewSet(viewsets.ModelViewSet):
         if post.content_type != Post.PostType.PNG and post.content_type != Post.PostType.JPG:
             return Response(status=404)
 
-        def map_content_type_to_image_type(content_type):
-            if content_type == Post.PostType.PNG:
-                return 'image/png'
-            if content_type == Post.PostType.JPG:
-                return 'image/jpeg'
-            return None
-
-
-        # get content
-        image_str = post.content
-
-        # decode content
-        image_bytes = base64.b64decode(image_str)
-        # save to NamedTemporaryFile
-        image = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-        name = image.name
-        image.write(image_bytes)
-        image.close()
-
+        try:
+            image = PostImage.objects.get(post=post)
+        except PostImage.DoesNotExist:
+            # posts that were written without save() still have base64 content
+            data = post.take_image()
+            if data is None:
+                return Response(status=404)
+            image = PostImage.store(post, data)
+            PostContent.objects.filter(post=post).update(data='')
 
-        # open the image
-        image = open(name, 'rb')
-            # return image
-        return FileResponse(image, content_type=map_content_type_to_image_type(post.content_type))
+        return image_response(request, image)
 
     @swagger_auto_schema(
             operation_summary="Replace the contents of a post.",
@@ -382,13 +471,15 @@ class PostViewSet(viewsets.ModelViewSet):
             responses={200: PostSerializer, 404: "Post not found"},
     )
     @authAPI
+    @conditionalAPI('updated_at', 'author__updated_at', 'comment__updated_at')
+    @cachedAPI('posts:{authors_pk}')
     def retrieve(self, *args, **kwargs):
         return super().retrieve(self, *args, **kwargs)
 
     @authAPI
     def likes(self, request, authors_pk=None, pk=None):
         post = get_object_or_404(Post, pk=pk)
-        queryset = post.likes.all()
+        queryset = LikeActivitySerializer.prefetch(post.likes.all())
         serializer = LikeActivitySerializer(queryset, many=True, context={'request': request})
         return Response({'type': 'likes', 'items': serializer.data})
 
@@ -410,9 +501,9 @@ class AuthorLikedViewSet(viewsets.ModelViewSet):
             return Like.objects.none()
 
         self.paginator.upper_response_param = 'author'
-        self.paginator.upper_url = self.request.build_absolute_uri(reverse('api:author-detail', kwargs={'pk': self.kwargs['authors_pk']}))
+        self.paginator.upper_url = api_url('api:author-detail', self.request, pk=self.kwargs['authors_pk'])
         try:
-            return Like.objects.filter(author=self.kwargs['authors_pk'])
+            return LikeActivitySerializer.prefetch(Like.objects.filter(author=self.kwargs['authors_pk']))
         except:
             raise exceptions.NotFound('Author not found')
 
@@ -422,6 +513,8 @@ class AuthorLikedViewSet(viewsets.ModelViewSet):
             responses={200: get_paginated_serializer(AuthorLikedPagination, LikeActivitySerializer), 404: "Author not found"},
     )
     @authAPI
+    @conditionalAPI('updated_at', 'author__updated_at')
+    @cachedAPI('liked:{authors_pk}')
     def list(self, request, authors_pk=None):
         return super(AuthorLikedViewSet, self).list(request)
 
@@ -442,9 +535,9 @@ class PostLikesViewSet(viewsets.ModelViewSet):
             return Like.objects.none()
 
         self.paginator.upper_response_param = 'post'
-        self.paginator.upper_url = self.request.build_absolute_uri(reverse('api:post-detail', kwargs={'authors_pk': self.kwargs['authors_pk'], 'pk': self.kwargs['posts_pk']}))
+        self.paginator.upper_url = api_url('api:post-detail', self.request, authors_pk=self.kwargs['authors_pk'], pk=self.kwargs['posts_pk'])
         try:
-            return Like.objects.filter(post=self.kwargs['posts_pk'], post__author=self.kwargs['authors_pk'])
+            return LikeActivitySerializer.prefetch(Like.objects.filter(post=self.kwargs['posts_pk'], post__author=self.kwargs['authors_pk']))
         except:
             raise exceptions.NotFound('Post not found')
 
@@ -454,6 +547,8 @@ class PostLikesViewSet(viewsets.ModelViewSet):
             responses={200: get_paginated_serializer(PostLikesPagination, LikeActivitySerializer), 404: "Post not found"},
     )
     @authAPI
+    @conditionalAPI('updated_at', 'author__updated_at')
+    @cachedAPI('post-likes:{posts_pk}')
     def list(self, request, authors_pk=None, posts_pk=None):
         return super(PostLikesViewSet, self).list(request)
 
@@ -475,9 +570,9 @@ class CommentLikesViewSet(viewsets.ModelViewSet):
             return CommentLike.objects.none()
 
         self.paginator.upper_response_param = 'comment'
-        self.paginator.upper_url = self.request.build_absolute_uri(reverse('api:comment-detail', kwargs={'authors_pk': self.kwargs['authors_pk'], 'posts_pk': self.kwargs['posts_pk'], 'pk': self.kwargs['comments_pk']}))
+        self.paginator.upper_url = api_url('api:comment-detail', self.request, authors_pk=self.kwargs['authors_pk'], posts_pk=self.kwargs['posts_pk'], pk=self.kwargs['comments_pk'])
         try:
-            return CommentLike.objects.filter(comment=self.kwargs['comments_pk'], comment__post=self.kwargs['posts_pk'], comment__post__author=self.kwargs['authors_pk'])
+            return CommentLikeActivitySerializer.prefetch(CommentLike.objects.filter(comment=self.kwargs['comments_pk'], comment__post=self.kwargs['posts_pk'], comment__post__author=self.kwargs['authors_pk']))
         except:
             raise exceptions.NotFound('Comment not found')
 
@@ -487,6 +582,8 @@ class CommentLikesViewSet(viewsets.ModelViewSet):
             responses={200: get_paginated_serializer(CommentLikesPagination, CommentLikeActivitySerializer), 404: 'Comment not found'},
     )
     @authAPI
+    @conditionalAPI('updated_at', 'author__updated_at')
+    @cachedAPI('comment-likes:{comments_pk}')
     def list(self, request, authors_pk=None, posts_pk=None, comments_pk=None):
         return super(CommentLikesViewSet, self).list(request)
 
@@ -514,10 +611,9 @@ class CommentViewSet(viewsets.ModelViewSet):
             return Comment.objects.none()
 
         self.paginator.upper_response_param = 'post'
-        self.paginator.upper_url = self.request.build_absolute_uri(reverse('api:post-detail', kwargs={'authors_pk': self.kwargs['authors_pk'],
-        'pk': self.kwargs['posts_pk']}))
+        self.paginator.upper_url = api_url('api:post-detail', self.request, authors_pk=self.kwargs['authors_pk'], pk=self.kwargs['posts_pk'])
         try:
-            return Comment.objects.filter(post=self.kwargs['posts_pk'], post__author=self.kwargs['authors_pk'])
+            return CommentSerializer.prefetch(Comment.objects.filter(post=self.kwargs['posts_pk'], post__author=self.kwargs['authors_pk']))
         except:
             raise exceptions.NotFound('Post or author not found.')
 
@@ -527,6 +623,8 @@ class CommentViewSet(viewsets.ModelViewSet):
             responses={200: get_paginated_serializer(CommentsPagination, CommentSerializer), 404: "Post or author not found"},
     )
     @authAPI
+    @conditionalAPI('updated_at', 'author__updated_at')
+    @cachedAPI('comments:{posts_pk}')
     def list(self, request, authors_pk=None, posts_pk=None):
         return super(CommentViewSet, self).list(request)
 
@@ -536,7 +634,82 @@ class CommentViewSet(viewsets.ModelViewSet):
             responses={200: CommentSerializer, 404: "Comment not found"},
     )
     @authAPI
+    @conditionalAPI('updated_at', 'author__updated_at')
+    @cachedAPI('comments:{posts_pk}')
     def retrieve(self, request, authors_pk=None, posts_pk=None, pk=None):
         return super(CommentViewSet, self).retrieve(request)
 
 
+class SharedInboxViewSet(viewsets.ViewSet):
+    """This is a viewset for the inbox of the whole server, which other
+    QuickComm nodes send batches of activities to. Each activity is written to
+    the journal with its target authors, and the process_inbox worker imports
+    it once and adds it to all of their inboxes."""
+
+    authentication_classes = [APIBasicAuthentication, SessionAuthentication]
+
+    # the most activities a single request may carry
+    MAX_ACTIVITIES = 500
+
+    @swagger_auto_schema(
+            operation_summary="Send items to the inboxes of many authors.",
+            operation_description="This endpoint takes a list of activities, each with the ids of the authors whose inboxes it goes to: [{\"authors\": [\"<id>\", ...], \"item\": {...}}, ...]. The activities are imported after the response is sent. The response has a result for each activity, in order, that says whether it was accepted, and for one that was not, whether sending it again can work.",
+            responses={202: "Accepted", 400: "Not a list of activities"},
+            security=[{"BasicAuth": []}],
+    )
+    @authAPI
+    def create(self, request):
+        activities = request.data
+        if not isinstance(activities, list) or len(activities) > self.MAX_ACTIVITIES:
+            raise exceptions.ParseError(f'Expected a list of at most {self.MAX_ACTIVITIES} activities')
+
+        # the target authors of every activity are loaded together
+        ids = []
+        for activity in activities:
+            if isinstance(activity, dict) and isinstance(activity.get('authors'), list):
+                ids.extend(activity['authors'])
+        authors = {str(author.id): author for author in get_shared_inbox_targets(ids)}
+
+        # activities that are turned away are marked permanent, so the sender
+        # does not try them again
+        results = []
+        accepted = []
+        for activity in activities:
+            if not isinstance(activity, dict) or not isinstance(activity.get('authors'), list):
+                results.append({'delivered': False, 'permanent': True, 'error': 'Expected an activity with a list of authors'})
+                continue
+            if not isinstance(activity.get('item'), dict) or not isinstance(activity['item'].get('type'), str):
+                results.append({'delivered': False, 'permanent': True, 'error': 'Expected an inbox item with a type'})
+                continue
+
+            targets = list({author.id: author for author in (authors.get(str(id)) for id in activity['authors']) if author is not None}.values())
+            if not targets:
+                results.append({'delivered': False, 'permanent': True, 'error': 'Author not found'})
+                continue
+
+            keys = {get_activity_key(activity['item'], author.id): author for author in targets}
+            accepted.append((activity, keys))
+            results.append({'delivered': True})
+
+        # the authors that already received an activity are dropped with one
+        # lookup of the keys of every activity
+        new = get_new_activity_keys([key for _, keys in accepted for key in keys if key is not None])
+
+        items = []
+        for activity, keys in accepted:
+            targets = [author for key, author in keys.items() if key is None or key in new]
+            if not targets:
+                continue
+
+            # The activity is written to the journal as it is, and the
+            # process_inbox worker imports it into the inboxes later
+            items.append(RawInboxItem(
+                endpoint=request.build_absolute_uri(),
+                direction=RawInboxItem.RawInboxDirection.IN,
+                data=activity['item'],
+                targets=[str(author.id) for author in targets],
+                origin=request.headers.get('Origin'),
+            ))
+        RawInboxItem.objects.bulk_create(items)
+
+        return Response(status=202, data={'detail': 'Accepted.', 'results': results})
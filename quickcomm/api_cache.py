@@ -0,0 +1,73 @@
+# This file houses the cache for serialized API responses. Remote hosts poll
+# the same pages over and over, and most of them rarely change, so the
+# serialized data of a page is cached and reused until the objects on it
+# change.
+#
+# Every cached page belongs to a resource, like the posts of one author. Each
+# resource has a version number in the cache, which is part of the key of its
+# pages. When an object changes, the versions of the resources it shows up in
+# are bumped, so their old pages are never read again and simply expire.
+#
+# Versions are bumped once the change is committed. A page read before that
+# still shows the old objects, and would otherwise be cached under the new
+# version. The database cache increments a version by reading and writing it
+# again, so two bumps at the same time can end up as one; a page cached between
+# them may then show the first change without the second until it expires.
+
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+
+# The cache the pages and versions are kept in, shared by every process.
+cache = caches['api']
+
+# How long a cached page is kept, in seconds. Pages are invalidated by their
+# version, so this only bounds how long unused pages take up space.
+API_CACHE_TIMEOUT = 60 * 10
+
+# Authors are embedded in almost every response, so every page also depends on
+# the version of this resource.
+AUTHORS = 'authors'
+
+
+def version_key(resource):
+    return f'api-version:{resource}'
+
+
+def bump_api_versions(*resources):
+    """Invalidates the cached pages of the given resources once the current
+    transaction is committed."""
+    transaction.on_commit(lambda: _bump_api_versions(resources))
+
+
+def _bump_api_versions(resources):
+    for resource in resources:
+        try:
+            cache.incr(version_key(resource))
+        except ValueError:
+            # There is no version yet, so there are no pages to invalidate.
+            # Versions start from the clock, so a version that was evicted
+            # never comes back with a number an old page was cached under.
+            cache.add(version_key(resource), time.time_ns(), None)
+
+
+def get_api_versions(*resources):
+    """Returns the current versions of the given resources."""
+    keys = [version_key(resource) for resource in resources]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def page_key(request, resource):
+    """Returns the cache key of the page the request asks for."""
+    versions = get_api_versions(resource, AUTHORS)
+
+    # the page also depends on the host it was asked on, as urls are absolute
+    digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'api-page:{resource}:' + ':'.join(str(version) for version in versions) + f':{digest}'
@@ -1,5 +1,5 @@
 
-from django.urls import path, include
+from django.urls import path, re_path, include
 
 from quickcomm.routers import AuthorLikedRouter, AuthorRouter, CommentsRouter, PostLikesRouter, PostRouter, FollowersRouter
 from . import api
@@ -30,6 +30,7 @@ commentlikes = PostLikesRouter(comment, r'comments', lookup='comments')
 commentlikes.register(r'likes', api.CommentLikesViewSet, basename='likes')
 
 urlpatterns = [
+    re_path(r'^inbox/?$', api.SharedInboxViewSet.as_view({'post': 'create'}), name='shared-inbox'),
     path('', include(author.urls)),
     path('', include(post.urls)),
     path('', include(follower.urls)),
@@ -4,7 +4,7 @@ from rest_framework import authentication
 from rest_framework import exceptions
 from rest_framework.request import Request
 
-from quickcomm.models import HostAuthenticator
+from quickcomm.models import HostAuthenticator, credentials_digest, get_verified_credentials, remember_verified_credentials
 
 # This file contains a custom Basic authentication for HTTP that uses our
 # HostAuthenticator model. This is used to authenticate requests from other
@@ -26,13 +26,16 @@ class APIBasicAuthentication(authentication.BaseAuthentication):
         except:
             raise exceptions.AuthenticationFailed('Invalid authentication header')
 
-        # check that the username and password are valid
-        try:
-            authenticator = HostAuthenticator.objects.get(username=username)
-        except HostAuthenticator.DoesNotExist:
-            raise exceptions.AuthenticationFailed('Invalid username or password')
+        # credentials that were verified recently skip the password hash
+        digest = credentials_digest(username, password)
+        authenticator = get_verified_credentials(digest)
+        if authenticator is not None:
+            return (authenticator, None)
 
-        if not authenticator.check_password(password):
+        # check that the username and password are valid
+        authenticator = HostAuthenticator.get_cached(username)
+        if authenticator is None or not authenticator.check_password(password):
             raise exceptions.AuthenticationFailed('Invalid username or password')
 
+        remember_verified_credentials(digest, authenticator)
         return (authenticator, None)
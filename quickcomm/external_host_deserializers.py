@@ -10,11 +10,15 @@
 # TODO handle case where looking at an author's liked items returns a post or comment that doesn't exist on our server
 # in that case, we don't want to represent the post or comment on our end, we just wanna store the external url
 
+import logging
 import uuid
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 from django.core.files.base import ContentFile
+from quickcomm.api_cache import bump_api_versions
 from quickcomm.external_host_requests import Group1QCRequest, InternalQCRequest, MattGroupQCRequest, THTHQCRequest
-from quickcomm.models import Author, Comment, CommentLike, Follow, FollowRequest, Host, Like, Post
+from quickcomm.models import Author, Comment, CommentLike, Follow, FollowRequest, Host, Like, Post, PostContent, PostImage, get_by_external_url, normalize_external_url
 import base64
 
 from quickcomm.serializers import CommentActivitySerializer, CommentLikeActivitySerializer, FollowActivitySerializer, LikeActivitySerializer, PostActivitySerializer
@@ -116,6 +120,59 @@ class AuthorDeserializer(serializers.ModelSerializer):
 
         return author
 
+    # the fields that are copied from the remote author when it is updated
+    UPDATE_FIELDS = ['display_name', 'profile_image', 'github', 'external_url', 'normalized_url']
+
+    @staticmethod
+    def save_batch(validated_items, host=None):
+        """Save a page of validated authors. The existing authors are found
+        with one lookup, and the page is written with one bulk insert and one
+        bulk update in a single transaction."""
+
+        # if the page has the same author twice, the last one wins
+        items = {normalize_external_url(data['external_url']): data for data in validated_items}
+        existing = Author.get_many_from_urls([data['external_url'] for data in items.values()])
+
+        new_authors = []
+        changed_authors = []
+        for normalized_url, data in items.items():
+            url = data['external_url']
+            author = existing.get(url)
+            if author is None:
+                # bulk_create does not call save(), so the url is normalized here
+                new_authors.append(Author(**data, host=host, normalized_url=normalized_url))
+                continue
+
+            # we can have an author without a host, but if we do have a host, it must match
+            if author.host_id is not None and host is not None and author.host_id != host.id:
+                logging.error(f'Author {url} belongs to another host. Skipping.')
+                continue
+
+            before = [getattr(author, field) for field in AuthorDeserializer.UPDATE_FIELDS]
+            author.display_name = data['display_name']
+            author.profile_image = data.get('profile_image')
+            author.github = data.get('github')
+            if author.external_url is not None:
+                author.external_url = url
+                author.normalized_url = normalized_url
+
+            # authors that did not change are not written, so their updated_at
+            # still matches what peers have cached
+            if before != [getattr(author, field) for field in AuthorDeserializer.UPDATE_FIELDS]:
+                author.updated_at = timezone.now()
+                changed_authors.append(author)
+
+        with transaction.atomic():
+            Author.objects.bulk_create(new_authors)
+            Author.objects.bulk_update(changed_authors, AuthorDeserializer.UPDATE_FIELDS + ['updated_at'])
+
+        # bulk writes do not send signals, so the cached pages are
+        # invalidated here
+        if new_authors or changed_authors:
+            bump_api_versions('authors')
+
+        return new_authors + changed_authors
+
     class Meta:
         model = Author
         fields = ['external_url', 'display_name', 'profile_image', 'github']
@@ -136,7 +193,7 @@ class PostDeserializer(serializers.ModelSerializer):
 
     def save(self, author=None):
         assert(author is not None)
-        post = Post.objects.filter(external_url=self.validated_data['external_url']).first()
+        post = get_by_external_url(Post, self.validated_data['external_url'])
         if post is None:
 
             # TODO support application mimetype
@@ -159,6 +216,86 @@ class PostDeserializer(serializers.ModelSerializer):
 
         return post
 
+    # the fields that are copied from the remote post when it is updated
+    UPDATE_FIELDS = ['title', 'source', 'origin', 'description', 'content_type', 'published', 'visibility', 'unlisted', 'external_url', 'content']
+
+    @staticmethod
+    def save_batch(validated_items, author=None):
+        """Save a page of validated posts of a remote author. The existing
+        posts are found with one query, and the page is written with one bulk
+        insert and one bulk update in a single transaction."""
+        assert(author is not None)
+
+        # if the page has the same post twice, the last one wins
+        items = {normalize_external_url(data['external_url']): data for data in validated_items}
+        existing = {post.normalized_url: post for post in Post.objects.filter(normalized_url__in=items.keys()).select_related('postcontent')}
+
+        new_posts = []
+        updated_posts = []
+        before = {}
+        for normalized_url, data in items.items():
+            post = existing.get(normalized_url)
+            if post is None:
+                # TODO support application mimetype
+                # bulk_create does not call save(), so the url is normalized here
+                new_posts.append(Post(**data, author=author, normalized_url=normalized_url))
+                continue
+
+            if post.author_id != author.id:
+                logging.error(f'Post {data["external_url"]} belongs to another author. Skipping.')
+                continue
+
+            before[post.pk] = [getattr(post, field) for field in PostDeserializer.UPDATE_FIELDS]
+            for field in PostDeserializer.UPDATE_FIELDS:
+                setattr(post, field, data.get(field))
+            post.normalized_url = normalized_url
+            updated_posts.append(post)
+
+        # posts of local authors are sent to inboxes when they are saved, so
+        # they cannot skip save()
+        if author.is_local:
+            for post in new_posts + updated_posts:
+                post.save()
+            return new_posts + updated_posts
+
+        # bulk_create does not call save(), so the images are taken out of the
+        # content here. Images that are already stored are not written again.
+        images = {}
+        for post in new_posts + updated_posts:
+            image = post.take_image()
+            if image is not None:
+                images[post.pk] = PostImage(post=post, **PostImage.defaults_for(post, image))
+        stored = dict(PostImage.objects.filter(post__in=[post.pk for post in updated_posts if post.pk in images]).values_list('post_id', 'etag'))
+        images = {pk: image for pk, image in images.items() if stored.get(pk) != image.etag}
+
+        # posts that did not change are not written, so their updated_at still
+        # matches what peers have cached
+        changed_posts = []
+        for post in updated_posts:
+            if post.pk in images or before[post.pk] != [getattr(post, field) for field in PostDeserializer.UPDATE_FIELDS]:
+                post.updated_at = timezone.now()
+                changed_posts.append(post)
+
+        # the content is not a column of the post, so it is written to its own
+        # table next to the posts, only for the posts whose content changed
+        content_index = PostDeserializer.UPDATE_FIELDS.index('content')
+        changed_contents = [post for post in changed_posts if before[post.pk][content_index] != post.content]
+        contents = [PostContent(post=post, data=post.content) for post in new_posts + changed_contents]
+        row_fields = [field for field in PostDeserializer.UPDATE_FIELDS if field != 'content']
+
+        with transaction.atomic():
+            Post.objects.bulk_create(new_posts)
+            Post.objects.bulk_update(changed_posts, row_fields + ['excerpt', 'normalized_url', 'updated_at'])
+            PostContent.objects.bulk_create(contents, update_conflicts=True, unique_fields=['post'], update_fields=['data'])
+            PostImage.objects.bulk_create(images.values(), update_conflicts=True, unique_fields=['post'], update_fields=['data', 'content_type', 'size', 'etag'])
+
+        # bulk writes do not send signals, so the cached pages are
+        # invalidated here
+        if new_posts or changed_posts:
+            bump_api_versions(f'posts:{author.id}')
+
+        return new_posts + changed_posts
+
 
     class Meta:
         model = Post
@@ -187,7 +324,7 @@ class CommentDeserializer(serializers.ModelSerializer):
             comment.save()
             return comment
 
-        comment = Comment.objects.filter(external_url=self.validated_data['external_url']).first()
+        comment = get_by_external_url(Comment, self.validated_data['external_url'])
         if comment is None or self.validated_data['external_url'] is None:
             comment = Comment.objects.create(**self.validated_data, post=post, author=author)
         else:
@@ -6,25 +6,67 @@
 # and caching external requests.
 
 import datetime
+import hashlib
 import json
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import exceptions
-import requests_cache
+import requests
 import logging
 from requests.adapters import HTTPAdapter
 
 
 from urllib3 import Retry
 
-from quickcomm.models import Author, Comment, Inbox, Post
+from quickcomm.host_health import HostUnavailable, get_breaker
+from quickcomm.http_cache import CachedSession, http_cache
+from quickcomm.models import Author, Comment, Inbox, Post, SyncState
 from .request_exposer import get_request
 
 
-# This caches the requests for 5 minutes, but this can be changed
-session = requests_cache.CachedSession('external_cache', expire_after=1)
+# The number of requests that can be in flight to a single host at once. This
+# is also the number of connections kept open to each host.
+HOST_CONCURRENCY = 4
+
+# The number of hosts that connections are kept open to.
+HOST_POOLS = 32
+
+# GET requests are answered from the HTTP cache while they are fresh (see
+# http_cache).
+session = CachedSession(http_cache)
 retry = Retry(connect=3, backoff_factor=0.5)
-adapter = HTTPAdapter(max_retries=retry)
+# urllib3 keeps a separate pool of connections for every host, so connections
+# to a host are reused across pages and across threads.
+adapter = HTTPAdapter(max_retries=retry, pool_connections=HOST_POOLS, pool_maxsize=HOST_CONCURRENCY)
 session.mount('http://', adapter)
 session.mount('https://', adapter)
+
+# Delta syncs send their own conditional requests and need to see the 304s,
+# so they go around the cache.
+sync_session = requests.Session()
+sync_session.mount('http://', adapter)
+sync_session.mount('https://', adapter)
+
+# Pages of lists are downloaded on this pool, so the next pages of a list are
+# fetched while the current one is saved.
+page_pool = ThreadPoolExecutor(max_workers=HOST_POOLS, thread_name_prefix='quickcomm-page')
+
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+def host_limit(url):
+    """Return the semaphore that bounds the number of requests in flight to
+    the host of the given url."""
+    parts = urllib.parse.urlsplit(url)
+    with _host_limits_lock:
+        if parts.netloc not in _host_limits:
+            _host_limits[parts.netloc] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        return _host_limits[parts.netloc]
+
 class BaseQCRequest:
     """This class is used to make requests to other servers. It is used to
     make requests to other servers, and to cache the results of those requests.
@@ -41,6 +83,18 @@ class BaseQCRequest:
     FOLLOWERS_ENDPOINT = '/followers'
     INBOX_ENDPOINT = '/inbox'
 
+    # seconds to wait on a remote inbox before giving up on a delivery
+    INBOX_TIMEOUT = 10
+
+    # QuickComm nodes have an inbox for the whole server, which takes many
+    # activities for many of its authors in one request
+    shared_inbox = False
+    SHARED_INBOX_ENDPOINT = '/inbox/'
+
+    # seconds a host that answered that it has no shared inbox is not asked
+    # again, so older nodes are not sent every batch for nothing
+    NO_SHARED_INBOX_TIMEOUT = 60 * 60
+
     paginate_posts = True
     paginate_followers = True
     paginate_post_likes = True
@@ -220,12 +274,37 @@ class BaseQCRequest:
             return url[:-1]
         return url
 
+    def _breaker(self, endpoint):
+        """Return the circuit breaker of the host of the endpoint."""
+        return get_breaker(self.host_obj, endpoint)
+
+    def _call(self, method, endpoint, **kwargs):
+        """Make a request to the remote server, and feed its outcome to the
+        circuit breaker of the host. Errors and server errors count as
+        failures."""
+        breaker = self._breaker(endpoint)
+        try:
+            with host_limit(endpoint):
+                response = method(endpoint, **kwargs)
+        except Exception as e:
+            breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
     def _get_singular_response(self, deserializer, endpoint, map_func, ensure_success=True):
         """Get a single response from the remote server."""
 
+        if not self._breaker(endpoint).allow():
+            logging.info(f'Host of {endpoint} is unavailable, skipping.')
+            return
+
         logging.info(f'Getting {endpoint}.')
         try:
-            response = session.get(endpoint, headers={'Authorization':f'Basic {self.auth}'})
+            response = self._call(session.get, endpoint, headers={'Authorization':f'Basic {self.auth}'})
         except Exception as e:
             logging.warning(f'Could not get {endpoint}, skipping.', exc_info=True)
             return
@@ -261,109 +340,326 @@ class BaseQCRequest:
             logging.error('Could not save item.', exc_info=True)
             return
 
-    def _get_list_response(self, deserializer, endpoint, map_func, list_base_func, check_author=[], paginated=True, **kwargs):
-        """Get a response from a remote server that is a list of items."""
+    def _get_page(self, endpoint, page, paginated, state=None):
+        """Get a single page of a list from the remote server. With the sync
+        state of the list, the first page is only sent back if it changed."""
+        params = {'page': page, 'size': self.PAGINATED_SIZE} if paginated else None
+        headers = {'Authorization':f'Basic {self.auth}'}
+
+        if state is None:
+            response = self._call(session.get, endpoint, params=params, headers=headers)
+        else:
+            if page == 1 and state.etag:
+                headers['If-None-Match'] = state.etag
+            if page == 1 and state.last_modified:
+                headers['If-Modified-Since'] = state.last_modified
+            response = self._call(sync_session.get, endpoint, params=params, headers=headers)
+
+        logging.debug('Called endpoint for page ' + str(page) + '.')
+        return response
+
+    def _get_published(self, raw_items, map_func):
+        """Return the publish dates of the items of a page, in page order."""
+        published = []
+        for item in raw_items:
+            try:
+                value = map_func(item).get('published')
+            except Exception as e:
+                continue
+            if isinstance(value, str):
+                value = parse_datetime(value)
+            if isinstance(value, datetime.datetime):
+                published.append(value if timezone.is_aware(value) else timezone.make_aware(value, datetime.timezone.utc))
+        return published
+
+    def _get_list_response(self, deserializer, endpoint, map_func, list_base_func, check_author=[], paginated=True, delta=False, **kwargs):
+        """Get a response from a remote server that is a list of items.
+
+        With delta, only what changed since the last sync of the list is
+        fetched and saved (see SyncState). The first page is asked for with
+        the validators from the last sync, and an unchanged list ends there.
+        Pages whose items are the same as last time are not saved again. A
+        list that is newest first ends at the first page that did not change
+        and has only items older than the newest item seen last time, so
+        edits and deletes of older items are still synced."""
+
+        if not self._breaker(endpoint).allow():
+            logging.info(f'Host of {endpoint} is unavailable, skipping.')
+            return
 
         logging.info(f'Getting {endpoint}')
 
+        state = SyncState.for_resource(self.host_obj, endpoint) if delta else None
+        known_hashes = set(state.page_hashes) if state is not None else set()
+        page_hashes = []
+        newest = None
+        validators = None
+        failed = False
+
         empty = False
         page = 1
 
+        # We don't know how many pages there are, so pages are requested in
+        # windows that double in size while the pages keep coming back full.
+        # The pages of a window are downloaded in parallel and saved in order.
+        # A short page is likely the last, so only one page is asked for next.
+        window = 1
+        full = False
+
         while not empty:
 
-            if paginated:
+            futures = [page_pool.submit(self._get_page, endpoint, page + i, paginated, state) for i in range(window if paginated else 1)]
+
+            for future in futures:
+
                 # call api
                 try:
-                    response = session.get(endpoint, params={'page': page, 'size': self.PAGINATED_SIZE}, headers={'Authorization':f'Basic {self.auth}'})
-                    logging.debug('Called endpoint for page ' + str(page) + '.')
+                    response = future.result()
                 except Exception as e:
                     logging.warning(f'Could not connect to {endpoint}, skipping.')
+                    empty = failed = True
                     break
 
+                if state is not None and page == 1:
+                    if response.status_code == 304:
+                        logging.info(f'{endpoint} did not change since the last sync.')
+                        state.last_synced = timezone.now()
+                        state.save()
+                        return
+                    headers = getattr(response, 'headers', {})
+                    validators = (headers.get('ETag'), headers.get('Last-Modified'))
+
                 # check response code
                 if response.status_code != 200:
-                    logging.info('Response code was not 200. Assuming empty and ending loop.')
+                    if paginated:
+                        logging.info('Response code was not 200. Assuming empty and ending loop.')
+                    else:
+                        logging.info('Response code was not 200. This endpoint is not paginated so some error occured.')
                     empty = True
+                    failed = failed or page == 1
                     break
-            else:
-                response = session.get(endpoint, headers={'Authorization':f'Basic {self.auth}'})
-                empty = True
 
-                # check response code
-                if response.status_code != 200:
-                    logging.info('Response code was not 200. This endpoint is not paginated so some error occured.')
+                try:
+                    json_response = response.json()
+                except Exception as e:
+                    logging.error('Could not parse response as JSON.', exc_info=True)
+                    empty = failed = True
+                    break
+
+                # loop though authors
+                try:
+                    current_raw_items = list_base_func(json_response)
+                except Exception as e:
+                    logging.error('Could not get list of authors from JSON response.', exc_info=True)
+                    empty = failed = True
                     break
 
-                logging.debug('Called endpoint for page ' + str(page) + '.')
+                if len(current_raw_items) == 0:
+                    logging.info('No more authors. Ending loop.')
+                    empty = True
+                    break
 
-            try:
-                json_response = response.json()
-            except Exception as e:
-                logging.error('Could not parse response as JSON.', exc_info=True)
-                empty = True
-                break
+                logging.info('Got ' + str(len(current_raw_items)) + ' items on page ' + str(page) + '.')
+
+                full = len(current_raw_items) >= self.PAGINATED_SIZE
+
+                if state is None:
+                    self._save_list_items(current_raw_items, deserializer, map_func, check_author, page, **kwargs)
+                    page += 1
+                    continue
+
+                page_hash = hashlib.sha256(json.dumps(current_raw_items, sort_keys=True).encode('utf-8')).hexdigest()
+                # new items push the others down the list, so a page counts as
+                # unchanged if it was any page of the list last time
+                unchanged = page_hash in known_hashes
+                page_hashes.append(page_hash)
+
+                if unchanged:
+                    logging.info(f'Page {page} did not change since the last sync, not saving it.')
+                elif not self._save_list_items(current_raw_items, deserializer, map_func, check_author, page, **kwargs):
+                    # the sync is not recorded, so the page is saved again
+                    # next time
+                    failed = True
+
+                published = self._get_published(current_raw_items, map_func)
+                if published:
+                    newest = max([newest] + published) if newest else max(published)
+                newest_first = published == sorted(published, reverse=True)
+                known = state.last_published is not None and published and max(published) <= state.last_published
+                page += 1
+
+                # a short page is the last one, and the rest of a list that is
+                # newest first was seen last time, unless this page changed
+                if unchanged and (not full or (newest_first and known)):
+                    logging.info(f'Reached items of {endpoint} from the last sync. Ending loop.')
+                    empty = True
+                    break
 
-            # loop though authors
-            try:
-                current_raw_items = list_base_func(json_response)
-            except Exception as e:
-                logging.error('Could not get list of authors from JSON response.', exc_info=True)
-                empty = True
-                break
+            # pages past the end of the list are not needed
+            for future in futures:
+                future.cancel()
 
-            if len(current_raw_items) == 0:
-                logging.info('No more authors. Ending loop.')
+            if not paginated:
                 empty = True
-                break
-
-            logging.info('Got ' + str(len(current_raw_items)) + ' items on page ' + str(page) + '.')
 
+            window = min(window * 2, HOST_CONCURRENCY) if full else 1
+
+        # a sync that failed part way is done in full next time
+        if state is not None and not failed:
+            state.etag, state.last_modified = validators or (None, None)
+            state.page_hashes = page_hashes + state.page_hashes[len(page_hashes):]
+            if newest is not None and (state.last_published is None or newest > state.last_published):
+                state.last_published = newest
+            state.last_synced = timezone.now()
+            state.save()
+
+    def _save_list_items(self, current_raw_items, deserializer, map_func, check_author, page, **kwargs):
+        """Save the items of a single page of a list. Returns whether every
+        item could be saved."""
+
+        # pages of items that don't embed authors can be saved all at once
+        if not check_author and hasattr(deserializer, 'save_batch'):
+            return self._save_list_items_batch(current_raw_items, deserializer, map_func, page, **kwargs)
+
+        saved = True
+        for item in current_raw_items:
+
+            extra_kwargs = {}
+            for author_item in check_author:
+
+                if author_item == '':
+                    raw_author = item
+                    author_item = 'author'
+                else:
+                    if item.get(author_item, None) is None:
+                        logging.info('Author not in item. Skipping.')
+                        continue
+                    raw_author = item[author_item]
+
+                logging.info('Checking author.')
+                # first get author via the url
+                author = Author.get_from_url(raw_author['url'])
+                # if the author is not local, get the author from the remote server
+                if author is None or not author.is_local:
+                    author = self._return_single_item(raw_author, self.map_raw_author, self.deserializers.author,
+                        )
+                    logging.info('Got author.')
+                    if author is None:
+                        logging.info('Author was not valid. Skipping.')
+                        continue
+                extra_kwargs[author_item] = author
+
+            if self._return_single_item(item, map_func, deserializer, **extra_kwargs, **kwargs) is None:
+                saved = False
+                continue
 
-            for item in current_raw_items:
+            logging.info('Saved item from page ' + str(page) + '.')
 
-                extra_kwargs = {}
-                for author_item in check_author:
+        return saved
 
-                    if author_item == '':
-                        raw_author = item
-                        author_item = 'author'
-                    else:
-                        if item.get(author_item, None) is None:
-                            logging.info('Author not in item. Skipping.')
-                            continue
-                        raw_author = item[author_item]
+    def _save_list_items_batch(self, current_raw_items, deserializer, map_func, page, **kwargs):
+        """Validate every item of a page, then save the valid ones together
+        with the deserializer's save_batch. Returns whether they were saved."""
 
-                    logging.info('Checking author.')
-                    # first get author via the url
-                    author = Author.get_from_url(raw_author['url'])
-                    # if the author is not local, get the author from the remote server
-                    if author is None or not author.is_local:
-                        author = self._return_single_item(raw_author, self.map_raw_author, self.deserializers.author,
-                            )
-                        logging.info('Got author.')
-                        if author is None:
-                            logging.info('Author was not valid. Skipping.')
-                            continue
-                    extra_kwargs[author_item] = author
+        validated_items = []
+        for item in current_raw_items:
+            try:
+                mapped_item = map_func(item)
+            except Exception as e:
+                logging.error('Could not map item.', exc_info=True)
+                continue
 
-                self._return_single_item(item, map_func, deserializer, **extra_kwargs, **kwargs)
+            serialized_item = deserializer(data=mapped_item)
+            if not serialized_item.is_valid():
+                logging.error(f'Could not validate item: {serialized_item.errors}')
+                continue
+            validated_items.append(serialized_item.validated_data)
 
-                logging.info('Saved item from page ' + str(page) + '.')
+        try:
+            saved = deserializer.save_batch(validated_items, **kwargs)
+        except Exception as e:
+            logging.error('Could not save page ' + str(page) + '.', exc_info=True)
+            return False
 
+        logging.info('Saved ' + str(len(saved)) + ' items from page ' + str(page) + '.')
+        return True
 
-            page += 1
+    def _outbound_for_inbox_type(self, inbox_type):
+        """Return the serializer and outbound map used to send an inbox item of
+        the given type."""
+        return {
+            Inbox.InboxType.POST: (self.serializers.post, self.map_outbound_post),
+            Inbox.InboxType.COMMENT: (self.serializers.comment, self.map_outbound_comment),
+            Inbox.InboxType.LIKE: (self.serializers.post_like, self.map_outbound_like),
+            Inbox.InboxType.COMMENTLIKE: (self.serializers.comment_like, self.map_outbound_like),
+            Inbox.InboxType.FOLLOW: (self.serializers.follow, self.map_outbound_follow),
+        }[inbox_type]
+
+    def _serialize_for_inbox(self, item, serializer):
+        """Serialize an item into plain JSON data that can be stored in the
+        outbox and sent later."""
+        serialized_item = serializer(item, context={'request': get_request()})
+        return json.loads(json.dumps(serialized_item.data))
+
+    def serialize_inbox_item(self, inbox_type, item):
+        """Serialize an item of the given inbox type to be queued in the outbox."""
+        serializer, _ = self._outbound_for_inbox_type(inbox_type)
+        return self._serialize_for_inbox(item, serializer)
+
+    def deliver_inbox_item(self, author, inbox_type, data):
+        """Send already serialized data from the outbox to the inbox of an
+        external author."""
+        _, map_func = self._outbound_for_inbox_type(inbox_type)
+        return self._post_to_inbox(author, data, map_func)
+
+    def deliver_to_shared_inbox(self, activities):
+        """Send already serialized data from the outbox to the shared inbox of
+        the host in one request. Each activity is an (authors, inbox_type,
+        data) tuple. Returns the result of each activity, a dict that says
+        whether the host accepted it ('delivered') and, if not, whether
+        sending it again cannot work ('permanent'), or None if the host has
+        no shared inbox. Errors are raised so the outbox can retry them."""
+        endpoint = self.host + self.SHARED_INBOX_ENDPOINT
+        no_shared_inbox_key = 'no-shared-inbox:' + hashlib.sha256(endpoint.encode('utf-8')).hexdigest()
+        if cache.get(no_shared_inbox_key):
+            return None
+        if not self._breaker(endpoint).allow():
+            raise HostUnavailable(f'The host of {endpoint} is unavailable.')
+
+        data = []
+        for authors, inbox_type, item in activities:
+            _, map_func = self._outbound_for_inbox_type(inbox_type)
+            # the host knows its authors by the last part of their url
+            data.append({'authors': [author.external_url.rstrip('/').split('/')[-1] for author in authors], 'item': map_func(item)})
+
+        logging.info(f'Sending {len(data)} activities to {endpoint}.')
+        res = self._call(session.post, endpoint, json=data, headers={'Authorization':f'Basic {self.auth}'},
+            timeout=self.INBOX_TIMEOUT)
+        if res.status_code in (404, 405):
+            cache.set(no_shared_inbox_key, True, self.NO_SHARED_INBOX_TIMEOUT)
+            return None
+        res.raise_for_status()
+        return res.json()['results']
 
     def _send_to_inbox(self, author, item, serializer, map_func):
-        """Send an item to the inbox of an external author."""
+        """Send an item to the inbox of an external author. HostUnavailable is
+        raised if the host is down."""
         logging.info(f'Sending {item} to inbox of {author}.')
+        return self._post_to_inbox(author, self._serialize_for_inbox(item, serializer), map_func)
+
+    def _post_to_inbox(self, author, data, map_func):
+        """Post serialized data to the inbox of an external author. Connection
+        errors are raised so the outbox can retry them, and so is
+        HostUnavailable when the host is down."""
         trail = '/' if self.inbox_trailing_slash else ''
         endpoint = f'{self._clean_url(author.external_url)}{self.INBOX_ENDPOINT}{trail}'
-        serialized_item = serializer(item, context={'request': get_request()})
-        data = map_func(serialized_item.data)
+        if not self._breaker(endpoint).allow():
+            raise HostUnavailable(f'The host of {endpoint} is unavailable.')
+        data = map_func(data)
         json_str = json.dumps(data)
         logging.info(f'Sending {json_str} to {endpoint}.')
-        res = session.post(endpoint, json=data, headers={'Authorization':f'Basic {self.auth}'},
-            )
+        res = self._call(session.post, endpoint, json=data, headers={'Authorization':f'Basic {self.auth}'},
+            timeout=self.INBOX_TIMEOUT)
         try:
             res.raise_for_status()
         except Exception as e:
@@ -418,7 +714,8 @@ class BaseQCRequest:
             self._clean_url(author.external_url) + self.POSTS_ENDPOINT,
             self.map_raw_post, self.map_list_posts,
             author=author,
-            paginated=self.paginate_posts
+            paginated=self.paginate_posts,
+            delta=True
             )
 
     def update_comments(self, post):
@@ -428,7 +725,8 @@ class BaseQCRequest:
             self.map_raw_comment, self.map_list_comments,
             check_author=["author"],
             post=post,
-            paginated=True
+            paginated=True,
+            delta=True
             )
 
     def update_post_likes(self, post):
@@ -464,7 +762,8 @@ class BaseQCRequest:
             self.map_raw_follower, self.map_list_followers,
             check_author=[''],
             following=author,
-            paginated=self.paginate_followers
+            paginated=self.paginate_followers,
+            delta=True
             )
 
     def send_post(self, post, author):
@@ -1083,6 +1382,8 @@ class MattGroupQCRequest(BaseQCRequest):
 
 class InternalQCRequest(BaseQCRequest):
 
+    shared_inbox = True
+
     def map_raw_author(self, external_data):
         return {
             'type': external_data['type'],
@@ -1,18 +1,136 @@
 
 
-import requests_cache
-
-# This caches the requests for 5 minutes, so we don't blow up the GitHub API
-session = requests_cache.CachedSession('github_cache', expire_after=300)
-
-def get_github_stream(github):
-    """Get the stream of a user from GitHub"""
-    # given the url, take the last section as the username
-    
-    username = github.split('/')[-1]
-    url = f'https://api.github.com/users/{username}/events/public'
-    response = session.get(url)
-    return response.json()
+import datetime
+import logging
+import urllib.parse
+import requests
+from dateutil import parser
+from django.utils import timezone
+
+from quickcomm.models import Author, GitHubEvent, GitHubFeed
+
+# GitHub events are ingested by the ingest_github worker and stored in the
+# database, so the stream never waits on GitHub. The worker makes conditional
+# requests, which GitHub answers with 304 Not Modified (and does not count
+# against the rate limit) when the feed did not change.
+session = requests.Session()
+session.headers.update({'Accept': 'application/vnd.github+json'})
+
+GITHUB_TIMEOUT = 10
+
+# How often a feed is polled. GitHub may ask for a longer interval with the
+# X-Poll-Interval header.
+POLL_INTERVAL = datetime.timedelta(minutes=5)
+
+# How long to wait before polling a feed that does not exist again.
+NOT_FOUND_INTERVAL = datetime.timedelta(days=1)
+
+# GitHub only lists the events of the last 90 days, so older ones are dropped.
+RETENTION = datetime.timedelta(days=90)
+
+def get_github_username(github):
+    """Returns the username of a GitHub profile URL, or None if it has none."""
+    if not github:
+        return None
+
+    path = urllib.parse.urlparse(github).path.strip('/')
+    if not path:
+        return None
+    return path.split('/')[0]
+
+def sync_github_feeds():
+    """Makes sure there is a feed for every GitHub user an author links to,
+    and removes the feeds nobody links to anymore."""
+
+    usernames = set()
+    for github in Author.objects.exclude(github=None).values_list('github', flat=True).distinct():
+        username = get_github_username(github)
+        if username is not None:
+            usernames.add(username.lower())
+
+    GitHubFeed.objects.exclude(username__in=usernames).delete()
+    existing = set(GitHubFeed.objects.values_list('username', flat=True))
+    GitHubFeed.objects.bulk_create([GitHubFeed(username=username) for username in usernames - existing])
+
+def parse_github_event(feed, raw_event):
+    """Returns the GitHubEvent for an event from the GitHub API."""
+    return GitHubEvent(
+        id=str(raw_event['id']),
+        feed=feed,
+        type=raw_event['type'],
+        actor_login=raw_event['actor']['login'],
+        actor_avatar_url=raw_event['actor'].get('avatar_url'),
+        message=get_github_message(raw_event),
+        url=get_github_url(raw_event),
+        created=parser.parse(raw_event['created_at']),
+    )
+
+def ingest_github_feed(feed):
+    """Polls a GitHub feed and stores the events that are new. Returns the
+    number of events that were stored."""
+
+    headers = {}
+    if feed.etag:
+        headers['If-None-Match'] = feed.etag
+    if feed.last_modified:
+        headers['If-Modified-Since'] = feed.last_modified
+
+    now = timezone.now()
+    feed.last_polled = now
+    feed.next_poll = now + POLL_INTERVAL
+
+    try:
+        response = session.get(f'https://api.github.com/users/{feed.username}/events/public', headers=headers, timeout=GITHUB_TIMEOUT)
+    except Exception as e:
+        logging.warning(f'Could not poll {feed}.', exc_info=True)
+        feed.last_error = str(e)
+        feed.save()
+        return 0
+
+    try:
+        poll_interval = datetime.timedelta(seconds=int(response.headers.get('X-Poll-Interval', 0)))
+        feed.next_poll = now + max(POLL_INTERVAL, poll_interval)
+    except ValueError:
+        pass
+
+    if response.status_code == 304:
+        feed.last_error = None
+        feed.save()
+        return 0
+
+    if response.status_code != 200:
+        feed.last_error = f'GitHub responded with {response.status_code}'
+        if response.status_code == 404:
+            feed.next_poll = now + NOT_FOUND_INTERVAL
+        feed.save()
+        return 0
+
+    events = []
+    for raw_event in response.json():
+        try:
+            events.append(parse_github_event(feed, raw_event))
+        except Exception as e:
+            logging.warning(f'Could not parse a GitHub event of {feed}.', exc_info=True)
+
+    # events we already have are left alone
+    GitHubEvent.objects.bulk_create(events, ignore_conflicts=True)
+
+    feed.etag = response.headers.get('ETag')
+    feed.last_modified = response.headers.get('Last-Modified')
+    feed.last_error = None
+    feed.save()
+    return len(events)
+
+def ingest_due_github_feeds():
+    """Polls every GitHub feed that is due, and drops the events that GitHub
+    no longer lists. Returns the number of feeds that were polled."""
+
+    feeds = list(GitHubFeed.objects.filter(next_poll__lte=timezone.now()))
+    for feed in feeds:
+        ingest_github_feed(feed)
+
+    GitHubEvent.objects.filter(created__lt=timezone.now() - RETENTION).delete()
+    return len(feeds)
 
 def get_github_message(stream):
     """Get the message from the GitHub event"""
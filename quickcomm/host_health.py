@@ -0,0 +1,166 @@
+# This file keeps track of which remote hosts are up. Every host has a circuit
+# breaker, which is fed by the calls made to the host and by a health probe
+# of its API root that the sync_scheduler worker runs in the background.
+#
+# The breaker of a host starts closed, and calls go through. After
+# FAILURE_THRESHOLD calls in a row fail, it opens, and calls to the host are
+# skipped without touching the network. After OPEN_TIMEOUT, it is half-open:
+# a single trial call (or the next probe) is let through, which closes the
+# breaker if it works and opens it again if it does not.
+#
+# The breakers live in each process, but changes of state are written to the
+# host, and a process that loads a host with a newer state takes it on. This
+# way the web workers and the other workers skip a host the probe found down.
+
+import datetime
+import logging
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.db import connection
+from django.utils import timezone
+
+from quickcomm.models import Host
+
+FAILURE_THRESHOLD = 5
+OPEN_TIMEOUT = datetime.timedelta(seconds=60)
+
+# Seconds to wait on the API root of a host before it counts as down.
+PROBE_TIMEOUT = 5
+
+# The number of hosts that are probed at the same time.
+PROBE_WORKERS = 8
+
+# The probe goes around the cache and the retries of the other sessions, so
+# it sees the host as it is right now.
+probe_session = requests.Session()
+probe_pool = ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix='quickcomm-probe')
+
+
+class HostUnavailable(Exception):
+    """Raised when a call to a host is skipped because its breaker is open."""
+
+
+class CircuitBreaker:
+    """The circuit breaker of a single host."""
+
+    def __init__(self, host=None):
+        self.lock = threading.Lock()
+        self.host_id = host.pk if host is not None else None
+        self.state = Host.CircuitState.CLOSED
+        self.changed = None
+        self.failures = 0
+        self.trial_started = None
+        if host is not None:
+            self.load(host)
+
+    def load(self, host):
+        """Takes on the state written to the host if it is newer than ours."""
+        with self.lock:
+            if host.circuit_changed is not None and (self.changed is None or host.circuit_changed > self.changed):
+                self.state = host.circuit_state
+                self.changed = host.circuit_changed
+                self.failures = 0
+
+    def allow(self):
+        """Returns true if a call to the host should be made."""
+        with self.lock:
+            if self.state == Host.CircuitState.CLOSED:
+                return True
+
+            now = timezone.now()
+            if self.state == Host.CircuitState.OPEN:
+                if now - self.changed < OPEN_TIMEOUT:
+                    return False
+                self._set_state(Host.CircuitState.HALF_OPEN, now)
+
+            # only one trial call at a time, unless the last one never ended
+            if self.trial_started is None or now - self.trial_started >= OPEN_TIMEOUT:
+                self.trial_started = now
+                return True
+            return False
+
+    def retry_at(self):
+        """Returns when calls to the host are let through again."""
+        with self.lock:
+            if self.state != Host.CircuitState.OPEN:
+                return timezone.now()
+            return self.changed + OPEN_TIMEOUT
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.trial_started = None
+            if self.state != Host.CircuitState.CLOSED:
+                self._set_state(Host.CircuitState.CLOSED)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_started = None
+            if self.state == Host.CircuitState.HALF_OPEN or (self.state == Host.CircuitState.CLOSED and self.failures >= FAILURE_THRESHOLD):
+                self._set_state(Host.CircuitState.OPEN)
+
+    def _set_state(self, state, now=None):
+        self.state = state
+        self.changed = now or timezone.now()
+        logging.info(f'Circuit of host {self.host_id} is now {state}.')
+        if self.host_id is not None:
+            Host.objects.filter(pk=self.host_id).update(circuit_state=state, circuit_changed=self.changed)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(host=None, url=None):
+    """Returns the circuit breaker of a host. Without a host, the breaker is
+    that of the domain of the url."""
+    key = host.pk if host is not None else urllib.parse.urlsplit(url).netloc
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(host)
+            return breaker
+    if host is not None:
+        breaker.load(host)
+    return breaker
+
+def probe_host(host):
+    """Calls the API root of a host, and records whether it answered and how
+    long it took. Returns True if the host is up. Any answer that is not a
+    server error counts as up, since the root may well be a 404."""
+    headers = {'Authorization': f'Basic {host.username_password_base64}'} if host.username_password_base64 else {}
+    start = time.monotonic()
+    try:
+        response = probe_session.get(host.url, headers=headers, timeout=PROBE_TIMEOUT)
+        success = response.status_code < 500
+    except Exception as e:
+        logging.warning(f'Could not probe {host}.', exc_info=True)
+        success = False
+    latency = (time.monotonic() - start) * 1000
+
+    breaker = get_breaker(host)
+    if success:
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+
+    host.record_ping(success, latency if success else None)
+    host.circuit_state = breaker.state
+    host.circuit_changed = breaker.changed
+    return success
+
+def probe_hosts(hosts):
+    """Probes the given hosts in parallel. Returns the number that are up."""
+
+    def task(host):
+        try:
+            return probe_host(host)
+        finally:
+            # every thread has its own database connection
+            connection.close()
+
+    return sum(probe_pool.map(task, list(hosts)))
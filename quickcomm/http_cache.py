@@ -0,0 +1,270 @@
+# This file contains the cache of GET requests to remote hosts. It has two
+# tiers: an LRU in the memory of each process, bounded by the size of the
+# responses in it, over an optional disk tier (the 'http' cache in settings)
+# that the processes on the same machine share. Responses are written to the
+# disk tier only when they are fetched, never when they are served.
+#
+# How long a response is fresh depends on the kind of list or object it is
+# (see ENDPOINT_TTLS), unless the peer says otherwise with Cache-Control.
+# Stale responses are kept for a while, and asked for again with the ETag or
+# Last-Modified they came with, so a peer can answer with 304 Not Modified.
+#
+# Requests that carry their own validators (like delta syncs) are passed
+# through untouched, so the caller sees the peer's answer.
+#
+# The counters of how requests were answered are kept by each process. Every
+# process publishes them to the shared 'api' cache now and then, and the
+# http_cache_stats command shows those of every process (web workers and
+# workers alike) and their total.
+
+import hashlib
+import logging
+import os
+import re
+import socket
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# Seconds a response stays fresh, by the last known segment of its path. An
+# author is at /authors/<id>, and the comments of a post at
+# /authors/<id>/posts/<id>/comments.
+ENDPOINT_TTLS = {
+    'authors': 300,
+    'followers': 120,
+    'posts': 60,
+    'comments': 60,
+    'likes': 30,
+    'liked': 30,
+}
+DEFAULT_TTL = 30
+
+# Peers may not ask for longer than this.
+MAX_TTL = 60 * 60
+
+# How long a stale response with validators is kept to revalidate it.
+STALE_TTL = 24 * 60 * 60
+
+# The bound on the size of the bodies in the memory tier of each process.
+# Larger responses only go to the disk tier.
+MEMORY_BYTES = 32 * 1024 * 1024
+MAX_MEMORY_ENTRY_BYTES = 2 * 1024 * 1024
+
+# How often a process publishes its counters, and how long they are kept
+# after it stops, in seconds.
+STATS_INTERVAL = 60
+STATS_TIMEOUT = 60 * 60
+
+# The key of the published counters in the shared cache. Two processes that
+# publish at the same time can drop one another's counters until they
+# publish again.
+STATS_KEY = 'http-cache-stats'
+
+_max_age = re.compile(r'max-age=(\d+)')
+
+
+def get_ttl(url, headers):
+    """Returns the number of seconds the response of a url is fresh for, or
+    None if it must not be stored."""
+    cache_control = headers.get('Cache-Control', '').lower()
+    if 'no-store' in cache_control:
+        return None
+    if 'no-cache' in cache_control:
+        return 0
+    max_age = _max_age.search(cache_control)
+    if max_age:
+        return min(int(max_age.group(1)), MAX_TTL)
+
+    for segment in reversed(urllib.parse.urlsplit(url).path.strip('/').split('/')):
+        if segment in ENDPOINT_TTLS:
+            return ENDPOINT_TTLS[segment]
+    return DEFAULT_TTL
+
+
+class HTTPCache:
+    """The two tiers of the cache, with counters of how requests were
+    answered. It is safe to use from many threads."""
+
+    def __init__(self, disk=None, memory_bytes=MEMORY_BYTES, shared=None):
+        self.disk = disk
+        self.memory_bytes = memory_bytes
+        self.shared = shared
+        self.reset()
+
+    def reset(self):
+        """Empties the memory tier and the counters. This is also done in
+        forked processes, which must not share the lock of their parent."""
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.size = 0
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'revalidated': 0, 'misses': 0, 'stored': 0, 'bypassed': 0}
+        self.next_publish = 0
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+            publish = self.shared is not None and time.monotonic() >= self.next_publish
+            if publish:
+                self.next_publish = time.monotonic() + STATS_INTERVAL
+        if publish:
+            self.publish_stats()
+
+    def stats(self):
+        """Returns the counters and the size of the memory tier."""
+        with self.lock:
+            return dict(self.counters, memory_entries=len(self.memory), memory_bytes=self.size)
+
+    def publish_stats(self):
+        """Writes the stats of this process to the shared cache, next to those
+        of the other processes."""
+        now = time.time()
+        try:
+            published = self.shared.get(STATS_KEY) or {}
+            published = {process: stats for process, stats in published.items() if stats['published'] > now - STATS_TIMEOUT}
+            published[f'{socket.gethostname()}:{os.getpid()}'] = dict(self.stats(), published=now)
+            self.shared.set(STATS_KEY, published, STATS_TIMEOUT)
+        except Exception:
+            logging.warning('Could not publish the HTTP cache stats.', exc_info=True)
+
+    def get(self, key):
+        """Returns the entry of a key and the tier it came from. An entry of
+        the memory tier that is stale is looked up in the disk tier too, as
+        another process may have fetched it again since."""
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+        if entry is not None and (entry['expires'] > time.time() or self.disk is None):
+            return entry, 'memory'
+
+        if self.disk is None:
+            return None, None
+        try:
+            disk_entry = self.disk.get(key)
+        except Exception:
+            logging.warning('Could not read the HTTP cache.', exc_info=True)
+            disk_entry = None
+        if disk_entry is not None and (entry is None or disk_entry['expires'] > entry['expires']):
+            self._remember(key, disk_entry)
+            return disk_entry, 'disk'
+        if entry is not None:
+            return entry, 'memory'
+        return None, None
+
+    def set(self, key, entry):
+        self._remember(key, entry)
+        if self.disk is not None:
+            keep = entry['expires'] - time.time()
+            if entry['etag'] or entry['last_modified']:
+                keep += STALE_TTL
+            try:
+                self.disk.set(key, entry, max(1, int(keep)))
+            except Exception:
+                logging.warning('Could not write the HTTP cache.', exc_info=True)
+        self.count('stored')
+
+    def _remember(self, key, entry):
+        """Puts an entry in the memory tier, dropping the least recently used
+        entries to stay in its bound."""
+        size = len(entry['content'])
+        if size > MAX_MEMORY_ENTRY_BYTES:
+            return
+        with self.lock:
+            old = self.memory.pop(key, None)
+            if old is not None:
+                self.size -= len(old['content'])
+            self.memory[key] = entry
+            self.size += size
+            while self.size > self.memory_bytes:
+                _, dropped = self.memory.popitem(last=False)
+                self.size -= len(dropped['content'])
+
+
+class CachedSession(requests.Session):
+    """A session that answers GET requests from an HTTPCache."""
+
+    def __init__(self, cache):
+        super().__init__()
+        self.cache = cache
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET' or 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers:
+            self.cache.count('bypassed')
+            return super().send(request, **kwargs)
+
+        # the same url can be fetched with the credentials of different hosts
+        auth = hashlib.sha256(request.headers.get('Authorization', '').encode('utf-8')).hexdigest()
+        key = 'http:' + hashlib.sha256(f'{request.url} {auth}'.encode('utf-8')).hexdigest()
+
+        entry, tier = self.cache.get(key)
+        if entry is not None and entry['expires'] > time.time():
+            self.cache.count(f'{tier}_hits')
+            return self._build_response(request, entry)
+
+        if entry is not None:
+            if entry['etag']:
+                request.headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                request.headers['If-Modified-Since'] = entry['last_modified']
+
+        response = super().send(request, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            self.cache.count('revalidated')
+            ttl = get_ttl(request.url, response.headers)
+            if ttl is not None:
+                self.cache.set(key, dict(entry, expires=time.time() + ttl))
+            return self._build_response(request, entry)
+
+        self.cache.count('misses')
+        if response.status_code == 200:
+            ttl = get_ttl(request.url, response.headers)
+            if ttl is not None:
+                self.cache.set(key, {
+                    'url': response.url,
+                    'headers': dict(response.headers),
+                    'content': response.content,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'expires': time.time() + ttl,
+                })
+        return response
+
+    def _build_response(self, request, entry):
+        """Returns a response for a cached entry."""
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = entry['url']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = entry['content']
+        response.request = request
+        response.from_cache = True
+        return response
+
+
+def get_disk_tier():
+    """Returns the disk tier from the 'http' cache in settings, if there is
+    one."""
+    if 'http' not in settings.CACHES:
+        return None
+    return caches['http']
+
+
+def get_published_stats():
+    """Returns the stats that the processes published, by process."""
+    return caches['api'].get(STATS_KEY) or {}
+
+
+http_cache = HTTPCache(get_disk_tier(), shared=caches['api'])
+
+# the lock of a parent could be held by another of its threads when it forks
+os.register_at_fork(after_in_child=http_cache.reset)
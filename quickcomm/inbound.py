@@ -0,0 +1,217 @@
+# This file imports the items that remote hosts send to the inboxes of local
+# authors. The inbox endpoints only write what they are sent to the journal
+# (see RawInboxItem) and answer 202 Accepted, so a burst from a busy peer does
+# not hold the web workers. The process_inbox worker then imports the items in
+# the order they came in, retrying the ones that fail with backoff. An item
+# sent to the shared inbox is imported once for all of its target authors.
+#
+# Peers often send the same activity more than once. Every activity is hashed
+# (see get_activity_key) when it comes in, and one that was already imported
+# for the same author, or is waiting in the journal, is dropped before
+# anything is written. Items of the shared inbox only drop the authors that
+# already imported them; copies that wait in the journal together are sorted
+# out when they are imported. Hashes are only remembered once the import
+# works, so a peer can send again an activity that failed.
+
+import hashlib
+import json
+import logging
+import uuid
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import exceptions
+
+# The fields of an activity that make up its content. Fields like the
+# publish date or the profile image of the actor can change between two
+# deliveries of the same activity, so they are left out.
+CONTENT_FIELDS = ('title', 'description', 'content', 'contentType', 'visibility', 'unlisted', 'categories', 'comment')
+
+
+def get_activity_key(data, author_id):
+    """Returns the hash of an activity sent to the inbox of the given author:
+    its type, the urls of its actor, itself and its object, and its content.
+    Returns None if the activity has no type, or is a follow, which can be
+    sent again after it was declined."""
+
+    # import here to avoid circular imports
+    from quickcomm.models import normalize_external_url
+
+    def url_of(value):
+        if isinstance(value, dict):
+            value = value.get('url') or value.get('id')
+        return normalize_external_url(value) if isinstance(value, str) else None
+
+    if not isinstance(data, dict) or not isinstance(data.get('type'), str) or data['type'].lower() == 'follow':
+        return None
+
+    activity = [
+        str(author_id),
+        data['type'].lower(),
+        url_of(data.get('actor') or data.get('author')),
+        url_of(data.get('id')),
+        url_of(data.get('object')),
+        {field: data[field] for field in CONTENT_FIELDS if field in data},
+    ]
+    return hashlib.sha256(json.dumps(activity, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def get_new_activity_keys(keys):
+    """Returns the keys among the given ones that were not received in the
+    last ReceivedActivity.TTL."""
+
+    # import here to avoid circular imports
+    from quickcomm.models import ReceivedActivity
+
+    seen = ReceivedActivity.objects.filter(key__in=keys, received__gte=timezone.now() - ReceivedActivity.TTL).values_list('key', flat=True)
+    return set(keys) - set(seen)
+
+
+def is_duplicate_activity(key):
+    """Returns true if the activity with the given key was already imported,
+    or is in the journal waiting to be."""
+
+    # import here to avoid circular imports
+    from quickcomm.models import RawInboxItem
+
+    if key is None:
+        return False
+    if not get_new_activity_keys([key]):
+        return True
+    return RawInboxItem.objects.filter(key=key, status=RawInboxItem.RawInboxStatus.PENDING).exists()
+
+
+def remember_activity_keys(keys):
+    """Records that the activities with the given keys were received now."""
+
+    # import here to avoid circular imports
+    from quickcomm.models import ReceivedActivity
+
+    now = timezone.now()
+    ReceivedActivity.objects.bulk_create([ReceivedActivity(key=key, received=now) for key in keys],
+        update_conflicts=True, unique_fields=['key'], update_fields=['received'])
+
+
+def forget_old_activity_keys():
+    """Deletes the keys of activities received longer than the TTL ago.
+    Returns the number of keys deleted."""
+
+    # import here to avoid circular imports
+    from quickcomm.models import ReceivedActivity
+
+    deleted, _ = ReceivedActivity.objects.filter(received__lt=timezone.now() - ReceivedActivity.TTL).delete()
+    return deleted
+
+
+def get_shared_inbox_targets(ids):
+    """Returns the local authors with the given ids, in order. Ids that are
+    not valid or not of a local author are skipped."""
+
+    # import here to avoid circular imports
+    from quickcomm.models import Author
+
+    valid_ids = []
+    for id in ids:
+        try:
+            valid_ids.append(uuid.UUID(str(id)))
+        except ValueError:
+            pass
+
+    authors = Author.objects.filter(external_url=None).in_bulk(valid_ids)
+    return [authors[id] for id in valid_ids if id in authors]
+
+
+def import_raw_inbox_item(item):
+    """Import a journaled inbox item into the inbox of its author, or of all
+    of its targets if it was sent to the shared inbox, the same way the inbox
+    endpoints used to before they answered."""
+
+    # import here to avoid circular imports
+    from quickcomm.external_host_deserializers import import_http_inbox_item
+    from quickcomm.models import Host, Inbox
+
+    if item.targets is not None:
+        authors = get_shared_inbox_targets(item.targets)
+    else:
+        authors = [item.author] if item.author is not None else []
+    if not authors:
+        raise exceptions.NotFound('Author not found')
+
+    # a copy of a shared inbox item may have been imported while this one
+    # waited, so the authors that already got it are dropped
+    keys = {author: get_activity_key(item.data, author.id) for author in authors}
+    if item.targets is not None and None not in keys.values():
+        new = get_new_activity_keys(list(keys.values()))
+        authors = [author for author in authors if keys[author] in new]
+        if not authors:
+            return
+
+    host = None
+    if item.origin is not None:
+        host = Host.objects.filter(url=item.origin).first()
+        if host is None:
+            logging.warning(f'No host found for origin header {item.origin}, using default')
+
+    with transaction.atomic():
+        obj, inbox_type = import_http_inbox_item(authors[0], item.data, host)
+        if inbox_type != Inbox.InboxType.FOLLOW:
+            Inbox.fan_out(obj, authors, inbox_type)
+        remember_activity_keys([keys[author] for author in authors if keys[author] is not None])
+
+
+def process_pending_inbox_items(limit=100):
+    """Claim up to limit journaled inbox items that are due and import them,
+    oldest first. Returns the number of items that were claimed."""
+
+    # import here to avoid circular imports
+    from quickcomm.models import RawInboxItem
+
+    now = timezone.now()
+
+    # Claim a batch by pushing its next attempt past the lease. Rows another
+    # worker has locked are skipped, so two workers never import the same item.
+    with transaction.atomic():
+        items = list(RawInboxItem.objects.select_for_update(skip_locked=True, of=('self',))
+                     .select_related('author')
+                     .filter(direction=RawInboxItem.RawInboxDirection.IN, status=RawInboxItem.RawInboxStatus.PENDING, next_attempt__lte=now)
+                     .order_by('received')[:limit])
+        RawInboxItem.objects.filter(id__in=[item.id for item in items]).update(next_attempt=now + RawInboxItem.LEASE)
+
+    for item in items:
+        try:
+            import_raw_inbox_item(item)
+        except (exceptions.APIException, KeyError, TypeError, AttributeError) as e:
+            # the item is not valid, and will not be by trying again
+            logging.warning(f'Could not import {item}.', exc_info=True)
+            item.mark_failed(str(e), retry=False)
+            continue
+        except Exception as e:
+            logging.error(f'Could not import {item}.', exc_info=True)
+            item.mark_failed(str(e))
+            continue
+
+        item.mark_done()
+
+    return len(items)
+
+
+def delete_old_inbox_items():
+    """Deletes the journaled inbox items that were imported longer than
+    RawInboxItem.RETENTION ago. Returns the number of items deleted."""
+
+    # import here to avoid circular imports
+    from quickcomm.models import RawInboxItem
+
+    deleted, _ = RawInboxItem.objects.filter(direction=RawInboxItem.RawInboxDirection.IN, status=RawInboxItem.RawInboxStatus.DONE,
+                                             processed__lt=timezone.now() - RawInboxItem.RETENTION).delete()
+    return deleted
+
+
+def replay_inbox_items(queryset):
+    """Queue failed inbox items to be imported again. Returns the number of
+    items that were queued."""
+
+    # import here to avoid circular imports
+    from quickcomm.models import RawInboxItem
+
+    return queryset.filter(status=RawInboxItem.RawInboxStatus.FAILED).update(
+        status=RawInboxItem.RawInboxStatus.PENDING, attempts=0, next_attempt=timezone.now())
@@ -0,0 +1,64 @@
+import base64
+import io
+import os
+import timeit
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from quickcomm import renderers
+from quickcomm.renderers import FastJSONParser, FastJSONRenderer
+from quickcomm.serializers import PostSerializer
+
+# This command compares how long DRF's JSON renderer and parser take on a page
+# of posts against the ones in quickcomm/renderers.py. The page is built from
+# the post example in the API docs, with an image in every few posts, so it
+# looks like the pages peers pull from us. Nothing is read from the database.
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the API JSON renderer and parser on a page of posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100, help='The number of posts on the page.')
+        parser.add_argument('--image-every', type=int, default=5, help='Put an image in every this many posts (0 for none).')
+        parser.add_argument('--image-size', type=int, default=64 * 1024, help='The size of each image in bytes.')
+        parser.add_argument('--repeat', type=int, default=50, help='How many times to render and parse the page.')
+
+    def handle(self, *args, **options):
+        page = self.make_page(options['posts'], options['image_every'], options['image_size'])
+        body = JSONRenderer().render(page)
+        repeat = options['repeat']
+
+        if renderers.orjson is None:
+            self.stdout.write('orjson is not installed, so both use the standard library.')
+        self.stdout.write(f'Page of {options["posts"]} posts, {len(body) / 1024:.0f} KiB, {repeat} runs each:')
+
+        runs = [
+            ('render', 'DRF', lambda: JSONRenderer().render(page)),
+            ('render', 'fast', lambda: FastJSONRenderer().render(page)),
+            ('parse', 'DRF', lambda: JSONParser().parse(io.BytesIO(body))),
+            ('parse', 'fast', lambda: FastJSONParser().parse(io.BytesIO(body))),
+        ]
+        for action, name, run in runs:
+            seconds = timeit.timeit(run, number=repeat) / repeat
+            self.stdout.write(f'  {action:<6} {name:<4} {seconds * 1000:8.2f} ms')
+
+    def make_page(self, posts, image_every, image_size):
+        """Returns a page of posts shaped like the posts endpoint returns."""
+        image = base64.b64encode(os.urandom(image_size)).decode('ascii')
+
+        items = []
+        for i in range(posts):
+            post = PostSerializer.get_examples()
+            post['id'] = post['url'] = post['id'].replace('eb5901f2-b85b-4656-8940-c85dedab7b91', str(uuid.uuid4()))
+            post['published'] = timezone.now()
+            if image_every and i % image_every == 0:
+                post['contentType'] = 'image/png;base64'
+                post['content'] = image
+            items.append(post)
+
+        return {'type': 'posts', 'page': 1, 'size': posts, 'items': items}
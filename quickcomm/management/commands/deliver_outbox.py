@@ -0,0 +1,32 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from quickcomm.signals import deliver_pending_outbox_items
+
+# This command runs the outbox worker. It delivers inbox items for remote
+# authors that were queued when they were saved, retrying failed deliveries
+# with backoff. It is run as its own process, next to the web workers.
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued inbox items to the inboxes of remote authors.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Deliver one batch and exit instead of running forever.')
+        parser.add_argument('--batch-size', type=int, default=200, help='The number of items to claim at a time.')
+        parser.add_argument('--interval', type=float, default=5.0, help='The number of seconds to wait when there is nothing to deliver.')
+
+    def handle(self, *args, **options):
+        while True:
+            claimed = deliver_pending_outbox_items(options['batch_size'])
+            if claimed:
+                logging.info(f'Processed {claimed} outbox items.')
+
+            if options['once']:
+                break
+
+            # only sleep when the queue is drained, otherwise keep going
+            if claimed < options['batch_size']:
+                time.sleep(options['interval'])
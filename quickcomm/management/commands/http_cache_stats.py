@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from quickcomm.http_cache import get_published_stats
+
+# This command shows how the requests to remote hosts were answered by the
+# HTTP cache (see http_cache), in every process that published its counters,
+# and the total over all of them.
+
+
+class Command(BaseCommand):
+    help = 'Show the counters of the HTTP cache of every process.'
+
+    def handle(self, *args, **options):
+        published = get_published_stats()
+        if not published:
+            self.stdout.write('No process published HTTP cache stats.')
+            return
+
+        total = {}
+        for process, stats in sorted(published.items()):
+            counters = {name: value for name, value in stats.items() if name != 'published'}
+            self.stdout.write(f'{process}: {counters}')
+            for name, value in counters.items():
+                total[name] = total.get(name, 0) + value
+        self.stdout.write(f'Total: {total}')
@@ -0,0 +1,31 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from quickcomm.external_requests import ingest_due_github_feeds, sync_github_feeds
+
+# This command runs the GitHub worker. It polls the public event feeds of the
+# GitHub users that authors link to and stores their events, so the stream can
+# show them without calling GitHub. It is run as its own process, next to the
+# web workers.
+
+
+class Command(BaseCommand):
+    help = 'Ingest the public GitHub events of the authors.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Poll the due feeds once and exit instead of running forever.')
+        parser.add_argument('--interval', type=float, default=30.0, help='The number of seconds to wait between checks for due feeds.')
+
+    def handle(self, *args, **options):
+        while True:
+            sync_github_feeds()
+            polled = ingest_due_github_feeds()
+            if polled:
+                logging.info(f'Polled {polled} GitHub feeds.')
+
+            if options['once']:
+                break
+
+            time.sleep(options['interval'])
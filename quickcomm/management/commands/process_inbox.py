@@ -0,0 +1,59 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from quickcomm.inbound import delete_old_inbox_items, forget_old_activity_keys, process_pending_inbox_items
+
+# This command runs the inbox worker. It imports the items remote hosts sent
+# to the inboxes of local authors, which the inbox endpoint only writes to the
+# journal, retrying failed imports with backoff. It also forgets the hashes of
+# activities that were received long enough ago, and deletes the items of the
+# journal that were imported long enough ago. It is run as its own process,
+# next to the web workers.
+
+# The number of seconds between deletions of old activity hashes and items.
+FORGET_INTERVAL = 60 * 60
+
+
+class Command(BaseCommand):
+    help = 'Import the items remote hosts sent to the inboxes of local authors.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Import one batch and exit instead of running forever.')
+        parser.add_argument('--batch-size', type=int, default=100, help='The number of items each worker claims at a time.')
+        parser.add_argument('--workers', type=int, default=1, help='The number of batches imported at the same time.')
+        parser.add_argument('--interval', type=float, default=1.0, help='The number of seconds to wait when there is nothing to import.')
+
+    def handle(self, *args, **options):
+        def work():
+            try:
+                return process_pending_inbox_items(options['batch_size'])
+            finally:
+                # every thread has its own database connection
+                connection.close()
+
+        last_forget = None
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='quickcomm-inbox') as pool:
+            while True:
+                if last_forget is None or time.monotonic() - last_forget >= FORGET_INTERVAL:
+                    last_forget = time.monotonic()
+                    forgotten = forget_old_activity_keys()
+                    if forgotten:
+                        logging.info(f'Forgot {forgotten} received activities.')
+                    deleted = delete_old_inbox_items()
+                    if deleted:
+                        logging.info(f'Deleted {deleted} imported inbox items.')
+
+                claimed = sum(pool.map(lambda _: work(), range(options['workers'])))
+                if claimed:
+                    logging.info(f'Imported {claimed} inbox items.')
+
+                if options['once']:
+                    break
+
+                # only sleep when the journal is drained, otherwise keep going
+                if claimed < options['batch_size'] * options['workers']:
+                    time.sleep(options['interval'])
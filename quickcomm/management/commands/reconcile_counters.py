@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from quickcomm.models import reconcile_counters
+
+# This command recounts the follower, like and comment counters from the rows
+# they count, in case any of them drifted (for example after rows were changed
+# by hand in the database).
+
+
+class Command(BaseCommand):
+    help = 'Recount the follower, like and comment counters.'
+
+    def handle(self, *args, **options):
+        fixed = reconcile_counters()
+        self.stdout.write(f'Fixed {fixed} counters.')
@@ -0,0 +1,39 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from quickcomm.inbound import process_pending_inbox_items, replay_inbox_items
+from quickcomm.models import RawInboxItem
+
+# This command queues inbox items that could not be imported to be imported
+# again, for instance after a bug in an import was fixed. The process_inbox
+# worker picks them up, or they can be imported right away with --now.
+
+
+class Command(BaseCommand):
+    help = 'Import failed inbox items again.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', help='The ids of the items to replay. All failed items if none are given.')
+        parser.add_argument('--origin', help='Only replay the items sent from this Origin.')
+        parser.add_argument('--hours', type=float, help='Only replay the items received in this many hours.')
+        parser.add_argument('--now', action='store_true', help='Import the items now instead of leaving them to the worker.')
+
+    def handle(self, *args, **options):
+        items = RawInboxItem.objects.filter(direction=RawInboxItem.RawInboxDirection.IN)
+        if options['ids']:
+            items = items.filter(id__in=options['ids'])
+        if options['origin']:
+            items = items.filter(origin=options['origin'])
+        if options['hours'] is not None:
+            items = items.filter(received__gte=timezone.now() - datetime.timedelta(hours=options['hours']))
+
+        queued = replay_inbox_items(items)
+        self.stdout.write(f'Queued {queued} inbox items.')
+
+        if options['now']:
+            while process_pending_inbox_items():
+                pass
+            failed = items.filter(status=RawInboxItem.RawInboxStatus.FAILED).count()
+            self.stdout.write(f'{failed} inbox items still failed.')
@@ -0,0 +1,47 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from quickcomm.host_health import probe_hosts
+from quickcomm.http_cache import http_cache
+from quickcomm.models import Host
+from quickcomm.sync_scheduler import CONCURRENCY, SyncScheduler, update_sync_schedules
+
+# This command runs the sync worker. It keeps a schedule for the authors of
+# every remote host and the posts and followers of every remote author, and
+# pulls each of them from its host when it is due. It is run as its own
+# process, next to the web workers, so page views never start syncs. It also
+# probes the API root of every host, so syncs and deliveries skip the hosts
+# that are down (see host_health).
+
+
+class Command(BaseCommand):
+    help = 'Sync the authors, posts and followers of remote hosts on a schedule.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the due syncs once and exit instead of running forever.')
+        parser.add_argument('--interval', type=float, default=5.0, help='The number of seconds to wait between checks for due syncs.')
+        parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='The number of syncs that run at the same time.')
+        parser.add_argument('--probe-interval', type=float, default=60.0, help='The number of seconds between health probes of the hosts.')
+
+    def handle(self, *args, **options):
+        scheduler = SyncScheduler(options['concurrency'])
+        last_probe = None
+        while True:
+            if last_probe is None or time.monotonic() - last_probe >= options['probe_interval']:
+                last_probe = time.monotonic()
+                online = probe_hosts(Host.objects.all())
+                logging.info(f'{online} hosts are online.')
+                logging.info(f'HTTP cache: {http_cache.stats()}')
+
+            update_sync_schedules()
+            started = scheduler.run_due()
+            if started:
+                logging.info(f'Started {started} syncs.')
+
+            if options['once']:
+                scheduler.wait()
+                break
+
+            time.sleep(options['interval'])
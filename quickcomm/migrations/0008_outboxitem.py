@@ -0,0 +1,35 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0007_alter_host_serializer_class'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxItem',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('delivered', 'Delivered'), ('failed', 'Failed')], default='pending', max_length=50)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('delivered', models.DateTimeField(blank=True, null=True)),
+                ('host', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quickcomm.host')),
+                ('inbox', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quickcomm.inbox')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outboxitem',
+            index=models.Index(fields=['status', 'next_attempt'], name='quickcomm_o_status_105a6c_idx'),
+        ),
+    ]
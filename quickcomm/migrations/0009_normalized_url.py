@@ -0,0 +1,87 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:29
+
+import logging
+from django.db import migrations, models
+
+
+def normalize_external_url(url):
+    """A copy of quickcomm.models.normalize_external_url, as migrations should
+    not depend on the current models module."""
+
+    if not url:
+        return None
+
+    url = url.strip()
+    scheme, sep, rest = url.partition('://')
+    if not sep:
+        rest = url
+
+    netloc, slash, path = rest.partition('/')
+    return (netloc.lower() + slash + path).rstrip('/')
+
+
+def backfill_normalized_urls(apps, schema_editor):
+    """Fill in the normalized url of every existing external object. If the
+    same object was stored twice under different urls, only the first copy
+    gets the normalized url so the unique index can be built."""
+
+    for model_name in ['Author', 'Post', 'Comment']:
+        model = apps.get_model('quickcomm', model_name)
+
+        seen = set()
+        changed = []
+        for obj in model.objects.exclude(external_url=None).order_by('pk').only('pk', 'external_url'):
+            normalized_url = normalize_external_url(obj.external_url)
+            if normalized_url is None:
+                continue
+            if normalized_url in seen:
+                logging.warning(f'{model_name} {obj.pk} duplicates {normalized_url}, leaving it unindexed.')
+                continue
+            seen.add(normalized_url)
+            obj.normalized_url = normalized_url
+            changed.append(obj)
+
+        model.objects.bulk_update(changed, ['normalized_url'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0008_outboxitem'),
+    ]
+
+    # the columns are added without the index, backfilled, and only then made
+    # unique
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='normalized_url',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='normalized_url',
+            field=models.CharField(blank=True, editable=False, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='normalized_url',
+            field=models.CharField(blank=True, editable=False, max_length=200, null=True),
+        ),
+        migrations.RunPython(backfill_normalized_urls, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='author',
+            name='normalized_url',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='normalized_url',
+            field=models.CharField(blank=True, editable=False, max_length=200, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='normalized_url',
+            field=models.CharField(blank=True, editable=False, max_length=200, null=True, unique=True),
+        ),
+    ]
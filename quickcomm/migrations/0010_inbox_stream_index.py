@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0009_normalized_url'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inbox',
+            index=models.Index(fields=['author', '-added', '-id'], name='quickcomm_i_author__5bf536_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0010_inbox_stream_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GitHubFeed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=100, unique=True)),
+                ('etag', models.CharField(blank=True, max_length=200, null=True)),
+                ('last_modified', models.CharField(blank=True, max_length=100, null=True)),
+                ('next_poll', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_polled', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GitHubEvent',
+            fields=[
+                ('id', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('type', models.CharField(max_length=50)),
+                ('actor_login', models.CharField(max_length=100)),
+                ('actor_avatar_url', models.URLField(blank=True, max_length=500, null=True)),
+                ('message', models.TextField()),
+                ('url', models.URLField(blank=True, max_length=500, null=True)),
+                ('created', models.DateTimeField()),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quickcomm.githubfeed')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='githubevent',
+            index=models.Index(fields=['feed', '-created'], name='quickcomm_g_feed_id_899677_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:34
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    """Count the follows, likes and comments that already exist."""
+
+    def count_of(model, field):
+        counts = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(total=Count('pk')).values('total')
+        return Coalesce(Subquery(counts), 0)
+
+    Author = apps.get_model('quickcomm', 'Author')
+    Post = apps.get_model('quickcomm', 'Post')
+    Comment = apps.get_model('quickcomm', 'Comment')
+    Follow = apps.get_model('quickcomm', 'Follow')
+    Like = apps.get_model('quickcomm', 'Like')
+    CommentLike = apps.get_model('quickcomm', 'CommentLike')
+
+    Author.objects.update(followers_count=count_of(Follow, 'following'), followings_count=count_of(Follow, 'follower'))
+    Post.objects.update(likes_count=count_of(Like, 'post'), comments_count=count_of(Comment, 'post'))
+    Comment.objects.update(likes_count=count_of(CommentLike, 'comment'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0011_github_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='author',
+            name='followings_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
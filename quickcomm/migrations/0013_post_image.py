@@ -0,0 +1,56 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:37
+
+import base64
+import binascii
+import hashlib
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_images_to_blobs(apps, schema_editor):
+    """Decode the base64 content of existing image posts into post images. The
+    content of a post that is not valid base64 is left as it is."""
+
+    Post = apps.get_model('quickcomm', 'Post')
+    PostImage = apps.get_model('quickcomm', 'PostImage')
+
+    posts = Post.objects.filter(content_type__in=['image/png;base64', 'image/jpeg;base64']).exclude(content='')
+    for post in posts.iterator(chunk_size=100):
+        content = post.content
+        if content.startswith('data:'):
+            content = content.split(',', 1)[-1]
+        content = ''.join(content.split())
+
+        try:
+            data = base64.b64decode(content, validate=True)
+        except (binascii.Error, ValueError):
+            continue
+
+        PostImage.objects.update_or_create(post=post, defaults={
+            'data': data,
+            'content_type': post.content_type.split(';')[0],
+            'size': len(data),
+            'etag': hashlib.sha256(data).hexdigest(),
+        })
+        Post.objects.filter(pk=post.pk).update(content='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0012_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostImage',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='quickcomm.post')),
+                ('data', models.BinaryField()),
+                ('content_type', models.CharField(max_length=50)),
+                ('size', models.PositiveIntegerField()),
+                ('etag', models.CharField(max_length=64)),
+            ],
+        ),
+        migrations.RunPython(move_images_to_blobs, migrations.RunPython.noop),
+    ]
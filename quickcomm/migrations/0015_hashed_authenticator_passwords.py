@@ -0,0 +1,35 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:47
+
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.db import migrations, models
+
+
+def hash_passwords(apps, schema_editor):
+    """Hash the plain-text passwords of the existing host authenticators. The
+    historical model has no save() override, so they are hashed here."""
+
+    HostAuthenticator = apps.get_model('quickcomm', 'HostAuthenticator')
+    for authenticator in HostAuthenticator.objects.all():
+        try:
+            identify_hasher(authenticator.password)
+            continue
+        except ValueError:
+            pass
+        authenticator.password = make_password(authenticator.password)
+        authenticator.save(update_fields=['password'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0014_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hostauthenticator',
+            name='password',
+            field=models.CharField(help_text='The password to use to authenticate to the host. It is hashed when saved.', max_length=128, verbose_name='Password'),
+        ),
+        migrations.RunPython(hash_passwords, migrations.RunPython.noop),
+    ]
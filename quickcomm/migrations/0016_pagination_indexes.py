@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0015_hashed_authenticator_passwords'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'published', 'id'], name='quickcomm_c_post_id_e16f43_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-published', '-id'], name='quickcomm_p_author__019fea_idx'),
+        ),
+    ]
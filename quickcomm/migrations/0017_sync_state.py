@@ -0,0 +1,27 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0016_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(max_length=300, unique=True)),
+                ('etag', models.CharField(blank=True, max_length=200, null=True)),
+                ('last_modified', models.CharField(blank=True, max_length=100, null=True)),
+                ('page_hashes', models.JSONField(blank=True, default=list)),
+                ('last_published', models.DateTimeField(blank=True, null=True)),
+                ('last_synced', models.DateTimeField(blank=True, null=True)),
+                ('host', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='quickcomm.host')),
+            ],
+        ),
+    ]
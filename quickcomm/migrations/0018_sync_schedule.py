@@ -0,0 +1,42 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0017_sync_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('HOST_AUTHORS', 'Authors of a host'), ('AUTHOR_POSTS', 'Posts of an author'), ('AUTHOR_FOLLOWERS', 'Followers of an author')], max_length=20)),
+                ('interval', models.PositiveIntegerField(default=300)),
+                ('next_run', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_run', models.DateTimeField(blank=True, null=True)),
+                ('last_duration', models.FloatField(blank=True, null=True)),
+                ('last_changed', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='quickcomm.author')),
+                ('host', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='quickcomm.host')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='syncschedule',
+            index=models.Index(fields=['next_run'], name='quickcomm_s_next_ru_332749_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='syncschedule',
+            constraint=models.UniqueConstraint(condition=models.Q(('author', None)), fields=('kind', 'host'), name='unique_host_sync_schedule'),
+        ),
+        migrations.AddConstraint(
+            model_name='syncschedule',
+            constraint=models.UniqueConstraint(condition=models.Q(('host', None)), fields=('kind', 'author'), name='unique_author_sync_schedule'),
+        ),
+    ]
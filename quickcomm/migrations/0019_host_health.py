@@ -0,0 +1,28 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0018_sync_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='host',
+            name='circuit_changed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='host',
+            name='circuit_state',
+            field=models.CharField(choices=[('closed', 'Closed'), ('open', 'Open'), ('half-open', 'Half Open')], default='closed', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='host',
+            name='latency_samples',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
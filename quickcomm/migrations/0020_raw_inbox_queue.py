@@ -0,0 +1,59 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0019_host_health'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rawinboxitem',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='rawinboxitem',
+            name='author',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='quickcomm.author'),
+        ),
+        migrations.AddField(
+            model_name='rawinboxitem',
+            name='last_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rawinboxitem',
+            name='next_attempt',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='rawinboxitem',
+            name='origin',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='rawinboxitem',
+            name='processed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rawinboxitem',
+            name='received',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='rawinboxitem',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='rawinboxitem',
+            index=models.Index(fields=['status', 'next_attempt'], name='quickcomm_r_status_b16acd_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:16
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0020_raw_inbox_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReceivedActivity',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('received', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
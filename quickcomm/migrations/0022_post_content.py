@@ -0,0 +1,64 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:22
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+import django.db.models.deletion
+
+EXCERPT_LENGTH = 200
+
+
+def move_content_to_blobs(apps, schema_editor):
+    """Copy the content of existing posts into post contents, and keep its
+    start as the excerpt of the post."""
+
+    Post = apps.get_model('quickcomm', 'Post')
+    PostContent = apps.get_model('quickcomm', 'PostContent')
+
+    posts = Post.objects.only('id', 'content')
+    for post in posts.iterator(chunk_size=100):
+        PostContent.objects.update_or_create(post=post, defaults={'data': post.content})
+        excerpt = Truncator(post.content[:EXCERPT_LENGTH + 1]).chars(EXCERPT_LENGTH)
+        Post.objects.filter(pk=post.pk).update(excerpt=excerpt)
+
+
+def move_content_to_posts(apps, schema_editor):
+    """Copy the post contents back into the posts."""
+
+    Post = apps.get_model('quickcomm', 'Post')
+    PostContent = apps.get_model('quickcomm', 'PostContent')
+
+    for content in PostContent.objects.iterator(chunk_size=100):
+        Post.objects.filter(pk=content.post_id).update(content=content.data)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0021_received_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostContent',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='quickcomm.post')),
+                ('data', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=200),
+        ),
+        migrations.RunPython(move_content_to_blobs, move_content_to_posts),
+        # the column needs a default to be added back when this is reversed
+        migrations.AlterField(
+            model_name='post',
+            name='content',
+            field=models.CharField(default='', max_length=10485760),
+        ),
+        migrations.RemoveField(
+            model_name='post',
+            name='content',
+        ),
+    ]
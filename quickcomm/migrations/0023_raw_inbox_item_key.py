@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0022_post_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rawinboxitem',
+            name='key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:52
+
+import hashlib
+import logging
+from django.db import migrations
+
+
+def store_image_files(apps, schema_editor):
+    """Copy the uploaded image files of image posts into post images, so the
+    files are not read on every request. Posts that already have a post image
+    keep it."""
+
+    ImageFile = apps.get_model('quickcomm', 'ImageFile')
+    PostImage = apps.get_model('quickcomm', 'PostImage')
+
+    image_files = ImageFile.objects.exclude(post__postimage__isnull=False).select_related('post')
+    for image_file in image_files.iterator(chunk_size=100):
+        try:
+            with image_file.image.open('rb') as f:
+                data = f.read()
+        except OSError:
+            logging.warning(f'The image file of post {image_file.post_id} could not be read, skipping it.')
+            continue
+
+        PostImage.objects.create(post=image_file.post,
+                                 data=data,
+                                 content_type=image_file.post.content_type.split(';')[0],
+                                 size=len(data),
+                                 etag=hashlib.sha256(data).hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0023_raw_inbox_item_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(store_image_files, migrations.RunPython.noop),
+    ]
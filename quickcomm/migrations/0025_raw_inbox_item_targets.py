@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickcomm', '0024_image_file_post_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rawinboxitem',
+            name='targets',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -1,45 +1,146 @@
 import base64
-import os
+import binascii
+import datetime
+import hashlib
+import logging
+import threading
+import time
 import uuid
-from django.db import models
+from collections import OrderedDict
+from django.db import models, transaction
 from django.core.validators import URLValidator
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
+from django.utils.text import Truncator
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.core.cache import cache
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from quickcomm.api_cache import bump_api_versions
+from quickcomm.signals import export_http_request_on_inbox_save, export_http_requests_on_inbox_create
+from quickcomm.urlbuilder import api_url
+
+def normalize_external_url(url):
+    """Returns the canonical form of an external URL, which is the same for
+    every combination of insecure http/trailing slashes. This is what
+    external objects are looked up by."""
+
+    if not url:
+        return None
 
-from quickcomm.signals import export_http_request_on_inbox_save
+    url = url.strip()
+    scheme, sep, rest = url.partition('://')
+    if not sep:
+        rest = url
 
-def try_all_external_urls(url, object):
-    """This method trys to get all objects with the given url with any combination
-    of insecure http/trailing slashes."""
+    # the host is case insensitive, the path is not
+    netloc, slash, path = rest.partition('/')
+    return (netloc.lower() + slash + path).rstrip('/')
 
-    # generate a list of the urls to try
-    urls = [url]
-    if url[-1] == '/':
-        urls.append(url[:-1])
-    else:
-        urls.append(url + '/')
+def get_by_external_url(object, url):
+    """Returns the object of the given model with the given external url, in a
+    single indexed lookup."""
 
-    for url_new in urls.copy():
-        if url_new[:5] == 'https':
-            urls.append(url_new.replace('https', 'http'))
-        else:
-            urls.append(url_new.replace('http', 'https'))
+    normalized_url = normalize_external_url(url)
+    if normalized_url is None:
+        return None
 
-    # try to get the object with each url
-    for url_new in urls:
-        try:
-            return object.objects.filter(external_url=url_new).first()
-        except:
-            pass
+    return object.objects.filter(normalized_url=normalized_url).first()
+
+def get_free_normalized_url(obj):
+    """Returns the normalized url to store on the given external object, or
+    None if another object already holds it. Duplicates left unindexed by the
+    normalized url migration can then still be saved."""
+
+    normalized_url = normalize_external_url(obj.external_url)
+    if normalized_url is None or normalized_url == obj.normalized_url:
+        return normalized_url
 
-    return None
+    if type(obj).objects.filter(normalized_url=normalized_url).exclude(pk=obj.pk).exists():
+        logging.warning(f'{type(obj).__name__} {obj.pk} duplicates {normalized_url}, leaving it unindexed.')
+        return None
+
+    return normalized_url
+
+def get_local_by_url_id(object, url):
+    """Returns the object of the given model whose id is the last part of the
+    given url, which is how our own objects are referred to."""
+
+    try:
+        return object.objects.filter(id=url.rstrip('/').split('/')[-1]).first()
+    except Exception as e:
+        return None
 
 
 # TODO we have to delete external objects when they don't show up in the big list. However, we have to be careful not to delete posts if they are private
 
+# The registration settings and host authenticators are read by every API
+# request, so each process keeps them for a short time instead of querying for
+# them again. Saving or deleting either clears the cache of the process it was
+# saved in, and the timeout bounds how long other processes take to notice.
+AUTH_CACHE_TIMEOUT = 30
+
+_auth_cache = {}
+_auth_cache_lock = threading.Lock()
+
+def get_auth_cached(key, load):
+    """Returns the value cached under key, loading it if it expired. Missing
+    values (None) are not cached, so unknown usernames cannot fill it up."""
+
+    entry = _auth_cache.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+
+    value = load()
+    if value is not None:
+        with _auth_cache_lock:
+            _auth_cache[key] = (time.monotonic() + AUTH_CACHE_TIMEOUT, value)
+    return value
+
+# Host authenticator passwords are stored hashed, and checking a hash takes
+# tens of milliseconds on purpose. Peers send the same credentials with every
+# request, so credentials that were verified recently are remembered by a
+# digest of them, and only the first request pays for the hash. Credentials
+# that fail are never remembered.
+VERIFIED_CREDENTIALS_TIMEOUT = 60 * 5
+VERIFIED_CREDENTIALS_SIZE = 1024
+
+_verified_credentials = OrderedDict()
+
+def credentials_digest(username, password):
+    """Returns the key verified credentials are remembered by, so the
+    passwords themselves are never kept in memory."""
+    return hashlib.sha256(f'{username}:{password}'.encode('utf-8')).hexdigest()
+
+def get_verified_credentials(digest):
+    """Returns the authenticator the credentials were verified for, or None."""
+    with _auth_cache_lock:
+        entry = _verified_credentials.get(digest)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del _verified_credentials[digest]
+            return None
+        _verified_credentials.move_to_end(digest)
+        return entry[1]
+
+def remember_verified_credentials(digest, authenticator):
+    with _auth_cache_lock:
+        _verified_credentials[digest] = (time.monotonic() + VERIFIED_CREDENTIALS_TIMEOUT, authenticator)
+        _verified_credentials.move_to_end(digest)
+        while len(_verified_credentials) > VERIFIED_CREDENTIALS_SIZE:
+            _verified_credentials.popitem(last=False)
+
+def clear_auth_cache():
+    with _auth_cache_lock:
+        _auth_cache.clear()
+        _verified_credentials.clear()
+
 # NOTE: The models in this file do not take into account how the site will
 # interact with other APIs. Ideally, we should be able to reuse the model
 # classes, but this logic is to be implemented later.
@@ -55,14 +156,14 @@ class HostAuthenticator(models.Model):
     """A host authenticator is a username and password that can be used to
     authenticate to a host."""
 
-    # Note: passwords are stored in plain-text. They are API keys, so they are
-    # not sensitive. If we want to store them in a more secure way, we can
-    # hash them, but for now, we will leave them as is.
+    # Note: passwords are hashed like user passwords when they are saved. A
+    # password entered in plain-text (e.g. in the admin) is hashed on save, so
+    # the credentials can only be shown until then.
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
 
     username = models.CharField(max_length=100, help_text="The username to use to authenticate to the host.", verbose_name="Username")
-    password = models.CharField(max_length=100, help_text="The password to use to authenticate to the host.", verbose_name="Password")
+    password = models.CharField(max_length=128, help_text="The password to use to authenticate to the host. It is hashed when saved.", verbose_name="Password")
     nickname = models.CharField(max_length=100, help_text="The nickname of the host authenticator. This is only used for display purposes.", verbose_name="Nickname", null=True, blank=True)
 
 
@@ -72,12 +173,41 @@ class HostAuthenticator(models.Model):
             return self.nickname
         return self.username
 
+    @property
+    def has_hashed_password(self):
+        try:
+            identify_hasher(self.password)
+        except ValueError:
+            return False
+        return True
+
     @property
     def base64string(self):
-        return base64.b64encode(f"{self.username}:{self.password}".encode('ascii')).decode('ascii')
+        """Returns the Basic auth credentials to give to the host. These are
+        only known until the password is hashed, otherwise this is None."""
+        password = getattr(self, '_raw_password', None)
+        if password is None and not self.has_hashed_password:
+            password = self.password
+        if password is None:
+            return None
+        return base64.b64encode(f"{self.username}:{password}".encode('ascii')).decode('ascii')
+
+    def set_password(self, raw_password):
+        self.password = make_password(raw_password)
+        self._raw_password = raw_password
 
     def check_password(self, password):
-        return self.password == password
+        return check_password(password, self.password)
+
+    def save(self, *args, **kwargs):
+        if not self.has_hashed_password:
+            self.set_password(self.password)
+        super(HostAuthenticator, self).save(*args, **kwargs)
+
+    @staticmethod
+    def get_cached(username):
+        """Returns the authenticator with the given username, or None."""
+        return get_auth_cached(('authenticator', username), lambda: HostAuthenticator.objects.filter(username=username).first())
 
     @property
     def is_authenticated(self):
@@ -105,6 +235,13 @@ class Host(models.Model):
         GROUP1 = "GROUP1", "Group 1"
         MATTGROUP = "MATTGROUP", "Matt's Group"
 
+    class CircuitState(models.TextChoices):
+        CLOSED = 'closed'
+        OPEN = 'open'
+        HALF_OPEN = 'half-open'
+
+    # The number of probe latencies kept for the percentiles.
+    LATENCY_SAMPLES = 100
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
 
@@ -117,6 +254,14 @@ class Host(models.Model):
     last_ping = models.DateTimeField(null=True, blank=True)
     last_ping_result = models.BooleanField(null=True, blank=True)
 
+    # The latency of the recent successful probes, in milliseconds.
+    latency_samples = models.JSONField(default=list, blank=True)
+
+    # The state of the circuit breaker of the host (see host_health), as of
+    # when it last changed.
+    circuit_state = models.CharField(max_length=20, choices=CircuitState.choices, default=CircuitState.CLOSED)
+    circuit_changed = models.DateTimeField(null=True, blank=True)
+
     nickname = models.CharField(max_length=100, help_text="The nickname of the host. This is only used for display purposes.", verbose_name="Nickname", null=True, blank=True)
 
     @property
@@ -130,29 +275,32 @@ class Host(models.Model):
 
 
     def ping(self):
-        """Pings the host to see if it is online. Return True if online, False
-        otherwise. This method uses the os.system() method to ping the host."""
-
-        # FIXME ping is not the best way to check if a host is online. We
-        # should use a more reliable method.
+        """Checks if the host is online by calling its API root. Returns True
+        if online, False otherwise."""
 
-        # strip the protocol from the url
-        clean_url = self.url.split('/')[2]
+        # import here to avoid circular imports
+        from quickcomm.host_health import probe_host
+        return probe_host(self)
 
-        # strip the port from the url
-        clean_url = clean_url.split(':')[0]
-
-        # ping the host
-        req = os.system(f"ping -c 1 {clean_url}")
-        success = req == 0
-
-        # last ping is now, set the last ping result
+    def record_ping(self, success, latency=None):
+        """Records the result of a health probe, with its latency in
+        milliseconds if it succeeded."""
         self.last_ping = timezone.now()
         self.last_ping_result = success
         if success:
             self.last_successful_ping = self.last_ping
-
-        return success
+        if latency is not None:
+            self.latency_samples = (self.latency_samples + [round(latency, 1)])[-Host.LATENCY_SAMPLES:]
+        Host.objects.filter(pk=self.pk).update(last_ping=self.last_ping, last_ping_result=success,
+            last_successful_ping=self.last_successful_ping, latency_samples=self.latency_samples)
+
+    def latency_percentile(self, percentile):
+        """Returns the given percentile of the latency of the recent probes in
+        milliseconds, or None if there are none."""
+        if not self.latency_samples:
+            return None
+        samples = sorted(self.latency_samples)
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
 
     # TODO move to the receiver mixins
     def save(self, *args, **kwargs):
@@ -181,6 +329,9 @@ class Author(models.Model):
     # enforced in the model.
     host = models.ForeignKey(Host, on_delete=models.CASCADE, null=True, blank=True,help_text="The host that this author is associated with. This is only used for remote authors. Internal authors will have this field set to null. This field should NOT be set manually.")
     external_url = models.CharField(max_length=100, blank=True, null=True, help_text="The external URL of the author. This is only used for remote authors. Internal authors will have this field set to null. This field should NOT be set manually.", verbose_name="External URL")
+    # the external url without its scheme or trailing slash, which is what
+    # remote authors are looked up by
+    normalized_url = models.CharField(max_length=100, blank=True, null=True, unique=True, editable=False)
     display_name = models.CharField(max_length=100)
     github = models.URLField(blank=True, null=True, validators=[URLValidator], help_text="The URL of the author's GitHub profile. This must be in proper form (e.g. https://github.com/abramhindle).", verbose_name="GitHub URL")
     profile_image = models.URLField(
@@ -189,38 +340,67 @@ class Author(models.Model):
     # TODO determine if admins are authors
     is_admin = models.BooleanField(default=False)
 
+    # These counters are kept up to date as follows are added and removed.
+    followers_count = models.PositiveIntegerField(default=0, editable=False)
+    followings_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # The last time the author or its counters changed, which is what
+    # conditional API requests are answered from.
+    updated_at = models.DateTimeField(auto_now=True)
+
 
     # TODO always use trailing slash
 
 
+    def save(self, *args, **kwargs):
+        self.normalized_url = get_free_normalized_url(self)
+        return super(Author, self).save(*args, **kwargs)
+
     @staticmethod
     def get_from_url(url):
         """Returns the author with the given URL."""
 
         # try to get the author from the database
-        author = try_all_external_urls(url, Author)
+        author = get_by_external_url(Author, url)
         if author is not None:
             return author
 
-        try:
-
-            author_id = url.split('/')
-            if author_id[-1] == '':
-                author_id = author_id[-2]
-            else:
-                author_id = author_id[-1]
-            author = Author.objects.filter(id=author_id).first()
-            if author is None:
-                return None
-        except:
-            return None
-
-        if author.host is None:
+        author = get_local_by_url_id(Author, url)
+        if author is not None and author.host is None:
             return author
 
         return None
 
 
+    @staticmethod
+    def get_many_from_urls(urls):
+        """Returns a dictionary of the authors with the given URLs, keyed by
+        the URL they were asked for. This works like get_from_url, but looks
+        up every URL with a constant number of queries."""
+
+        normalized_urls = {}
+        for url in urls:
+            normalized_urls.setdefault(normalize_external_url(url), url)
+
+        authors = {}
+        for author in Author.objects.filter(normalized_url__in=normalized_urls.keys()):
+            authors[normalized_urls[author.normalized_url]] = author
+
+        # the URLs that were not found may point to one of our own authors
+        ids = {}
+        for url in urls:
+            if url in authors:
+                continue
+            try:
+                ids[uuid.UUID(url.rstrip('/').split('/')[-1])] = url
+            except ValueError:
+                continue
+
+        for author in Author.objects.filter(id__in=ids.keys(), host=None):
+            authors[ids[author.id]] = author
+
+        return authors
+
     # This section defines the types of authors that can exist on our server.
     # Since we have to "cache" all author objects to get them to display in
     # the frontend, we will have 3 types of authors:
@@ -280,7 +460,7 @@ class Author(models.Model):
     
     def follower_count(self):
         """return number of profiles following author (self)"""
-        return Follow.objects.filter(following=self).count()
+        return self.followers_count
     
     def get_followers(self):
         return Follow.objects.filter(following=self)
@@ -289,7 +469,7 @@ class Author(models.Model):
         return Follow.objects.filter(follower=self)
     
     def following_count(self):
-        return Follow.objects.filter(follower=self).count()
+        return self.followings_count
 
     def posts_count(self):
         return Post.objects.filter(author=self).count()
@@ -414,13 +594,21 @@ class Post(models.Model):
         PUBLIC = 'PUBLIC'
         FRIENDS = 'FRIENDS'
 
+    # The number of characters of the content that are kept in the excerpt.
+    EXCERPT_LENGTH = 200
+
+    # The fields that lists of posts show, which are loaded with only().
+    LIST_FIELDS = ('id', 'title', 'content_type', 'excerpt', 'author', 'published', 'visibility', 'unlisted', 'recipient')
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=100)
     source = models.URLField(blank=True, null=True, validators=[URLValidator])
     origin = models.URLField(blank=True, null=True, validators=[URLValidator])
     description = models.CharField(max_length=1000)
     content_type = models.CharField(max_length=50, choices=PostType.choices)
-    content = models.CharField(max_length=10485760)
+    # The content of a post can be large, so it is kept in its own table (see
+    # PostContent) and the post only has the start of it, for lists.
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH, blank=True, editable=False)
     # FIXME categories has to be a list of strings of some sort
     author = models.ForeignKey(Author, on_delete=models.CASCADE)
     categories = models.CharField(max_length=1000)
@@ -429,13 +617,55 @@ class Post(models.Model):
         max_length=50)
     unlisted = models.BooleanField(default=False)
     external_url = models.URLField(blank=True, null=True, validators=[URLValidator])
+    normalized_url = models.CharField(max_length=200, blank=True, null=True, unique=True, editable=False)
     likes = models.ManyToManyField(User, related_name='post_likes')
     recipient = models.UUIDField(editable=False, null=True)
 
+    # These counters are kept up to date as likes and comments are added and
+    # removed.
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # the posts of an author are paged newest first
+        indexes = [models.Index(fields=['author', '-published', '-id'])]
+
+    # content that was set but is not written yet
+    _content = None
+
+    @property
+    def content(self):
+        """Returns the content of the post. It is loaded from its own table
+        the first time it is asked for, unless the post was fetched with
+        select_related('postcontent')."""
+        if self._content is not None:
+            return self._content
+        try:
+            return self.postcontent.data
+        except PostContent.DoesNotExist:
+            return ''
+
+    @content.setter
+    def content(self, value):
+        """Sets the content of the post, and its excerpt. The content is
+        written when the post is saved."""
+        self._content = value
+        # the content can be megabytes long, so only its start is looked at
+        self.excerpt = Truncator((value or '')[:Post.EXCERPT_LENGTH + 1]).chars(Post.EXCERPT_LENGTH)
+
     def save(self, *args, **kwargs):
+        self.normalized_url = get_free_normalized_url(self)
+        image = self.take_image()
+        adding = self._state.adding
         saved = super(Post, self).save(*args, **kwargs)
 
-        # FIXME move saving image logic here?
+        # the content and the image are stored before the post is sent to any
+        # inbox, as serializing the post needs them
+        if self._content is not None:
+            PostContent.store(self, self._content, adding)
+        if image is not None:
+            PostImage.store(self, image)
 
         # skip inbox logic for remote authors
         if self.author.is_remote:
@@ -447,51 +677,56 @@ class Post(models.Model):
 
         # if visibility is private, we only send to the inbox of the recipient and the author of the post
         elif self.visibility == 'PRIVATE':
-            try:
-                author = Author.objects.get(id=self.recipient)
-                if not Inbox.objects.filter(content_type=ContentType.objects.get_for_model(self), object_id=self.id, author=author).exists():
-                    Inbox.objects.create(content_object=self, author=author, inbox_type=Inbox.InboxType.POST)
+            author = Author.objects.select_related('host').filter(id=self.recipient).first()
+            if author is None:
+                return saved
 
-                # We also include the author as a follower of themselves to simplify
-                # the inbox logic.
-                if not Inbox.objects.filter(content_type=ContentType.objects.get_for_model(self), object_id=self.id, author=self.author).exists():
-                    Inbox.objects.create(content_object=self, author=self.author, inbox_type=Inbox.InboxType.POST)
-            except:
-                pass
+            # We also include the author as a follower of themselves to simplify
+            # the inbox logic.
+            Inbox.fan_out(self, [author, self.author], Inbox.InboxType.POST)
 
             return saved
             
         else:
             # When we save a post, we also need to create an inbox post for each
-            # follower of the author.
+            # follower of the author. The recipients are found in one query
+            # and written with one bulk insert, no matter how many followers
+            # the author has.
 
-            followers = Follow.objects.filter(following=self.author)
+            followers = Follow.objects.filter(following=self.author).select_related('follower__host').order_by('id')
 
-            for follower in followers:
-                # If this is a friend post, only create the post for true friends
-                if (self.visibility == 'FRIENDS' and follower.is_bidirectional()) or self.visibility == 'PUBLIC':
-                    if not Inbox.objects.filter(content_type=ContentType.objects.get_for_model(self), object_id=self.id, author=follower.follower).exists():
-                        Inbox.objects.create(content_object=self, author=follower.follower, inbox_type=Inbox.InboxType.POST)
+            # If this is a friend post, only create the post for true friends.
+            # This joins the follow table on itself to keep the followers that
+            # the author follows back.
+            if self.visibility == 'FRIENDS':
+                followers = followers.filter(follower__following__follower=self.author)
+            elif self.visibility != 'PUBLIC':
+                followers = Follow.objects.none()
 
             # We also include the author as a follower of themselves to simplify
             # the inbox logic.
-            if not Inbox.objects.filter(content_type=ContentType.objects.get_for_model(self), object_id=self.id, author=self.author).exists():
-                Inbox.objects.create(content_object=self, author=self.author, inbox_type=Inbox.InboxType.POST)
+            recipients = [follower.follower for follower in followers]
+            recipients.append(self.author)
+            Inbox.fan_out(self, recipients, Inbox.InboxType.POST)
 
         return saved
     
     def update_info(self,post_info,post_id):
         post = Post.objects.filter(id=post_id, author=self.author)
-        post.update(title=self.title,
+        updated = post.update(title=self.title,
         source=self.source,
         origin=self.origin,
         description=self.description,
         content_type=self.content_type,
-        content=self.content,
+        excerpt=self.excerpt,
         categories=self.categories,
         author=self.author,
         visibility=self.visibility,
-        unlisted=self.unlisted)
+        unlisted=self.unlisted,
+        updated_at=timezone.now())
+        if updated and self._content is not None:
+            PostContent.objects.update_or_create(post_id=post_id, defaults={'data': self._content})
+        bump_api_versions(f'posts:{self.author_id}')
         return post
 
     def delete(self, *args, **kwargs):
@@ -506,10 +741,55 @@ class Post(models.Model):
         super(Post, self).delete(*args, **kwargs)
 
 
+    @property
+    def is_image(self):
+        """Returns true if the post is an image post."""
+        return self.content_type == Post.PostType.PNG or self.content_type == Post.PostType.JPG
+
+    def take_image(self):
+        """Decodes the base64 content of an image post and clears it, so the
+        image is only stored once, as binary. Returns the image bytes, or None
+        if there is no new image in the content."""
+        if not self.is_image or not self.content:
+            return None
+
+        # some hosts send the image as a data url
+        content = self.content
+        if content.startswith('data:'):
+            content = content.split(',', 1)[-1]
+        content = ''.join(content.split())
+
+        try:
+            image = base64.b64decode(content, validate=True)
+        except (binascii.Error, ValueError):
+            return None
+
+        self.content = ''
+        return image
+
     @property
     def content_formatted(self):
         """Returns the content of the post as either base64 or plain text."""
-        return self.content
+        if not self.is_image or self.content:
+            return self.content
+
+        # Federation needs images as base64. It is encoded from the stored
+        # image the first time it is asked for, and cached by the image's hash.
+        # Lists of posts annotate the hash (image_etag) instead of querying it.
+        if hasattr(self, 'image_etag'):
+            etag = self.image_etag
+        else:
+            etag = PostImage.objects.filter(post=self).values_list('etag', flat=True).first()
+        if etag is None:
+            return self.content
+
+        key = f'post-image-base64:{etag}'
+        encoded = cache.get(key)
+        if encoded is None:
+            data = PostImage.objects.values_list('data', flat=True).get(pk=self.pk)
+            encoded = base64.b64encode(data).decode('utf-8')
+            cache.set(key, encoded, PostImage.BASE64_CACHE_TIMEOUT)
+        return encoded
 
     @content_formatted.setter
     def content_formatted(self, value):
@@ -518,7 +798,7 @@ class Post(models.Model):
 
     def get_image_url(self, request):
         """Returns the absolute URL of the image associated with the post."""
-        return request.build_absolute_uri("/api/authors/"+self.author_id.__str__()+"/posts/"+self.id.__str__()+"/image/")
+        return api_url('api:post-image', request, authors_pk=self.author_id, pk=self.id)
     def __str__(self):
         return f"{self.title} by {self.author.__str__()}"
 
@@ -530,7 +810,7 @@ class Post(models.Model):
     @property
     def count(self):
         """Returns the number of comments for this post."""
-        return self.comments.count()
+        return self.comments_count
 
     @property
     def likes(self):
@@ -547,25 +827,12 @@ class Post(models.Model):
     def get_from_url(url):
         """Returns the post with the given URL."""
 
-        post = Post.objects.filter(external_url=url).first()
+        post = get_by_external_url(Post, url)
         if post is not None:
-            return Post
-
-        if url[-1] == '/':
-            url = url[:-1]
-
-            post = Post.objects.filter(external_url=url).first()
-            if post is not None:
-                return Post
-
-
-        post_id= url.split('/')[-1]
-        try:
-            post = Post.objects.get(id=post_id)
-        except:
-            return None
+            return post
 
-        if post.author.host is None:
+        post = get_local_by_url_id(Post, url)
+        if post is not None and post.author.host is None:
             return post
 
         return None
@@ -585,8 +852,18 @@ class Comment(models.Model):
     content_type = models.CharField(max_length=50, choices=CommentType.choices, default=CommentType.TEXT)
     published = models.DateTimeField(auto_now_add=True)
     external_url = models.URLField(blank=True, null=True, validators=[URLValidator])
+    normalized_url = models.CharField(max_length=200, blank=True, null=True, unique=True, editable=False)
+
+    # This counter is kept up to date as likes are added and removed.
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # the comments of a post are paged oldest first
+        indexes = [models.Index(fields=['post', 'published', 'id'])]
 
     def save(self, *args, **kwargs):
+        self.normalized_url = get_free_normalized_url(self)
         saved = super(Comment, self).save(*args, **kwargs)
         # When we save a comment, we also need to create an inbox post for the
         # author of the post.
@@ -610,25 +887,12 @@ class Comment(models.Model):
     def get_from_url(url):
         """Returns the comment with the given URL."""
 
-        comment = Comment.objects.filter(external_url=url).first()
+        comment = get_by_external_url(Comment, url)
         if comment is not None:
-            return Comment
-
-        if url[-1] == '/':
-            url = url[:-1]
-
-            comment = Comment.objects.filter(external_url=url).first()
-            if comment is not None:
-                return Comment
-
-
-        comment_id = url.split('/')[-1]
-        try:
-            comment = Comment.objects.get(id=comment_id)
-        except:
-            return None
+            return comment
 
-        if comment.post.author.host is None:
+        comment = get_local_by_url_id(Comment, url)
+        if comment is not None and comment.post.author.host is None:
             return comment
 
         return None
@@ -640,11 +904,7 @@ class Comment(models.Model):
 
     def like_count(self):
         """Returns the number of likes for this comment."""
-        return CommentLike.objects.filter(comment=self).count()
-
-    def like_ids(self):
-        """Returns the ids of authors who have liked this comment."""
-        return [like.author.id for like in CommentLike.objects.filter(comment=self)]
+        return self.likes_count
 
     def __str__(self):
         return f"{self.author.__str__()} commented on {self.post.__str__()}"
@@ -658,9 +918,75 @@ class ImageFile(models.Model):
 
     def save(self, *args, **kwargs):
         res = super(ImageFile, self).save(*args, **kwargs)
+
+        # the image is served and federated from its post image, so the file
+        # is not read again on every request
+        with self.image.open('rb') as image_file:
+            PostImage.store(self.post, image_file.read())
+
         self.post.save()
         return res
 
+class PostContent(models.Model):
+    """The content of a post. It is kept apart from the post, so lists of
+    posts do not load it. Only the pages and API responses of whole posts
+    do."""
+
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True)
+    data = models.TextField(blank=True)
+
+    @staticmethod
+    def store(post, data, adding=False):
+        """Stores the content of a post, replacing any content it had. The
+        content of a post that was just added is inserted without looking for
+        old content first."""
+        if adding:
+            content = PostContent.objects.create(post=post, data=data)
+        else:
+            content = PostContent.objects.update_or_create(post=post, defaults={'data': data})[0]
+
+        # the content is written, so the post reads it from here from now on
+        Post._meta.get_field('postcontent').set_cached_value(post, content)
+        post._content = None
+        return content
+
+    def __str__(self):
+        return f"Content of {self.post_id}"
+
+class PostImage(models.Model):
+    """A post image is the binary image of an image post. Images arrive as
+    base64, but are stored and served as binary, so they are not decoded on
+    every request."""
+
+    # How long the base64 of an image is kept in the cache, in seconds.
+    BASE64_CACHE_TIMEOUT = 60 * 60
+
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True)
+    data = models.BinaryField()
+    content_type = models.CharField(max_length=50)
+    size = models.PositiveIntegerField()
+
+    # The hash of the image, used as its ETag.
+    etag = models.CharField(max_length=64)
+
+    @staticmethod
+    def store(post, data):
+        """Stores the image of a post, replacing any image it had."""
+        return PostImage.objects.update_or_create(post=post, defaults=PostImage.defaults_for(post, data))[0]
+
+    @staticmethod
+    def defaults_for(post, data):
+        """Returns the fields of the image of a post."""
+        return {
+            'data': data,
+            'content_type': post.content_type.split(';')[0],
+            'size': len(data),
+            'etag': hashlib.sha256(data).hexdigest(),
+        }
+
+    def __str__(self):
+        return f"Image of {self.post_id}"
+
 class Inbox(models.Model):
     """The inbox is a relationship between an author and either a like, comment,
     post, or friend request.
@@ -713,17 +1039,129 @@ class Inbox(models.Model):
     object_id = models.UUIDField()
     content_object = GenericForeignKey('content_type', 'object_id')
 
+    class Meta:
+        # the stream is read newest first, one page at a time
+        indexes = [models.Index(fields=['author', '-added', '-id'])]
+
+    # the number of items on each page of the stream
+    STREAM_PAGE_SIZE = 25
+
+    # the related objects each type of content shows in the stream, keyed by
+    # content type
+    STREAM_RELATED = {
+        'post': ['author__host'],
+        'comment': ['author', 'post__author'],
+        'like': ['author', 'post__author'],
+        'commentlike': ['author', 'comment__post__author'],
+        'followrequest': ['from_user__host', 'to_user'],
+    }
+
+    @staticmethod
+    def stream(author, cursor=None, size=STREAM_PAGE_SIZE):
+        """Returns a page of the author's inbox, newest first, and the cursor
+        of the next page. The cursor is the (added, id) of the last item, or
+        None if this is the last page."""
+
+        items = Inbox.objects.filter(author=author).order_by('-added', '-id')
+        if cursor is not None:
+            added, id = cursor
+            items = items.filter(Q(added__lt=added) | Q(added=added, id__lt=id))
+
+        # get one extra item to know if there is another page
+        items = list(items[:size + 1])
+        next_cursor = None
+        if len(items) > size:
+            items = items[:size]
+            next_cursor = (items[-1].added, items[-1].id)
+
+        Inbox.load_content_objects(items)
+        Inbox.load_follow_state(items)
+        return items, next_cursor
+
+    @staticmethod
+    def load_content_objects(items):
+        """Loads the content objects of the given inbox items with one query
+        per content type, instead of one query per item."""
+
+        by_type = {}
+        for item in items:
+            by_type.setdefault(item.content_type_id, []).append(item)
+
+        content_object = Inbox._meta.get_field('content_object')
+        object_id = Inbox._meta.get_field('object_id')
+        for content_type_id, typed_items in by_type.items():
+            content_type = ContentType.objects.get_for_id(content_type_id)
+            model = content_type.model_class()
+            related = Inbox.STREAM_RELATED.get(content_type.model, [])
+
+            # object ids are stored as UUIDs, even for models with integer keys
+            objects = model.objects.select_related(*related).filter(pk__in=[item.object_id for item in typed_items])
+            objects = {object_id.to_python(obj.pk): obj for obj in objects}
+
+            # deleted objects are cached as None, like the generic foreign key does
+            for item in typed_items:
+                content_object.set_cached_value(item, objects.get(item.object_id))
+
+    @staticmethod
+    def load_follow_state(items):
+        """Sets is_following on the follow requests of the given inbox items,
+        with one query for all of them."""
+
+        follow_requests = [item.content_object for item in items
+                           if item.inbox_type == Inbox.InboxType.FOLLOW and item.content_object is not None]
+        if not follow_requests:
+            return
+
+        follows = set(Follow.objects.filter(
+            follower__in={request.from_user_id for request in follow_requests},
+            following__in={request.to_user_id for request in follow_requests},
+        ).values_list('follower_id', 'following_id'))
+
+        for request in follow_requests:
+            request.is_following = (request.from_user_id, request.to_user_id) in follows
+
     def save(self, *args, **kwargs):
-        sel = super(Inbox, self).save(*args, **kwargs)
-        # skip inbox logic if we are updating the inbox
-        # if self.id:
-        #     return sel
+        created = self._state.adding
+
+        # The inbox item and its outbox entry are written in the same
+        # transaction, so a queued delivery never points at a missing item and
+        # an item is never saved without its delivery.
+        with transaction.atomic():
+            sel = super(Inbox, self).save(*args, **kwargs)
 
-        # call remote method:
-        export_http_request_on_inbox_save(self)
+            # skip inbox logic if we are updating the inbox
+            if created:
+                # queue the remote delivery, the outbox worker sends it later
+                export_http_request_on_inbox_save(self)
 
         return sel
 
+    @staticmethod
+    def fan_out(content_object, authors, inbox_type):
+        """Adds an object to the inboxes of the given authors, skipping the
+        authors that already have it. The existing items are found with one
+        query, the new items are written with one bulk insert, and the remote
+        deliveries are queued together. Returns the new inbox items."""
+
+        content_type = ContentType.objects.get_for_model(content_object)
+
+        # remove duplicate authors, keeping the order they were given in
+        authors = list({author.id: author for author in authors}.values())
+
+        existing = set(Inbox.objects.filter(content_type=content_type, object_id=content_object.id).values_list('author_id', flat=True))
+        items = [Inbox(author=author, content_object=content_object, inbox_type=inbox_type)
+                 for author in authors if author.id not in existing]
+        if not items:
+            return items
+
+        # bulk_create does not call save(), so the outbox entries are queued
+        # here, in the same transaction as the inbox items
+        with transaction.atomic():
+            Inbox.objects.bulk_create(items)
+            export_http_requests_on_inbox_create(items)
+
+        return items
+
     def __str__(self):
         return f"{self.author.__str__()}'s inbox contains {self.content_object.__str__()}"
 
@@ -732,6 +1170,7 @@ class CommentLike(models.Model):
 
     author = models.ForeignKey(Author, on_delete=models.CASCADE)
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
         saved = super(CommentLike, self).save(*args, **kwargs)
@@ -761,6 +1200,7 @@ class Like(models.Model):
 
     author = models.ForeignKey(Author, on_delete=models.CASCADE)
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
     
     def save(self, *args, **kwargs):
         saved = super(Like, self).save(*args, **kwargs)
@@ -793,6 +1233,7 @@ class CommentLike(models.Model):
 
     author = models.ForeignKey(Author, on_delete=models.CASCADE)
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
         saved = super(CommentLike, self).save(*args, **kwargs)
@@ -826,22 +1267,405 @@ class RegistrationSettings(models.Model):
     are_new_users_active = models.BooleanField(default=True)
     allow_api_access_without_login = models.BooleanField(default=False)
 
+    @staticmethod
+    def get_cached():
+        """Returns the settings, creating them if there are none yet."""
+        return get_auth_cached('registration-settings', lambda: RegistrationSettings.objects.get_or_create()[0])
+
     def __str__(self):
         return f"{self.are_new_users_active.__str__()}"
 
 
 class RawInboxItem(models.Model):
     """A raw inbox item is a straight JSON object that is either received from
-    a remote author or sent to a remote author."""
+    a remote author or sent to a remote author.
+
+    Items sent to the inbox of a local author, or to the shared inbox, are
+    written here as they come in, and the process_inbox worker imports them
+    later, so the request never waits on the import. Items that could not be
+    imported are kept, and can be imported again with the replay_inbox
+    command."""
 
     class RawInboxDirection(models.TextChoices):
         IN = 'in'
         OUT = 'out'
 
+    class RawInboxStatus(models.TextChoices):
+        PENDING = 'pending'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    # After this many failed attempts, the item is marked as failed and is no
+    # longer retried. Items that are not valid fail straight away.
+    MAX_ATTEMPTS = 5
+
+    # The delay before the first retry. Every following retry doubles it.
+    BACKOFF = datetime.timedelta(seconds=30)
+
+    # How long a worker holds an item it has claimed before another worker is
+    # allowed to pick it up again.
+    LEASE = datetime.timedelta(minutes=5)
+
+    # How long imported items are kept before they are deleted. Failed items
+    # are kept until they are imported again.
+    RETENTION = datetime.timedelta(days=7)
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     endpoint = models.URLField()
     direction = models.CharField(max_length=50, choices=RawInboxDirection.choices)
     data = models.JSONField()
 
+    # The author whose inbox the item was sent to, and the Origin header it
+    # came with, which says which host sent it.
+    author = models.ForeignKey(Author, on_delete=models.CASCADE, null=True, blank=True)
+    origin = models.CharField(max_length=200, null=True, blank=True)
+
+    # The ids of the authors an item sent to the shared inbox goes to. It is
+    # imported once and added to all of their inboxes.
+    targets = models.JSONField(null=True, blank=True)
+
+    # The hash of the activity (see inbound.get_activity_key), so a copy that
+    # comes in while the item waits to be imported is dropped.
+    key = models.CharField(max_length=64, null=True, blank=True, db_index=True, editable=False)
+
+    status = models.CharField(max_length=50, choices=RawInboxStatus.choices, default=RawInboxStatus.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(null=True, blank=True)
+    received = models.DateTimeField(default=timezone.now)
+    processed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt'])]
+
+    def mark_done(self):
+        """Marks the item as imported."""
+        self.status = RawInboxItem.RawInboxStatus.DONE
+        self.attempts += 1
+        self.processed = timezone.now()
+        self.last_error = None
+        self.save()
+
+    def mark_failed(self, error, retry=True):
+        """Records a failed attempt and schedules the next one with exponential
+        backoff, or gives up after MAX_ATTEMPTS or if retry is false."""
+        self.attempts += 1
+        self.last_error = error
+        if not retry or self.attempts >= RawInboxItem.MAX_ATTEMPTS:
+            self.status = RawInboxItem.RawInboxStatus.FAILED
+        else:
+            self.next_attempt = timezone.now() + RawInboxItem.BACKOFF * 2 ** (self.attempts - 1)
+        self.save()
+
     def __str__(self):
         return f"Raw inbox item {self.direction} {self.endpoint}"
+
+
+class ReceivedActivity(models.Model):
+    """A received activity is the hash of an activity a remote host sent to
+    the inbox of a local author (see inbound.get_activity_key). Peers often
+    send the same activity again, and those are dropped with one lookup of
+    the hash instead of being imported again. Hashes are kept for TTL."""
+
+    TTL = datetime.timedelta(days=7)
+
+    key = models.CharField(max_length=64, primary_key=True)
+    received = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"Received activity {self.key}"
+
+
+class OutboxItem(models.Model):
+    """An outbox item is a queued delivery of an inbox item to the inbox of a
+    remote author. These are created when an inbox item for a remote author is
+    saved, and are sent by the deliver_outbox worker, so the request that made
+    the item never waits on the remote host."""
+
+    class OutboxStatus(models.TextChoices):
+        PENDING = 'pending'
+        DELIVERED = 'delivered'
+        FAILED = 'failed'
+
+    # After this many failed attempts, the item is marked as failed and is no
+    # longer retried.
+    MAX_ATTEMPTS = 8
+
+    # The delay before the first retry. Every following retry doubles it.
+    BACKOFF = datetime.timedelta(seconds=30)
+
+    # How long a worker holds an item it has claimed before another worker is
+    # allowed to pick it up again.
+    LEASE = datetime.timedelta(minutes=5)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    inbox = models.ForeignKey(Inbox, on_delete=models.CASCADE)
+    host = models.ForeignKey(Host, on_delete=models.CASCADE)
+
+    # The serialized activity, taken when the item is queued.
+    payload = models.JSONField()
+
+    status = models.CharField(max_length=50, choices=OutboxStatus.choices, default=OutboxStatus.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    delivered = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt'])]
+
+    def mark_delivered(self):
+        """Marks the item as delivered."""
+        self.status = OutboxItem.OutboxStatus.DELIVERED
+        self.attempts += 1
+        self.delivered = timezone.now()
+        self.last_error = None
+        self.save()
+
+    def mark_failed(self, error, retry=True):
+        """Records a failed attempt and schedules the next one with exponential
+        backoff, or gives up after MAX_ATTEMPTS or if retry is false."""
+        self.attempts += 1
+        self.last_error = error
+        if not retry or self.attempts >= OutboxItem.MAX_ATTEMPTS:
+            self.status = OutboxItem.OutboxStatus.FAILED
+        else:
+            self.next_attempt = timezone.now() + OutboxItem.BACKOFF * 2 ** (self.attempts - 1)
+        self.save()
+
+    def postpone(self, until, error):
+        """Schedules the next attempt for later without counting this one, as
+        the item was not sent."""
+        self.next_attempt = until
+        self.last_error = error
+        self.save()
+
+    def __str__(self):
+        return f"Outbox item {self.status} for {self.inbox.author.__str__()}"
+
+
+class SyncState(models.Model):
+    """The state of a list on a remote host (like the posts of a remote
+    author) as of its last sync, so the next sync only fetches what changed."""
+
+    # The url of the list, which includes the host.
+    resource = models.CharField(max_length=300, unique=True)
+    host = models.ForeignKey(Host, on_delete=models.CASCADE, null=True, blank=True)
+
+    # The validators of the first page, sent back in conditional requests.
+    etag = models.CharField(max_length=200, null=True, blank=True)
+    last_modified = models.CharField(max_length=100, null=True, blank=True)
+
+    # A hash of the items on each page, in page order.
+    page_hashes = models.JSONField(default=list, blank=True)
+
+    # The newest publish date seen on the list.
+    last_published = models.DateTimeField(null=True, blank=True)
+    last_synced = models.DateTimeField(null=True, blank=True)
+
+    @staticmethod
+    def for_resource(host, resource):
+        """Returns the state of the list at the given url, which is unsaved if
+        the list was never synced."""
+        return SyncState.objects.filter(resource=resource).first() or SyncState(host=host, resource=resource)
+
+    def __str__(self):
+        return f"Sync state of {self.resource}"
+
+class SyncSchedule(models.Model):
+    """A sync schedule says when the sync_scheduler worker next pulls a list
+    from a remote host: the authors of a host, or the posts or followers of a
+    remote author. The interval shrinks when a sync finds changes and backs
+    off when it does not, so busy peers are polled more than idle ones."""
+
+    class Kind(models.TextChoices):
+        HOST_AUTHORS = 'HOST_AUTHORS', 'Authors of a host'
+        AUTHOR_POSTS = 'AUTHOR_POSTS', 'Posts of an author'
+        AUTHOR_FOLLOWERS = 'AUTHOR_FOLLOWERS', 'Followers of an author'
+
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    host = models.ForeignKey(Host, on_delete=models.CASCADE, null=True, blank=True)
+    author = models.ForeignKey(Author, on_delete=models.CASCADE, null=True, blank=True)
+
+    # The number of seconds between syncs.
+    interval = models.PositiveIntegerField(default=300)
+    next_run = models.DateTimeField(default=timezone.now)
+    last_run = models.DateTimeField(null=True, blank=True)
+    # The number of seconds the last sync took.
+    last_duration = models.FloatField(null=True, blank=True)
+    last_changed = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['next_run'])]
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'host'], condition=models.Q(author=None), name='unique_host_sync_schedule'),
+            models.UniqueConstraint(fields=['kind', 'author'], condition=models.Q(host=None), name='unique_author_sync_schedule'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.host or self.author}"
+
+class GitHubFeed(models.Model):
+    """A GitHub feed is the public event feed of a GitHub user that an author
+    links to. The feeds are polled in the background by the ingest_github
+    worker, which remembers the validators of the last response so it can
+    make conditional requests."""
+
+    username = models.CharField(max_length=100, unique=True)
+
+    # The validators of the last response, sent back to GitHub so it can
+    # answer with 304 Not Modified when nothing changed.
+    etag = models.CharField(max_length=200, null=True, blank=True)
+    last_modified = models.CharField(max_length=100, null=True, blank=True)
+
+    next_poll = models.DateTimeField(default=timezone.now)
+    last_polled = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+
+    def __str__(self):
+        return f"GitHub feed of {self.username}"
+
+
+class GitHubEvent(models.Model):
+    """A GitHub event is a single public event of a GitHub feed. The event is
+    parsed once when it is ingested, so the stream only has to read it."""
+
+    # The id GitHub gives the event.
+    id = models.CharField(max_length=50, primary_key=True)
+    feed = models.ForeignKey(GitHubFeed, on_delete=models.CASCADE)
+    type = models.CharField(max_length=50)
+    actor_login = models.CharField(max_length=100)
+    actor_avatar_url = models.URLField(max_length=500, null=True, blank=True)
+    message = models.TextField()
+    url = models.URLField(max_length=500, null=True, blank=True)
+    created = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=['feed', '-created'])]
+
+    @property
+    def format(self): return "github"
+
+    @property
+    def added(self):
+        """Returns the date of the event, for sorting it with inbox items."""
+        return self.created
+
+    def __str__(self):
+        return f"{self.type} by {self.actor_login}"
+
+
+# The counters on authors, posts and comments are updated with the rows they
+# count. The updates are done with F() expressions in the database, so two
+# requests liking the same post at once both count. Signals are used instead
+# of save() and delete() so that queryset deletes and cascades are counted
+# too. The reconcile_counters command fixes any counter that drifted.
+
+def change_counter(model, pk, field, amount):
+    """Atomically adds amount to a counter, never going below zero."""
+    model.objects.filter(pk=pk).update(**{field: Greatest(F(field) + amount, 0)}, updated_at=timezone.now())
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Author, instance.following_id, 'followers_count', 1)
+        change_counter(Author, instance.follower_id, 'followings_count', 1)
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    change_counter(Author, instance.following_id, 'followers_count', -1)
+    change_counter(Author, instance.follower_id, 'followings_count', -1)
+
+@receiver(post_save, sender=Like)
+def count_like(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Post, instance.post_id, 'likes_count', 1)
+
+@receiver(post_delete, sender=Like)
+def uncount_like(sender, instance, **kwargs):
+    change_counter(Post, instance.post_id, 'likes_count', -1)
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Post, instance.post_id, 'comments_count', 1)
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    change_counter(Post, instance.post_id, 'comments_count', -1)
+
+@receiver(post_save, sender=CommentLike)
+def count_comment_like(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Comment, instance.comment_id, 'likes_count', 1)
+
+@receiver(post_delete, sender=CommentLike)
+def uncount_comment_like(sender, instance, **kwargs):
+    change_counter(Comment, instance.comment_id, 'likes_count', -1)
+
+@receiver(post_save, sender=HostAuthenticator)
+@receiver(post_delete, sender=HostAuthenticator)
+@receiver(post_save, sender=RegistrationSettings)
+@receiver(post_delete, sender=RegistrationSettings)
+def invalidate_auth_cache(sender, instance, **kwargs):
+    clear_auth_cache()
+
+# The serialized API pages are cached by the versions of the resources they
+# show (see api_cache.py). Saving or deleting an object bumps the versions of
+# every page it appears on. Bulk writes skip these signals, so they bump the
+# versions themselves.
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def invalidate_author_pages(sender, instance, **kwargs):
+    bump_api_versions('authors')
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    bump_api_versions(f'posts:{instance.author_id}')
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):
+    # posts show their latest comments
+    post_author_id = Post.objects.filter(pk=instance.post_id).values_list('author_id', flat=True).first()
+    bump_api_versions(f'comments:{instance.post_id}', f'posts:{post_author_id}')
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def invalidate_like_pages(sender, instance, **kwargs):
+    bump_api_versions(f'post-likes:{instance.post_id}', f'liked:{instance.author_id}')
+
+@receiver(post_save, sender=CommentLike)
+@receiver(post_delete, sender=CommentLike)
+def invalidate_comment_like_pages(sender, instance, **kwargs):
+    bump_api_versions(f'comment-likes:{instance.comment_id}', f'liked:{instance.author_id}')
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_pages(sender, instance, **kwargs):
+    bump_api_versions(f'followers:{instance.following_id}')
+
+def reconcile_counters():
+    """Recounts every counter from the rows it counts. Returns the number of
+    counters that were wrong."""
+
+    def count_of(model, field):
+        counts = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(total=Count('pk')).values('total')
+        return Coalesce(Subquery(counts), 0)
+
+    fixed = 0
+    for model, counters in [
+        (Author, {'followers_count': count_of(Follow, 'following'), 'followings_count': count_of(Follow, 'follower')}),
+        (Post, {'likes_count': count_of(Like, 'post'), 'comments_count': count_of(Comment, 'post')}),
+        (Comment, {'likes_count': count_of(CommentLike, 'comment')}),
+    ]:
+        for field, expected in counters.items():
+            wrong = model.objects.annotate(expected=expected).exclude(**{field: F('expected')})
+            fixed += model.objects.filter(pk__in=wrong.values('pk')).update(**{field: expected})
+
+    return fixed
+
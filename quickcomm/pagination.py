@@ -1,6 +1,19 @@
+import base64
+import json
 
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Pages are numbered by default, with the page and size params peers expect.
+# Numbered pages take a COUNT(*) and an OFFSET, so deep pages get slower the
+# deeper they are. Clients can opt into cursor pages instead by passing
+# ?cursor= (empty for the first page). Cursor pages seek past the last item
+# of the previous page on the ordering of the list, skip the count, and link
+# to the next page in the 'next' field of the usual response.
 
 class BasePagination(PageNumberPagination):
     page_size_query_param = 'size'
@@ -10,6 +23,65 @@ class BasePagination(PageNumberPagination):
     upper_response_param = None
     upper_url = None
 
+    cursor_query_param = 'cursor'
+    # The ordering of the list, which must end in a unique field. A leading
+    # '-' sorts that field newest first.
+    ordering = ('id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+
+        # lists without an ordering would come back in any order, so the same
+        # item could show up on two pages
+        queryset = queryset.order_by(*self.ordering)
+
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        size = self.get_page_size(request)
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            queryset = queryset.filter(self.seek(self.decode_cursor(queryset.model, cursor)))
+
+        # one more item is fetched to know if there is a next page
+        items = list(queryset[:size + 1])
+        self.next_cursor = self.encode_cursor(items[size - 1]) if len(items) > size else None
+        return items[:size]
+
+    def seek(self, values):
+        """Returns the filter for the items after the given values of the
+        ordering fields: those after the first value, or equal to it and after
+        the second value, and so on."""
+        seek = Q()
+        for i, field in enumerate(self.ordering):
+            after = '__lt' if field.startswith('-') else '__gt'
+            equal = {self.ordering[j].lstrip('-'): values[j] for j in range(i)}
+            seek |= Q(**equal) & Q(**{field.lstrip('-') + after: values[i]})
+        return seek
+
+    def encode_cursor(self, item):
+        """Returns the cursor of the items after the given item."""
+        values = [item._meta.get_field(field.lstrip('-')).value_to_string(item) for field in self.ordering]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, model, cursor):
+        """Returns the values of the ordering fields in the cursor."""
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            return [model._meta.get_field(field.lstrip('-')).to_python(value) for field, value in zip(self.ordering, values)]
+        except (TypeError, ValueError, UnicodeError, ValidationError):
+            raise NotFound('Invalid cursor')
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
     # TODO add id properly
     def get_paginated_response(self, data):
         mymap = {
@@ -19,15 +91,19 @@ class BasePagination(PageNumberPagination):
             mymap[self.upper_response_param] = self.upper_url
 
         mymap.update({'type': self.response_type,
-            'page': self.page.number,
+            'page': None if self.cursor_mode else self.page.number,
             'size': self.get_page_size(self.request),
             self.response_data_field: data })
 
+        if self.cursor_mode:
+            mymap['next'] = self.get_next_link()
+
         return Response(data=mymap)
 
 class CommentsPagination(BasePagination):
     response_type = 'comments'
     response_data_field = 'comments'
+    ordering = ('published', 'id')
 
 class AuthorsPagination(BasePagination):
     response_type = 'authors'
@@ -40,6 +116,7 @@ class FollowersPagination(BasePagination):
 class PostsPagination(BasePagination):
     response_type = 'posts'
     response_data_field = 'items'
+    ordering = ('-published', '-id')
 
 class PostLikesPagination(BasePagination):
     response_type = 'likes'
@@ -51,4 +128,4 @@ class CommentLikesPagination(BasePagination):
 
 class AuthorLikedPagination(BasePagination):
     response_type = 'liked'
-    response_data_field = 'items'
\ No newline at end of file
+    response_data_field = 'items'
@@ -0,0 +1,50 @@
+# This file contains the JSON renderer and parser for the API. Peers pull large
+# pages of posts, some with base64 images in them, so rendering and parsing
+# JSON is a large share of the time spent on them. When orjson is installed,
+# it is used for both. Otherwise, these fall back to the standard library, the
+# same as DRF's own JSON renderer and parser.
+#
+# orjson handles UUIDs and datetimes natively, and writes datetimes the way
+# DRF does (ISO 8601, with 'Z' for UTC). Anything else it does not know is
+# handed to DRF's encoder. The output is the same JSON, except that it is not
+# pretty-printed (the browsable API asks for indentation, so it falls back).
+
+from rest_framework import renderers, parsers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """A JSON renderer that uses orjson when it is installed."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # orjson can only indent by two spaces, so indented output is left to
+        # the standard library
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        return orjson.dumps(data, default=JSONEncoder().default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONParser(parsers.JSONParser):
+    """A JSON parser that uses orjson when it is installed."""
+
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return orjson.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
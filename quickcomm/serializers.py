@@ -1,16 +1,19 @@
-import base64
 from rest_framework import serializers
 from rest_framework_nested.relations import NestedHyperlinkedRelatedField
-from rest_framework.reverse import reverse
 from django.urls import reverse as django_reverse
-from .models import Author, FollowRequest, ImageFile, Post, Comment, Follow, Like
+from django.db.models import OuterRef, Prefetch, Subquery
+from .models import Author, FollowRequest, Post, PostImage, Comment, Follow, Like
 from .pagination import CommentsPagination
-from django.core.paginator import Paginator
+from .urlbuilder import api_url, get_base_url
 
 
 # This file contains the serializers for the API. Serializers are used to convert
 # model objects into JSON.
 
+# Every serializer that follows a relation has a prefetch() method, which adds
+# what it follows to a queryset. Viewsets call it on their querysets, so a page
+# takes the same number of queries no matter how many items are on it.
+
 # TODO check for the case where we have a temporary author.
 # we don't want the host to be us
 
@@ -35,8 +38,8 @@ class AuthorSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if obj.external_url is not None:
             return obj.external_url.split("/authors/")[0]
-        if obj.host is None:
-            return request.build_absolute_uri("/api/")
+        if obj.host_id is None:
+            return get_base_url(request) + "/api/"
         return obj.host.url
 
     def get_id(self, obj):
@@ -45,11 +48,17 @@ class AuthorSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if obj.external_url is not None:
             return obj.external_url
-        if obj.host is None:
-            return request.build_absolute_uri(reverse('api:author-detail', args=[obj.id]))
+        if obj.host_id is None:
+            return api_url('api:author-detail', request, pk=obj.id)
         else:
             return obj.external_url
 
+    @staticmethod
+    def prefetch(queryset, prefix=''):
+        """Returns the queryset with what the serializer follows, for authors
+        found at prefix (e.g. 'author__')."""
+        return queryset.select_related(prefix + 'host')
+
 
     @staticmethod
     def get_examples():
@@ -95,7 +104,12 @@ class CommentSerializer(serializers.ModelSerializer):
         """This method defines a custom getter that returns the absolute URL of
         the post as the ID."""
         request = self.context.get('request')
-        return request.build_absolute_uri(reverse('api:comment-detail', kwargs={'pk': obj.id.__str__(), 'posts_pk': obj.post_id.__str__(), 'authors_pk': obj.post.author_id.__str__()}))
+        return api_url('api:comment-detail', request, authors_pk=obj.post.author_id, posts_pk=obj.post_id, pk=obj.id)
+
+    @staticmethod
+    def prefetch(queryset):
+        """Returns the queryset with what the serializer follows."""
+        return AuthorSerializer.prefetch(queryset.select_related('post', 'author'), 'author__')
 
     @staticmethod
     def get_examples():
@@ -181,59 +195,65 @@ class PostSerializer(serializers.ModelSerializer):
     comments = serializers.SerializerMethodField(method_name='get_comments')
     count = serializers.IntegerField(required=False, read_only=True)
 
-    def get_content(self, obj):
-        if obj.content_type == Post.PostType.JPG or obj.content_type == Post.PostType.PNG:
-            # find the image in the media folder
-
-            try:
-                img = ImageFile.objects.get(post_id=obj.id)
-            except Exception as e:
-                return obj.content
+    # the number of comments embedded in each post
+    COMMENTS_SRC_SIZE = 10
 
-            # convert the image to base64
-            with open(img.image.path, "rb") as image_file:
-                encoded_string = base64.b64encode(image_file.read())
-                return encoded_string.decode('utf-8')
+    @staticmethod
+    def prefetch(queryset):
+        """Returns the queryset with what the serializer follows. The first
+        comments of every post are fetched in one query, by limiting the
+        comments of each post in a subquery."""
+
+        first_comments = Comment.objects.filter(pk__in=Subquery(
+            Comment.objects.filter(post=OuterRef('post')).order_by('published', 'id').values('pk')[:PostSerializer.COMMENTS_SRC_SIZE]
+        )).order_by('published', 'id')
+
+        queryset = queryset.select_related('author', 'postcontent').annotate(
+            image_etag=Subquery(PostImage.objects.filter(post=OuterRef('pk')).values('etag')[:1]),
+        ).prefetch_related(
+            Prefetch('comment_set', queryset=CommentSerializer.prefetch(first_comments), to_attr='first_comments'),
+        )
+        return AuthorSerializer.prefetch(queryset, 'author__')
 
-        return obj.content
+    def get_content(self, obj):
+        # images are encoded from their post image, and the encoding is cached
+        return obj.content_formatted
     
     def get_source(self,obj):
         request = self.context.get('request')
         if not obj.source:
-            return request.build_absolute_uri(reverse('api:post-detail', kwargs={'authors_pk': obj.author_id.__str__(), 'pk': obj.id.__str__()}))
+            return api_url('api:post-detail', request, authors_pk=obj.author_id, pk=obj.id)
         else:
             return obj.source
         
     def get_origin(self, obj):
         request = self.context.get('request')
         if not obj.origin:
-            return request.build_absolute_uri(reverse('api:post-detail', kwargs={'authors_pk': obj.author_id.__str__(), 'pk': obj.id.__str__()}))
+            return api_url('api:post-detail', request, authors_pk=obj.author_id, pk=obj.id)
         else:
             return obj.origin
 
     
 
     def get_comments(self, obj):
-        return self.context.get('request').build_absolute_uri(
-        reverse('api:comment-list', kwargs={'authors_pk': obj.author_id.__str__(), 'posts_pk': obj.id.__str__()}))
+        return api_url('api:comment-list', self.context.get('request'), authors_pk=obj.author_id, posts_pk=obj.id)
 
     def get_comments_src(self, obj):
-        page = 1,
-        size = 10
+        page = 1
+        size = self.COMMENTS_SRC_SIZE
         request = self.context.get('request')
 
-
-        comments = Comment.objects.filter(post_id=obj.id).order_by('published')
-        paginator = Paginator(comments, size)
-        comments = paginator.get_page(page)
+        # posts from prefetch() already have their first comments
+        comments = getattr(obj, 'first_comments', None)
+        if comments is None:
+            comments = CommentSerializer.prefetch(Comment.objects.filter(post_id=obj.id).order_by('published', 'id'))[:size]
         serializer = CommentSerializer(comments, many=True, context={'request': request})
         return {
             "type": "comments",
             "page": page,
             "size": size,
-            "post": request.build_absolute_uri(reverse('api:post-detail', kwargs={'authors_pk': obj.author_id.__str__(), 'pk': obj.id.__str__()})),
-            "id": request.build_absolute_uri(reverse('api:comment-list', kwargs={'authors_pk': obj.author_id.__str__(), 'posts_pk': obj.id.__str__()
-                                                                             })),
+            "post": api_url('api:post-detail', request, authors_pk=obj.author_id, pk=obj.id),
+            "id": api_url('api:comment-list', request, authors_pk=obj.author_id, posts_pk=obj.id),
             "comments": serializer.data,
         }
 
@@ -309,7 +329,7 @@ class PostSerializer(serializers.ModelSerializer):
         """This method defines a custom getter that returns the absolute URL of
         the post as the ID."""
         request = self.context.get('request')
-        return request.build_absolute_uri(reverse('api:post-detail', kwargs={'pk': obj.id.__str__(), 'authors_pk': obj.author_id.__str__()}))
+        return api_url('api:post-detail', request, authors_pk=obj.author_id, pk=obj.id)
 
     class Meta:
         model = Post
@@ -375,7 +395,7 @@ class CommentActivitySerializer(serializers.ModelSerializer):
             if obj.post.external_url:
                 return obj.post.external_url
             request = self.context.get('request')
-            return request.build_absolute_uri(reverse('api:post-detail', kwargs={'authors_pk': obj.author_id.__str__(), 'posts_pk': obj.post_id.__str__()}))
+            return api_url('api:post-detail', request, authors_pk=obj.post.author_id, pk=obj.post_id)
 
         def get_summary(self, obj):
             return obj.author.display_name.__str__() + " commented on your post"
@@ -396,11 +416,16 @@ class LikeActivitySerializer(serializers.ModelSerializer):
     author = AuthorSerializer(read_only=True)
     object = serializers.SerializerMethodField()
 
+    @staticmethod
+    def prefetch(queryset):
+        """Returns the queryset with what the serializer follows."""
+        return AuthorSerializer.prefetch(queryset.select_related('author', 'post'), 'author__')
+
     def get_object(self, obj):
         if obj.post.external_url:
             return obj.post.external_url
         request = self.context.get('request')
-        return request.build_absolute_uri(reverse('api:post-detail', kwargs={'pk': obj.post_id.__str__(), 'authors_pk': obj.author_id.__str__()}))
+        return api_url('api:post-detail', request, authors_pk=obj.post.author_id, pk=obj.post_id)
 
     def get_summary(self, obj):
         return obj.author.display_name.__str__() + " Likes your post"
@@ -440,11 +465,16 @@ class CommentLikeActivitySerializer(serializers.ModelSerializer):
     author = AuthorSerializer(read_only=True)
     object = serializers.SerializerMethodField()
 
+    @staticmethod
+    def prefetch(queryset):
+        """Returns the queryset with what the serializer follows."""
+        return AuthorSerializer.prefetch(queryset.select_related('author', 'comment__post'), 'author__')
+
     def get_object(self, obj):
         if obj.comment.external_url:
             return obj.comment.external_url
         request = self.context.get('request')
-        return request.build_absolute_uri(reverse('api:comment-detail', kwargs={'pk': obj.comment_id.__str__(), 'authors_pk': obj.author_id.__str__(), 'posts_pk': obj.comment.post_id.__str__()}))
+        return api_url('api:comment-detail', request, authors_pk=obj.comment.post.author_id, posts_pk=obj.comment.post_id, pk=obj.comment_id)
 
     def get_summary(self, obj):
         return obj.author.display_name.__str__() + " Likes your comment"
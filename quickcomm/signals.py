@@ -1,38 +1,175 @@
-
 # This class dispatches external inbox items when they are added to the inbox.
 # It uses the signal system to do this, as we cannot properly import the
 # model serializers in the model classes.
+#
+# Items are not sent straight away. They are serialized and queued in the
+# outbox when they are saved, and the deliver_outbox worker sends them to the
+# remote host outside of the request, retrying with backoff when it fails.
+# Items for other QuickComm nodes are sent to their shared inbox, many in one
+# request.
+
+# The most outbox items sent to a shared inbox in one request.
+SHARED_INBOX_SIZE = 200
+
+import json
+import logging
+from django.db import transaction
+from django.utils import timezone
 
 
 def export_http_request_on_inbox_save(sender):
+    """Queue an inbox item for delivery if it belongs to a remote author."""
+    export_http_requests_on_inbox_create([sender])
+
+
+def export_http_requests_on_inbox_create(items):
+    """Queue a batch of new inbox items for delivery to the remote authors
+    among them. Each object is serialized once for the whole batch, and the
+    outbox entries are written with a single insert."""
 
     # import here to avoid circular imports
     from quickcomm.external_host_deserializers import get_request_class_from_host
-    from quickcomm.models import Inbox
-    import logging
+    from quickcomm.models import OutboxItem
 
-    logging.info(f"Inbox item added {sender}, sending to external host")
-
-    # skip if the author is not external
-    if not sender.author.is_remote or not sender.author.host:
+    # skip the authors that are not external
+    items = [item for item in items if item.author.is_remote and item.author.host]
+    if not items:
         return
 
+    logging.info(f"Queueing {len(items)} inbox items for external hosts")
+
+    payloads = {}
+    outbox = []
+    for item in items:
+        host = item.author.host
+        req = get_request_class_from_host(host)
+
+        # the payload is the same for every recipient of the same object
+        key = (req.serializers, item.inbox_type, item.object_id)
+        if key not in payloads:
+            try:
+                payloads[key] = req.serialize_inbox_item(item.inbox_type, item.content_object)
+            except Exception as e:
+                logging.error(f'Could not serialize {item} for the outbox.', exc_info=True)
+                payloads[key] = None
+
+        if payloads[key] is not None:
+            outbox.append(OutboxItem(inbox=item, host=host, payload=payloads[key]))
+
+    OutboxItem.objects.bulk_create(outbox)
+
+
+def deliver_outbox_item(item):
+    """Send a queued outbox item to the inbox of its remote author. Returns
+    True if the remote host accepted it."""
+
+    # import here to avoid circular imports
+    from quickcomm.external_host_deserializers import get_request_class_from_host
+
+    req = get_request_class_from_host(item.host)
+    return req.deliver_inbox_item(item.inbox.author, item.inbox.inbox_type, item.payload)
+
+
+def deliver_outbox_batch(req, items):
+    """Send outbox items for the same host to its shared inbox, in requests of
+    at most SHARED_INBOX_SIZE items. Items with the same payload go out as
+    one activity for all of their authors. Returns the items that have to be
+    sent one by one, because the host has no shared inbox."""
+
+    # import here to avoid circular imports
+    from quickcomm.host_health import HostUnavailable, get_breaker
+
+    for start in range(0, len(items), SHARED_INBOX_SIZE):
+        batch = items[start:start + SHARED_INBOX_SIZE]
+
+        groups = {}
+        for item in batch:
+            key = (item.inbox.inbox_type, json.dumps(item.payload, sort_keys=True))
+            groups.setdefault(key, []).append(item)
+        groups = list(groups.values())
+
+        try:
+            results = req.deliver_to_shared_inbox([([item.inbox.author for item in group], group[0].inbox.inbox_type, group[0].payload) for group in groups])
+            if results is not None and len(results) != len(groups):
+                raise ValueError('The shared inbox did not answer for every activity.')
+        except HostUnavailable as e:
+            # the host is down, so nothing was sent and the attempt does not
+            # count towards giving up, for this batch or the ones after it
+            retry_at = get_breaker(req.host_obj).retry_at()
+            for item in items[start:]:
+                item.postpone(retry_at, str(e))
+            return []
+        except Exception as e:
+            logging.warning(f'Could not deliver {len(batch)} items to the shared inbox of {req.host_obj}.', exc_info=True)
+            for item in batch:
+                item.mark_failed(str(e))
+            continue
+
+        if results is None:
+            return items[start:]
+
+        for group, result in zip(groups, results):
+            for item in group:
+                if result.get('delivered'):
+                    item.mark_delivered()
+                else:
+                    # an item the host will never accept, like one for an
+                    # author it does not have, is not sent again
+                    item.mark_failed(result.get('error') or 'The remote inbox did not accept the item.',
+                                     retry=not result.get('permanent'))
+
+    return []
+
+
+def deliver_pending_outbox_items(limit=200):
+    """Claim up to limit outbox items that are due and try to deliver them.
+    Items for hosts with a shared inbox are sent together, and the others
+    one by one. Returns the number of items that were claimed."""
+
+    # import here to avoid circular imports
+    from quickcomm.external_host_deserializers import get_request_class_from_host
+    from quickcomm.host_health import HostUnavailable, get_breaker
+    from quickcomm.models import OutboxItem
+
+    now = timezone.now()
+
+    # Claim a batch by pushing its next attempt past the lease. Rows another
+    # worker has locked are skipped, so two workers never send the same item.
+    with transaction.atomic():
+        items = list(OutboxItem.objects.select_for_update(skip_locked=True, of=('self',))
+                     .select_related('inbox__author', 'host')
+                     .filter(status=OutboxItem.OutboxStatus.PENDING, next_attempt__lte=now)
+                     .order_by('next_attempt')[:limit])
+        OutboxItem.objects.filter(id__in=[item.id for item in items]).update(next_attempt=now + OutboxItem.LEASE)
+
+    single = []
+    shared = {}
+    for item in items:
+        if get_request_class_from_host(item.host).shared_inbox:
+            shared.setdefault(item.host_id, []).append(item)
+        else:
+            single.append(item)
+
+    for host_items in shared.values():
+        single += deliver_outbox_batch(get_request_class_from_host(host_items[0].host), host_items)
+
+    for item in single:
+        try:
+            success = deliver_outbox_item(item)
+            error = None if success else 'The remote inbox did not accept the item.'
+        except HostUnavailable as e:
+            # the host is down, so nothing was sent and the attempt does not
+            # count towards giving up
+            item.postpone(get_breaker(item.host).retry_at(), str(e))
+            continue
+        except Exception as e:
+            logging.warning(f'Could not deliver {item}.', exc_info=True)
+            success = False
+            error = str(e)
+
+        if success:
+            item.mark_delivered()
+        else:
+            item.mark_failed(error)
 
-    # determine the type of the inbox item
-    inbox_type = sender.inbox_type
-    author = sender.author
-    obj = sender.content_object
-    req = get_request_class_from_host(author.host)
-
-    if inbox_type == Inbox.InboxType.POST:
-        req.send_post(obj, author)
-    elif inbox_type == Inbox.InboxType.COMMENT:
-        req.send_comment(obj, author)
-    elif inbox_type == Inbox.InboxType.LIKE:
-        req.send_post_like(obj, author)
-    elif inbox_type == Inbox.InboxType.COMMENTLIKE:
-        req.send_comment_like(obj, author)
-    elif inbox_type == Inbox.InboxType.FOLLOW:
-        req.send_follow(obj, author)
-
-    return
\ No newline at end of file
+    return len(items)
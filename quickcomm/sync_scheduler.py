@@ -0,0 +1,146 @@
+# This file contains the scheduler that keeps our copies of remote hosts up to
+# date. It is run by the sync_scheduler worker, in its own process, so page
+# views never start syncs themselves. There is a schedule for the authors of
+# every host, and for the posts and the followers of every remote author.
+#
+# The interval of a schedule adapts to the list it syncs: it is halved when a
+# sync finds changes and doubled when it does not, between MIN_INTERVAL and
+# MAX_INTERVAL. Busy peers are polled often, and idle ones back off
+# exponentially. At most a given number of syncs run at the same time, across
+# all hosts. Requests to each host are also limited separately in
+# external_host_requests.
+
+import datetime
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from quickcomm.external_host_deserializers import sync_authors, sync_followers, sync_posts
+from quickcomm.models import Author, Follow, Host, Post, SyncSchedule
+
+MIN_INTERVAL = 60
+MAX_INTERVAL = 6 * 60 * 60
+
+# The default number of syncs that run at the same time.
+CONCURRENCY = 8
+
+# Next runs are spread by up to this fraction of the interval, so schedules
+# created together do not stay in step.
+JITTER = 0.1
+
+SYNC_FUNCTIONS = {
+    SyncSchedule.Kind.HOST_AUTHORS: lambda schedule: sync_authors(schedule.host),
+    SyncSchedule.Kind.AUTHOR_POSTS: lambda schedule: sync_posts(schedule.author),
+    SyncSchedule.Kind.AUTHOR_FOLLOWERS: lambda schedule: sync_followers(schedule.author),
+}
+
+def update_sync_schedules():
+    """Makes sure there is a schedule for every host and remote author.
+    Schedules of hosts and authors that are deleted go with them."""
+    existing = set(SyncSchedule.objects.values_list('kind', 'host_id', 'author_id'))
+
+    wanted = [(SyncSchedule.Kind.HOST_AUTHORS, host_id, None) for host_id in Host.objects.values_list('id', flat=True)]
+    for author_id in Author.objects.exclude(host=None).exclude(external_url=None).values_list('id', flat=True):
+        wanted.append((SyncSchedule.Kind.AUTHOR_POSTS, None, author_id))
+        wanted.append((SyncSchedule.Kind.AUTHOR_FOLLOWERS, None, author_id))
+
+    SyncSchedule.objects.bulk_create([SyncSchedule(kind=kind, host_id=host_id, author_id=author_id)
+        for kind, host_id, author_id in wanted if (kind, host_id, author_id) not in existing])
+
+def get_fingerprint(schedule):
+    """Returns a summary of the local copy of the list a schedule syncs. Syncs
+    only write the rows that changed, so it only changes when they do."""
+    if schedule.kind == SyncSchedule.Kind.HOST_AUTHORS:
+        return Author.objects.filter(host=schedule.host_id).aggregate(count=Count('pk'), updated=Max('updated_at'))
+    if schedule.kind == SyncSchedule.Kind.AUTHOR_POSTS:
+        return Post.objects.filter(author=schedule.author_id).aggregate(count=Count('pk'), updated=Max('updated_at'))
+    return Follow.objects.filter(following=schedule.author_id).aggregate(count=Count('pk'), newest=Max('pk'))
+
+def get_next_run(now, interval):
+    """Returns when a schedule with the given interval runs next."""
+    return now + datetime.timedelta(seconds=interval * (1 + random.uniform(-JITTER, JITTER)))
+
+def claim_sync(schedule):
+    """Moves the next run of a due schedule past its interval, so no other
+    scheduler picks it up while it runs. Returns false if another scheduler
+    claimed it first."""
+    now = timezone.now()
+    return SyncSchedule.objects.filter(pk=schedule.pk, next_run=schedule.next_run).update(next_run=get_next_run(now, schedule.interval)) == 1
+
+def run_sync(schedule):
+    """Runs the sync of a schedule and adapts its interval to whether the
+    sync found changes."""
+    before = get_fingerprint(schedule)
+    start = time.monotonic()
+    now = timezone.now()
+    error = None
+    try:
+        SYNC_FUNCTIONS[schedule.kind](schedule)
+    except Exception as e:
+        logging.error(f'Could not run the sync of {schedule}.', exc_info=True)
+        error = str(e)
+
+    changed = error is None and get_fingerprint(schedule) != before
+    if changed:
+        schedule.interval = max(MIN_INTERVAL, schedule.interval // 2)
+        schedule.last_changed = now
+    else:
+        schedule.interval = min(MAX_INTERVAL, schedule.interval * 2)
+
+    schedule.last_run = now
+    schedule.last_duration = time.monotonic() - start
+    schedule.last_error = error
+    schedule.next_run = get_next_run(timezone.now(), schedule.interval)
+    schedule.save(update_fields=['interval', 'last_run', 'last_duration', 'last_changed', 'last_error', 'next_run'])
+    return changed
+
+def hurry_author_syncs(author):
+    """Makes the syncs of a remote author due, so someone looking at the author
+    sees fresh posts soon. Authors synced in the last MIN_INTERVAL seconds
+    are left alone."""
+    now = timezone.now()
+    recent = now - datetime.timedelta(seconds=MIN_INTERVAL)
+    SyncSchedule.objects.filter(author=author, next_run__gt=now).exclude(last_run__gt=recent).update(next_run=now)
+
+class SyncScheduler:
+    """Runs due syncs on a pool of threads, with at most concurrency of them
+    running at the same time."""
+
+    def __init__(self, concurrency=CONCURRENCY):
+        self.concurrency = concurrency
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='quickcomm-sync')
+        self.running = {}
+
+    def run_due(self):
+        """Starts as many due syncs as the budget allows, oldest first.
+        Returns the number of syncs started."""
+        self.running = {pk: future for pk, future in self.running.items() if not future.done()}
+        budget = self.concurrency - len(self.running)
+        if budget <= 0:
+            return 0
+
+        started = 0
+        due = SyncSchedule.objects.filter(next_run__lte=timezone.now()).exclude(pk__in=self.running.keys()).select_related('host', 'author__host').order_by('next_run')
+        for schedule in due[:budget]:
+            if claim_sync(schedule):
+                self.running[schedule.pk] = self.pool.submit(self._run, schedule)
+                started += 1
+        return started
+
+    def wait(self):
+        """Waits for the running syncs to finish."""
+        for future in list(self.running.values()):
+            future.result()
+        self.running = {}
+
+    def _run(self, schedule):
+        try:
+            run_sync(schedule)
+        finally:
+            # every thread has its own database connection
+            connection.close()
@@ -1,8 +1,5 @@
 from django import template
-from datetime import datetime
-from dateutil import parser
 
-from quickcomm.external_requests import get_github_message, get_github_url
 from quickcomm.models import Follow
 
 
@@ -37,16 +34,15 @@ def streamfollow(inbox_content):
     follow = inbox_content.content_object
     time = inbox_content.added
 
-    is_following = Follow.objects.filter(following=follow.to_user, follower=follow.from_user).exists()
+    # the stream precomputes this for the whole page
+    is_following = getattr(follow, 'is_following', None)
+    if is_following is None:
+        is_following = Follow.objects.filter(following=follow.to_user, follower=follow.from_user).exists()
     return {'follow': follow, 'time': time, 'is_following': is_following}
 
 @register.inclusion_tag('streamgh.html')
-def streamgh(stream):
-    time = parser.parse(stream["created_at"])
-    message = get_github_message(stream)
-    url = get_github_url(stream)
-
-    return {'stream': stream, 'time': time, 'message': message, 'url': url}
+def streamgh(event):
+    return {'event': event, 'time': event.created}
 
 @register.inclusion_tag('minipost.html')
 def minipost(post):
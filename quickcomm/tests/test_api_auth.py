@@ -0,0 +1,81 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from django.contrib.auth.models import User
+from quickcomm.models import Author, HostAuthenticator, RegistrationSettings, clear_auth_cache
+
+class PeerAuthenticationTests(TestCase):
+    """This set of tests checks that peers authenticate with Basic auth, and
+    that the settings and credentials they are checked against are cached."""
+
+    def setUp(self):
+        clear_auth_cache()
+        self.client = APIClient()
+
+        RegistrationSettings.objects.create()
+        self.user = User.objects.create_user(username='rajan', password='badpassword')
+        self.author = Author.objects.create(user=self.user, display_name='My Real Cool Name', github='https://github.com/rajanmaghera', profile_image='https://url.com')
+        self.authenticator = HostAuthenticator.objects.create(username='peer', password='apikey')
+
+    def get(self, username, password):
+        self.client.credentials(HTTP_AUTHORIZATION='Basic ' + HostAuthenticator(username=username, password=password).base64string)
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            return self.client.get('/api/authors/{}/'.format(self.author.id))
+
+    def test_peer_credentials(self):
+        """Test that a peer is let in with its credentials only"""
+        self.assertEqual(self.get('peer', 'apikey').status_code, 200)
+        self.assertEqual(self.get('peer', 'wrong').status_code, 403)
+        self.assertEqual(self.get('nobody', 'apikey').status_code, 403)
+
+    def test_no_auth_queries(self):
+        """Test that repeated peer calls do not query the settings or credentials"""
+        self.get('peer', 'apikey')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get('peer', 'apikey').status_code, 200)
+        tables = [HostAuthenticator._meta.db_table, RegistrationSettings._meta.db_table]
+        self.assertFalse([query['sql'] for query in queries if any(table in query['sql'] for table in tables)])
+
+    def test_saving_invalidates(self):
+        """Test that saving credentials or settings takes effect straight away"""
+        self.assertEqual(self.get('peer', 'apikey').status_code, 200)
+
+        self.authenticator.password = 'newkey'
+        self.authenticator.save()
+        self.assertEqual(self.get('peer', 'apikey').status_code, 403)
+        self.assertEqual(self.get('peer', 'newkey').status_code, 200)
+
+        settings = RegistrationSettings.get_cached()
+        settings.allow_api_access_without_login = True
+        settings.save()
+        self.assertEqual(self.get('nobody', 'apikey').status_code, 403)
+        self.client.credentials()
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            self.assertEqual(self.client.get('/api/authors/{}/'.format(self.author.id)).status_code, 200)
+
+    def test_hashed_password(self):
+        """Test that passwords are stored hashed, and still check"""
+        authenticator = HostAuthenticator.objects.get(username='peer')
+        self.assertNotEqual(authenticator.password, 'apikey')
+        self.assertTrue(authenticator.check_password('apikey'))
+        self.assertFalse(authenticator.check_password('wrong'))
+        self.assertIsNone(authenticator.base64string)
+
+        # saving again does not hash the hash
+        authenticator.save()
+        self.assertTrue(HostAuthenticator.objects.get(username='peer').check_password('apikey'))
+
+    def test_verified_credentials(self):
+        """Test that verified credentials skip the password hash, and wrong ones never do"""
+        with mock.patch.object(HostAuthenticator, 'check_password', autospec=True, side_effect=lambda self, password: password == 'apikey') as check:
+            self.assertEqual(self.get('peer', 'apikey').status_code, 200)
+            self.assertEqual(self.get('peer', 'apikey').status_code, 200)
+            self.assertEqual(check.call_count, 1)
+
+            self.assertEqual(self.get('peer', 'wrong').status_code, 403)
+            self.assertEqual(self.get('peer', 'wrong').status_code, 403)
+            self.assertEqual(check.call_count, 3)
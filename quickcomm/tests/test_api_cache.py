@@ -0,0 +1,83 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from django.contrib.auth.models import User
+from quickcomm.api_cache import get_api_versions
+from quickcomm.models import Author, Comment, Like, Post
+
+class APICacheTests(TestCase):
+    """This set of tests checks that serialized API pages are cached, and that
+    changing an object invalidates the pages it is on."""
+
+    def setUp(self):
+        self.client = APIClient()
+
+        self.user = User.objects.create_user(username='rajan', password='badpassword')
+        self.author = Author.objects.create(user=self.user, display_name='My Real Cool Name', github='https://github.com/rajanmaghera', profile_image='https://url.com')
+        self.post = Post.objects.create(author=self.author, title='My Post', description='My Post Description', content_type='text/plain', content='My Post Content', visibility='PUBLIC', unlisted=False, categories='["test"]')
+
+    def get(self, url):
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            self.client.force_login(user=self.user)
+            with CaptureQueriesContext(connection) as queries:
+                req = self.client.get(url)
+            self.assertEqual(req.status_code, 200)
+            return req, len(queries)
+
+    def test_cached_page(self):
+        """Test that a second request for a page is answered from the cache with fewer queries"""
+        url = '/api/authors/{}/posts/'.format(self.author.id)
+        first, first_queries = self.get(url)
+        second, second_queries = self.get(url)
+        self.assertEqual(first.json(), second.json())
+        self.assertLess(second_queries, first_queries)
+
+    def test_new_comment_invalidates(self):
+        """Test that a new comment shows up on cached comment and post pages"""
+        comments_url = '/api/authors/{}/posts/{}/comments/'.format(self.author.id, self.post.id)
+        posts_url = '/api/authors/{}/posts/'.format(self.author.id)
+        self.assertEqual(len(self.get(comments_url)[0].json()['comments']), 0)
+        self.get(posts_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=self.post, author=self.author, comment='Nice')
+        self.assertEqual(len(self.get(comments_url)[0].json()['comments']), 1)
+        self.assertEqual(self.get(posts_url)[0].json()['items'][0]['count'], 1)
+
+    def test_new_like_invalidates(self):
+        """Test that a new like shows up on the cached likes and liked pages"""
+        likes_url = '/api/authors/{}/posts/{}/likes/'.format(self.author.id, self.post.id)
+        liked_url = '/api/authors/{}/liked/'.format(self.author.id)
+        self.assertEqual(len(self.get(likes_url)[0].json()['items']), 0)
+        self.assertEqual(len(self.get(liked_url)[0].json()['items']), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(post=self.post, author=self.author)
+        self.assertEqual(len(self.get(likes_url)[0].json()['items']), 1)
+        self.assertEqual(len(self.get(liked_url)[0].json()['items']), 1)
+
+    def test_updated_post_invalidates(self):
+        """Test that a post updated without save() does not serve the old page"""
+        url = '/api/authors/{}/posts/{}/'.format(self.author.id, self.post.id)
+        self.assertEqual(self.get(url)[0].json()['title'], 'My Post')
+
+        self.post.title = 'New Title'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.update_info(None, self.post.id)
+        self.assertEqual(self.get(url)[0].json()['title'], 'New Title')
+
+    def test_versions_are_bumped_on_commit(self):
+        """Test that a change only invalidates pages once it is committed"""
+        resource = f'posts:{self.author.id}'
+        version = get_api_versions(resource)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.post.title = 'New Title'
+            self.post.save()
+            self.assertEqual(get_api_versions(resource), version)
+
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_api_versions(resource), version)
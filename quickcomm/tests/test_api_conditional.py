@@ -0,0 +1,55 @@
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from django.contrib.auth.models import User
+from quickcomm.models import Author, Comment, Post
+
+class ConditionalRequestTests(TestCase):
+    """This set of tests checks that unchanged API resources are answered with
+    304 Not Modified."""
+
+    def setUp(self):
+        self.client = APIClient()
+
+        self.user = User.objects.create_user(username='rajan', password='badpassword')
+        self.author = Author.objects.create(user=self.user, display_name='My Real Cool Name', github='https://github.com/rajanmaghera', profile_image='https://url.com')
+        self.post = Post.objects.create(author=self.author, title='My Post', description='My Post Description', content_type='text/plain', content='My Post Content', visibility='PUBLIC', unlisted=False, categories='["test"]')
+
+    def get(self, url, **headers):
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            self.client.force_login(user=self.user)
+            return self.client.get(url, **headers)
+
+    def test_unchanged_list(self):
+        """Test that a list returns 304 for a matching ETag, and 200 again once it changes"""
+        url = '/api/authors/{}/posts/'.format(self.author.id)
+        req = self.get(url)
+        self.assertEqual(req.status_code, 200)
+        etag = req['ETag']
+        self.assertIn('Last-Modified', req)
+
+        req = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(req.status_code, 304)
+        self.assertEqual(req.content, b'')
+
+        # a new comment changes the post, as posts embed their comments
+        Comment.objects.create(post=self.post, author=self.author, comment='Nice')
+        req = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(req.status_code, 200)
+        self.assertNotEqual(req['ETag'], etag)
+
+    def test_pages_have_their_own_etag(self):
+        """Test that different pages of the same list do not share an ETag"""
+        first = self.get('/api/authors/?page=1&size=1')
+        second = self.get('/api/authors/?page=1&size=2')
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+    def test_unchanged_detail(self):
+        """Test that a detail endpoint returns 304 for a matching ETag, and 200 once the author changes"""
+        url = '/api/authors/{}/'.format(self.author.id)
+        etag = self.get(url)['ETag']
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.author.display_name = 'New Name'
+        self.author.save()
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
@@ -0,0 +1,124 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from django.contrib.auth.models import User
+from quickcomm.models import Author, Comment, CommentLike, Follow, Host, Like, Post
+
+class QueryCountTests(TestCase):
+    """This set of tests checks that every list endpoint takes the same number
+    of queries no matter how many items are on the page."""
+
+    SIZES = [1, 10, 100]
+
+    def setUp(self):
+        self.client = APIClient()
+
+        self.user = User.objects.create_user(username='rajan', password='badpassword')
+        self.author = Author.objects.create(user=self.user, display_name='My Real Cool Name', github='https://github.com/rajanmaghera', profile_image='https://url.com')
+        self.host = Host.objects.create(url='https://remote.example.com/api/')
+        self.created = 0
+
+    def make_authors(self, n):
+        """Returns n new remote authors."""
+        authors = [Author(host=self.host, external_url=f'https://remote.example.com/api/authors/{self.created + i}', display_name=f'Remote {i}', profile_image='https://url.com') for i in range(n)]
+        self.created += n
+        return Author.objects.bulk_create(authors)
+
+    def make_posts(self, author, n):
+        return Post.objects.bulk_create([Post(author=author, title=f'Post {i}', description='Description', content_type='text/plain', content='Content', visibility='PUBLIC', unlisted=False, categories='["test"]') for i in range(n)])
+
+    def make_comments(self, post, n):
+        return Comment.objects.bulk_create([Comment(post=post, author=author, comment='Nice') for author in self.make_authors(n)])
+
+    def assertConstantQueries(self, make_url):
+        """Checks that the page at make_url(size) takes the same number of
+        queries for every size."""
+        counts = []
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            # log in and load the settings before counting
+            self.client.force_login(user=self.user)
+            self.client.get('/api/authors/{}/'.format(self.author.id))
+
+            for size in self.SIZES:
+                # bulk_create does not invalidate the API cache, so every size
+                # gets its own page
+                url = make_url(size) + '?size=1000&n={}'.format(size)
+                with CaptureQueriesContext(connection) as queries:
+                    req = self.client.get(url)
+                self.assertEqual(req.status_code, 200)
+                counts.append(len(queries))
+        self.assertEqual(len(set(counts)), 1, dict(zip(self.SIZES, counts)))
+
+    def test_authors(self):
+        """Test the query count of the authors list"""
+        def make_url(size):
+            self.make_authors(size)
+            return '/api/authors/'
+        self.assertConstantQueries(make_url)
+
+    def test_followers(self):
+        """Test the query count of the followers list"""
+        def make_url(size):
+            author = self.make_authors(1)[0]
+            Follow.objects.bulk_create([Follow(follower=follower, following=author) for follower in self.make_authors(size)])
+            return '/api/authors/{}/followers/'.format(author.id)
+        self.assertConstantQueries(make_url)
+
+    def test_posts(self):
+        """Test the query count of the posts list, with the comments embedded in each post"""
+        def make_url(size):
+            author = self.make_authors(1)[0]
+            for post in self.make_posts(author, size):
+                self.make_comments(post, 2)
+            return '/api/authors/{}/posts/'.format(author.id)
+        self.assertConstantQueries(make_url)
+
+    def test_comments(self):
+        """Test the query count of the comments list"""
+        def make_url(size):
+            post = self.make_posts(self.author, 1)[0]
+            self.make_comments(post, size)
+            return '/api/authors/{}/posts/{}/comments/'.format(self.author.id, post.id)
+        self.assertConstantQueries(make_url)
+
+    def test_post_likes(self):
+        """Test the query count of the likes of a post"""
+        def make_url(size):
+            post = self.make_posts(self.author, 1)[0]
+            Like.objects.bulk_create([Like(post=post, author=author) for author in self.make_authors(size)])
+            return '/api/authors/{}/posts/{}/likes/'.format(self.author.id, post.id)
+        self.assertConstantQueries(make_url)
+
+    def test_comment_likes(self):
+        """Test the query count of the likes of a comment"""
+        def make_url(size):
+            post = self.make_posts(self.author, 1)[0]
+            comment = self.make_comments(post, 1)[0]
+            CommentLike.objects.bulk_create([CommentLike(comment=comment, author=author) for author in self.make_authors(size)])
+            return '/api/authors/{}/posts/{}/comments/{}/likes/'.format(self.author.id, post.id, comment.id)
+        self.assertConstantQueries(make_url)
+
+    def test_liked(self):
+        """Test the query count of the items liked by an author"""
+        def make_url(size):
+            author = self.make_authors(1)[0]
+            Like.objects.bulk_create([Like(post=post, author=author) for post in self.make_posts(self.author, size)])
+            return '/api/authors/{}/liked/'.format(author.id)
+        self.assertConstantQueries(make_url)
+
+    def test_first_comments(self):
+        """Test that each post embeds only its first comments, in order"""
+        posts = self.make_posts(self.author, 2)
+        comments = self.make_comments(posts[0], 12)
+        self.make_comments(posts[1], 1)
+
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            self.client.force_login(user=self.user)
+            items = self.client.get('/api/authors/{}/posts/'.format(self.author.id)).json()['items']
+
+        embedded = {item['id']: [comment['id'] for comment in item['commentsSrc']['comments']] for item in items}
+        self.assertEqual(sorted(len(ids) for ids in embedded.values()), [1, 10])
+        first = [comment for comment in sorted(comments, key=lambda comment: (comment.published, comment.id))][:10]
+        self.assertIn([str(comment.id) for comment in first], [[url.rstrip('/').split('/')[-1] for url in ids] for ids in embedded.values()])
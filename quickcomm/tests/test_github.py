@@ -0,0 +1,93 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from quickcomm.external_requests import ingest_due_github_feeds, sync_github_feeds
+from quickcomm.models import Author, GitHubEvent, GitHubFeed
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, events=None, headers=None):
+        self.status_code = status_code
+        self.events = events
+        self.headers = headers or {}
+
+    def json(self):
+        return self.events
+
+
+def raw_event(id):
+    return {
+        'id': str(id),
+        'type': 'WatchEvent',
+        'actor': {'login': 'rajanmaghera', 'avatar_url': 'https://avatars.githubusercontent.com/u/16507599?v=4'},
+        'repo': {'name': 'HyperTexts/QuickComm', 'url': 'https://api.github.com/repos/HyperTexts/QuickComm'},
+        'payload': {},
+        'created_at': timezone.now().isoformat(),
+    }
+
+
+class GitHubIngestTests(TestCase):
+    """This set of tests checks that GitHub events are ingested in the
+    background with conditional requests, and that the stream reads them from
+    the database."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='pass1')
+        self.author = Author.objects.create(user=self.user, display_name='user1', github='https://github.com/rajanmaghera')
+
+    @mock.patch('quickcomm.external_requests.session')
+    def test_events_are_ingested(self, session):
+        """Test that events are parsed and stored once, and that the next poll
+        is a conditional request."""
+        session.get.return_value = FakeResponse(200, [raw_event(1), raw_event(2)], {'ETag': '"abc"'})
+
+        sync_github_feeds()
+        self.assertEqual(ingest_due_github_feeds(), 1)
+
+        events = GitHubEvent.objects.order_by('id')
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0].message, 'Starred HyperTexts/QuickComm')
+        self.assertEqual(GitHubFeed.objects.get().etag, '"abc"')
+
+        # the feed is not polled again until it is due
+        self.assertEqual(ingest_due_github_feeds(), 0)
+
+        GitHubFeed.objects.update(next_poll=timezone.now())
+        session.get.return_value = FakeResponse(304)
+        ingest_due_github_feeds()
+
+        self.assertEqual(session.get.call_args[1]['headers']['If-None-Match'], '"abc"')
+        self.assertEqual(GitHubEvent.objects.count(), 2)
+
+    def test_feeds_follow_authors(self):
+        """Test that there is one feed per linked GitHub user, and that feeds
+        nobody links to are removed."""
+        Author.objects.create(display_name='Empty GitHub', github='https://github.com/')
+        sync_github_feeds()
+        self.assertEqual(list(GitHubFeed.objects.values_list('username', flat=True)), ['rajanmaghera'])
+
+        self.author.github = None
+        self.author.save()
+        sync_github_feeds()
+        self.assertEqual(GitHubFeed.objects.count(), 0)
+
+    @mock.patch('quickcomm.external_requests.session')
+    def test_stream_does_not_call_github(self, session):
+        """Test that the stream shows the stored events without calling GitHub."""
+        session.get.return_value = FakeResponse(200, [raw_event(1)])
+        sync_github_feeds()
+        ingest_due_github_feeds()
+        session.reset_mock()
+
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            self.client.login(username='user1', password='pass1')
+            response = self.client.get(reverse('index'))
+
+        session.get.assert_not_called()
+        self.assertEqual([item.format for item in response.context['inbox']], ['github'])
+        self.assertEqual(response.context['inbox'][0].local_author, self.author)
@@ -0,0 +1,90 @@
+import datetime
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from quickcomm.external_host_deserializers import Deserializers, InboxSerializers
+from quickcomm.external_host_requests import InternalQCRequest
+from quickcomm.host_health import FAILURE_THRESHOLD, OPEN_TIMEOUT, HostUnavailable, get_breaker, probe_host
+from quickcomm.models import Author, Host
+
+
+class FakeResponse:
+
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+
+
+class HostHealthTests(TestCase):
+    """This set of tests checks that hosts that are down are skipped by their
+    circuit breaker, and let back in once they answer again."""
+
+    def setUp(self):
+        self.host = Host.objects.create(url='https://remote.example.com/api/', username_password_base64='dXNlcjpwYXNz')
+        self.author = Author.objects.create(host=self.host, external_url='https://remote.example.com/api/authors/1', display_name='Remote')
+        self.req = InternalQCRequest(self.host, Deserializers, InboxSerializers)
+
+    def sync_authors(self, session):
+        self.req._get_list_response(Deserializers.author, 'https://remote.example.com/api/authors',
+                                    lambda item: item, lambda data: data['items'])
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_open_circuit_skips_calls(self, session):
+        """Test that a host that keeps failing is no longer called"""
+        session.get.side_effect = ConnectionError('Remote host is down')
+        for _ in range(FAILURE_THRESHOLD):
+            self.sync_authors(session)
+        self.assertEqual(session.get.call_count, FAILURE_THRESHOLD)
+        self.assertEqual(get_breaker(self.host).state, Host.CircuitState.OPEN)
+
+        self.sync_authors(session)
+        with self.assertRaises(HostUnavailable):
+            self.req.deliver_inbox_item(self.author, 'post', {})
+        self.assertEqual(session.get.call_count, FAILURE_THRESHOLD)
+        session.post.assert_not_called()
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_half_open_trial(self, session):
+        """Test that one call is let through after the timeout, and that it
+        closes the circuit when it works"""
+        breaker = get_breaker(self.host)
+        for _ in range(FAILURE_THRESHOLD):
+            breaker.record_failure()
+
+        breaker.changed = timezone.now() - OPEN_TIMEOUT - datetime.timedelta(seconds=1)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, Host.CircuitState.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, Host.CircuitState.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_state_is_shared_through_the_host(self):
+        """Test that a breaker takes on a newer state written to the host"""
+        breaker = get_breaker(self.host)
+        Host.objects.filter(pk=self.host.pk).update(circuit_state=Host.CircuitState.OPEN, circuit_changed=timezone.now())
+        self.assertFalse(get_breaker(Host.objects.get()).allow())
+        self.assertIs(get_breaker(self.host), breaker)
+
+    @mock.patch('quickcomm.host_health.probe_session')
+    def test_probe(self, probe_session):
+        """Test that probes record the latency of the host and feed its breaker"""
+        probe_session.get.return_value = FakeResponse(404)
+        self.assertTrue(probe_host(self.host))
+        probe_session.get.assert_called_once()
+        self.assertEqual(probe_session.get.call_args[0][0], 'https://remote.example.com/api/')
+
+        host = Host.objects.get()
+        self.assertTrue(host.last_ping_result)
+        self.assertEqual(len(host.latency_samples), 1)
+        self.assertIsNotNone(host.latency_percentile(95))
+
+        probe_session.get.side_effect = ConnectionError('Remote host is down')
+        for _ in range(FAILURE_THRESHOLD):
+            self.assertFalse(host.ping())
+        host = Host.objects.get()
+        self.assertFalse(host.last_ping_result)
+        self.assertEqual(host.circuit_state, Host.CircuitState.OPEN)
+        self.assertEqual(len(host.latency_samples), 1)
@@ -0,0 +1,158 @@
+import io
+import time
+
+import requests
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.test import TestCase
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from quickcomm.http_cache import STATS_KEY, CachedSession, HTTPCache, get_ttl
+
+
+class FakeAdapter(BaseAdapter):
+    """Answers every request with the next of the given responses."""
+
+    def __init__(self, *responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        status_code, headers, content = self.responses.pop(0)
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = content
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class HTTPCacheTests(TestCase):
+    """This set of tests checks that responses from remote hosts are cached
+    for as long as they are fresh, and revalidated after."""
+
+    URL = 'https://remote.example.com/api/authors/1/posts'
+
+    def make_session(self, adapter, disk=None, memory_bytes=1024):
+        session = CachedSession(HTTPCache(disk, memory_bytes))
+        session.mount('https://', adapter)
+        return session
+
+    def test_ttl(self):
+        """Test that the TTL depends on the endpoint, unless the peer sets one"""
+        self.assertEqual(get_ttl(self.URL, {}), 60)
+        self.assertEqual(get_ttl('https://remote.example.com/api/authors/1', {}), 300)
+        self.assertEqual(get_ttl(self.URL, {'Cache-Control': 'max-age=5'}), 5)
+        self.assertEqual(get_ttl(self.URL, {'Cache-Control': 'no-cache'}), 0)
+        self.assertIsNone(get_ttl(self.URL, {'Cache-Control': 'no-store'}))
+
+    def test_fresh_responses_are_served_from_memory(self):
+        """Test that a fresh response is only fetched once"""
+        adapter = FakeAdapter((200, {}, b'{"items": []}'))
+        session = self.make_session(adapter)
+        self.assertEqual(session.get(self.URL).json(), {'items': []})
+        response = session.get(self.URL)
+        self.assertEqual(response.json(), {'items': []})
+        self.assertTrue(response.from_cache)
+        self.assertEqual(len(adapter.requests), 1)
+        self.assertEqual(session.cache.stats()['memory_hits'], 1)
+        self.assertEqual(session.cache.stats()['misses'], 1)
+
+    def test_credentials_are_part_of_the_key(self):
+        """Test that a response is not served to a request with other credentials"""
+        adapter = FakeAdapter((200, {}, b'1'), (200, {}, b'2'))
+        session = self.make_session(adapter)
+        session.get(self.URL, headers={'Authorization': 'Basic a'})
+        self.assertEqual(session.get(self.URL, headers={'Authorization': 'Basic b'}).content, b'2')
+
+    def test_stale_responses_are_revalidated(self):
+        """Test that a stale response is asked for with its ETag, and served
+        again when the peer did not change it"""
+        adapter = FakeAdapter((200, {'ETag': '"v1"', 'Cache-Control': 'max-age=0'}, b'[1]'), (304, {}, b''))
+        session = self.make_session(adapter)
+        session.get(self.URL)
+        response = session.get(self.URL)
+        self.assertEqual(adapter.requests[1].headers['If-None-Match'], '"v1"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [1])
+        self.assertEqual(session.cache.stats()['revalidated'], 1)
+
+    def test_no_store(self):
+        """Test that responses the peer does not want stored are not"""
+        adapter = FakeAdapter((200, {'Cache-Control': 'no-store'}, b'1'), (200, {}, b'2'))
+        session = self.make_session(adapter)
+        session.get(self.URL)
+        self.assertEqual(session.get(self.URL).content, b'2')
+
+    def test_conditional_requests_are_passed_through(self):
+        """Test that requests with their own validators see the peer's answer"""
+        adapter = FakeAdapter((200, {'ETag': '"v1"'}, b'1'), (304, {}, b''))
+        session = self.make_session(adapter)
+        session.get(self.URL)
+        self.assertEqual(session.get(self.URL, headers={'If-None-Match': '"v1"'}).status_code, 304)
+
+    def test_memory_bound_and_disk_tier(self):
+        """Test that the memory tier drops the least recently used responses,
+        and that the disk tier still has them"""
+        disk = LocMemCache('test-http-cache', {})
+        disk.clear()
+        adapter = FakeAdapter((200, {}, b'a' * 600), (200, {}, b'b' * 600))
+        session = self.make_session(adapter, disk=disk)
+        session.get(self.URL + '?page=1')
+        session.get(self.URL + '?page=2')
+        self.assertEqual(session.cache.stats()['memory_entries'], 1)
+
+        self.assertEqual(session.get(self.URL + '?page=1').content, b'a' * 600)
+        self.assertEqual(len(adapter.requests), 2)
+        self.assertEqual(session.cache.stats()['disk_hits'], 1)
+
+    def test_stale_memory_entry_is_refreshed_from_disk(self):
+        """Test that a stale response in memory is replaced by a fresher one
+        another process wrote to the disk tier, without asking the peer"""
+        disk = LocMemCache('test-http-cache', {})
+        disk.clear()
+        adapter = FakeAdapter((200, {'ETag': '"v1"', 'Cache-Control': 'max-age=0'}, b'[1]'))
+        session = self.make_session(adapter, disk=disk)
+        session.get(self.URL)
+
+        # another process fetches the list again
+        other = self.make_session(FakeAdapter((200, {'ETag': '"v2"'}, b'[2]')), disk=disk)
+        self.assertEqual(other.get(self.URL).json(), [2])
+
+        response = session.get(self.URL)
+        self.assertEqual(response.json(), [2])
+        self.assertTrue(response.from_cache)
+        self.assertEqual(len(adapter.requests), 1)
+        self.assertEqual(session.cache.stats()['disk_hits'], 1)
+
+    def test_stats_of_every_process_are_published(self):
+        """Test that the counters of a process are published to the shared
+        cache, and shown with those of the other processes"""
+        caches['api'].delete(STATS_KEY)
+        caches['api'].set(STATS_KEY, {'other:1': {'memory_hits': 2, 'misses': 1, 'published': time.time()}})
+
+        session = CachedSession(HTTPCache(memory_bytes=1024, shared=caches['api']))
+        session.mount('https://', FakeAdapter((200, {}, b'[]')))
+        session.get(self.URL)
+        session.get(self.URL)
+
+        # the counters are published at most every STATS_INTERVAL, so the
+        # second request is not in them yet
+        published = caches['api'].get(STATS_KEY)
+        self.assertEqual(len(published), 2)
+        self.assertEqual([stats['misses'] for process, stats in published.items() if process != 'other:1'], [1])
+
+        out = io.StringIO()
+        call_command('http_cache_stats', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn("'misses': 2", lines[-1])
+        self.assertIn("'memory_hits': 2", lines[-1])
@@ -0,0 +1,103 @@
+import base64
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from quickcomm.external_host_deserializers import PostDeserializer
+from quickcomm.models import Author, Host, ImageFile, Post, PostImage
+from quickcomm.serializers import PostSerializer
+
+# the smallest valid PNG, a single transparent pixel
+PNG = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII=')
+
+
+class PostImageTests(TestCase):
+    """This set of tests checks that images are stored once as binary and
+    served with validators and byte ranges."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='pass1')
+        self.author = Author.objects.create(user=self.user, display_name='user1')
+        self.post = Post.objects.create(author=self.author,
+                                        title='My Image',
+                                        description='My Image Description',
+                                        content_type=Post.PostType.PNG,
+                                        content=base64.b64encode(PNG).decode('utf-8'),
+                                        visibility='PUBLIC',
+                                        unlisted=False,
+                                        categories='["test"]')
+        self.url = f'/api/authors/{self.author.id}/posts/{self.post.id}/image/'
+
+    def get(self, **headers):
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            self.client.login(username='user1', password='pass1')
+            return self.client.get(self.url, **headers)
+
+    def test_image_is_stored_as_binary(self):
+        """Test that the base64 content is decoded once into the post image,
+        and encoded again for federation."""
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.content, '')
+        self.assertEqual(bytes(PostImage.objects.get(post=self.post).data), PNG)
+
+        content = PostSerializer(self.post, context={'request': RequestFactory().get('/')}).data['content']
+        self.assertEqual(base64.b64decode(content), PNG)
+
+    def test_uploaded_image_file(self):
+        """Test that an uploaded image file is stored as the post image, and
+        federated from it without opening the file."""
+        post = Post.objects.create(author=self.author, title='Uploaded Image', description='', content_type=Post.PostType.PNG,
+                                   content='', visibility='PUBLIC', unlisted=False, categories='[]')
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            image_file = ImageFile.objects.create(post=post, image=SimpleUploadedFile('image.png', PNG, content_type='image/png'))
+            self.assertEqual(bytes(PostImage.objects.get(post=post).data), PNG)
+            image_file.image.delete(save=False)
+
+        post = Post.objects.get(pk=post.pk)
+        with CaptureQueriesContext(connection) as queries:
+            content = PostSerializer(post, context={'request': RequestFactory().get('/')}).data['content']
+        self.assertEqual(base64.b64decode(content), PNG)
+        self.assertFalse([query for query in queries if 'imagefile' in query['sql']])
+
+    def test_image_response(self):
+        """Test that the image is served with its ETag and length, and that a
+        client with the same ETag gets a 304."""
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), PNG)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Content-Length'], str(len(PNG)))
+
+        response = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_range(self):
+        """Test that a byte range of the image can be requested."""
+        response = self.get(HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), PNG[:10])
+        self.assertEqual(response['Content-Range'], f'bytes 0-9/{len(PNG)}')
+
+        response = self.get(HTTP_RANGE=f'bytes={len(PNG)}-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_synced_images_are_stored(self):
+        """Test that images of remote posts saved in a batch are stored as
+        binary too."""
+        host = Host.objects.create(url='https://remote.example.com/api', username_password_base64='dXNlcjpwYXNz')
+        remote = Author.objects.create(host=host, display_name='Remote Author', external_url='https://remote.example.com/api/authors/1')
+        data = {'title': 'Remote Image', 'source': None, 'origin': None, 'description': 'Remote Image Description',
+                'content_type': Post.PostType.PNG, 'content': base64.b64encode(PNG).decode('utf-8'),
+                'published': self.post.published, 'visibility': 'PUBLIC', 'unlisted': False,
+                'external_url': 'https://remote.example.com/api/authors/1/posts/1'}
+
+        PostDeserializer.save_batch([data], author=remote)
+        PostDeserializer.save_batch([data], author=remote)
+
+        post = Post.objects.get(author=remote)
+        self.assertEqual(post.content, '')
+        self.assertEqual(bytes(PostImage.objects.get(post=post).data), PNG)
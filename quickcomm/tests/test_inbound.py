@@ -0,0 +1,152 @@
+import datetime
+import io
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from quickcomm.inbound import delete_old_inbox_items, process_pending_inbox_items
+from quickcomm.models import Author, Inbox, Like, Post, RawInboxItem
+
+
+class InboundInboxTests(TestCase):
+    """This set of tests checks that items sent to an inbox are accepted
+    straight away and imported by the worker."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='rajan', password='badpassword')
+        self.author = Author.objects.create(user=self.user, display_name='Local', profile_image='https://url.com')
+        self.post = Post.objects.create(author=self.author, title='Post', description='Description', content_type='text/plain', content='Content', visibility='PUBLIC', unlisted=False, categories='[]')
+
+    def like(self, actor=1):
+        return {
+            'type': 'Like',
+            'summary': 'Remote likes your post',
+            'author': {
+                'type': 'author',
+                'id': 'https://remote.example.com/api/authors/{}'.format(actor),
+                'url': 'https://remote.example.com/api/authors/{}'.format(actor),
+                'host': 'https://remote.example.com/api/',
+                'displayName': 'Remote',
+                'github': None,
+                'profileImage': None,
+            },
+            'object': 'http://testserver/api/authors/{}/posts/{}'.format(self.author.id, self.post.id),
+        }
+
+    def send(self, item, author_id=None):
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            self.client.force_login(user=self.user)
+            return self.client.post('/api/authors/{}/inbox/'.format(author_id or self.author.id), item, format='json')
+
+    def test_item_is_accepted_then_imported(self):
+        """Test that the endpoint only journals the item, and the worker imports it"""
+        req = self.send(self.like())
+        self.assertEqual(req.status_code, 202)
+        self.assertEqual(Like.objects.count(), 0)
+
+        item = RawInboxItem.objects.get()
+        self.assertEqual(item.author, self.author)
+        self.assertEqual(item.status, RawInboxItem.RawInboxStatus.PENDING)
+
+        self.assertEqual(process_pending_inbox_items(), 1)
+        item.refresh_from_db()
+        self.assertEqual(item.status, RawInboxItem.RawInboxStatus.DONE)
+        self.assertEqual(Like.objects.count(), 1)
+        self.assertTrue(Inbox.objects.filter(author=self.author, inbox_type=Inbox.InboxType.LIKE).exists())
+
+    def test_accepting_is_cheap(self):
+        """Test that accepting an item does not import anything"""
+        self.send(self.like())
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            with CaptureQueriesContext(connection) as queries:
+                req = self.client.post('/api/authors/{}/inbox/'.format(self.author.id), self.like(actor=2), format='json')
+        self.assertEqual(req.status_code, 202)
+        # the savepoints of the transaction are not queries
+        queries = [query['sql'] for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertLessEqual(len(queries), 6, queries)
+
+    def test_unknown_author(self):
+        """Test that items for authors that do not exist are turned away"""
+        self.assertEqual(self.send(self.like(), author_id='not-an-id').status_code, 404)
+        self.assertEqual(self.send({'summary': 'no type'}).status_code, 400)
+        self.assertEqual(RawInboxItem.objects.count(), 0)
+
+    def test_invalid_item_fails_and_can_be_replayed(self):
+        """Test that an item that cannot be imported fails without retries,
+        and is imported again by the replay command"""
+        like = self.like()
+        like['object'] = 'http://testserver/api/authors/{}/posts/missing'.format(self.author.id)
+        self.send(like)
+        with self.assertLogs(level='WARNING'):
+            process_pending_inbox_items()
+
+        item = RawInboxItem.objects.get()
+        self.assertEqual(item.status, RawInboxItem.RawInboxStatus.FAILED)
+        self.assertEqual(item.attempts, 1)
+
+        # fix the item, as if the bug in the import was fixed
+        item.data = self.like()
+        item.save()
+        call_command('replay_inbox', '--now', stdout=io.StringIO())
+
+        item.refresh_from_db()
+        self.assertEqual(item.status, RawInboxItem.RawInboxStatus.DONE)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_duplicates_are_dropped(self):
+        """Test that an activity sent again is dropped, whether it is waiting
+        in the journal or was imported, while one that changed is accepted"""
+        self.send(self.like())
+        self.assertEqual(self.send(self.like()).status_code, 200)
+        self.assertEqual(RawInboxItem.objects.count(), 1)
+
+        process_pending_inbox_items()
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            with CaptureQueriesContext(connection) as queries:
+                req = self.client.post('/api/authors/{}/inbox/'.format(self.author.id), self.like(), format='json')
+        self.assertEqual(req.status_code, 200)
+        self.assertEqual(len([query for query in queries if 'quickcomm_receivedactivity' in query['sql']]), 1)
+        self.assertEqual(RawInboxItem.objects.count(), 1)
+
+        # the publish date and the actor's profile do not make a new activity
+        like = self.like()
+        like['published'] = '2023-03-01T00:00:00Z'
+        like['author']['displayName'] = 'Renamed'
+        self.assertEqual(self.send(like).status_code, 200)
+
+        self.assertEqual(self.send(self.like(actor=2)).status_code, 202)
+        self.assertEqual(RawInboxItem.objects.count(), 2)
+
+    def test_failed_item_can_be_sent_again(self):
+        """Test that an activity whose import failed is accepted again when
+        the peer sends it again"""
+        like = self.like()
+        like['object'] = 'http://testserver/api/authors/{}/posts/missing'.format(self.author.id)
+        self.assertEqual(self.send(like).status_code, 202)
+        with self.assertLogs(level='WARNING'):
+            process_pending_inbox_items()
+        self.assertEqual(RawInboxItem.objects.get().status, RawInboxItem.RawInboxStatus.FAILED)
+
+        self.assertEqual(self.send(like).status_code, 202)
+        self.assertEqual(RawInboxItem.objects.filter(status=RawInboxItem.RawInboxStatus.PENDING).count(), 1)
+
+    def test_old_imported_items_are_deleted(self):
+        """Test that imported items are deleted after the retention period,
+        while failed items are kept"""
+        self.send(self.like())
+        like = self.like(actor=2)
+        like['object'] = 'http://testserver/api/authors/{}/posts/missing'.format(self.author.id)
+        self.send(like)
+        with self.assertLogs(level='WARNING'):
+            process_pending_inbox_items()
+
+        self.assertEqual(delete_old_inbox_items(), 0)
+        RawInboxItem.objects.update(processed=timezone.now() - RawInboxItem.RETENTION - datetime.timedelta(minutes=1))
+        self.assertEqual(delete_old_inbox_items(), 1)
+        self.assertEqual(RawInboxItem.objects.get().status, RawInboxItem.RawInboxStatus.FAILED)
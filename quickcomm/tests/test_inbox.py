@@ -2,6 +2,8 @@
 
 from django.test import TestCase
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from quickcomm.models import Author, Comment, Inbox, Post, FollowRequest, Follow, Like, CommentLike
 
@@ -324,3 +326,23 @@ class InternalInboxTests(TestCase):
         self.assertEqual(len(items),1)
         self.assertEqual(items[0].inbox_type,items[0].InboxType.POST)
         self.assertEqual(items[0].content_object.content_type,'image/png;base64')
+
+    def test_post_fan_out_query_count(self):
+        """Test that the number of queries to publish a post does not grow
+        with the number of followers."""
+
+        def publish_with_followers(count):
+            author = Author.objects.create(display_name='Popular Author')
+            for i in range(count):
+                follower = Author.objects.create(display_name=f'Follower {i}')
+                Follow.objects.create(follower=follower, following=author)
+                Follow.objects.create(follower=author, following=follower)
+
+            with CaptureQueriesContext(connection) as queries:
+                Post.objects.create(author=author, title='My Post', description='My Post Description', content_type='text/plain', content='My Post Content', visibility='FRIENDS', unlisted=False, categories='["test"]')
+
+            self.assertEqual(Inbox.objects.filter(author=author, inbox_type=Inbox.InboxType.POST).count(), 1)
+            return len(queries)
+
+        self.assertEqual(publish_with_followers(2), publish_with_followers(20))
+        self.assertEqual(Inbox.objects.filter(inbox_type=Inbox.InboxType.POST).count(), 2 + 1 + 20 + 1)
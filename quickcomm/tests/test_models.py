@@ -1,7 +1,9 @@
 import uuid
 from django.test import TestCase
 from django.contrib.auth.models import User
-from quickcomm.models import Author, Post
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from quickcomm.models import Author, Comment, CommentLike, Follow, Host, Like, Post, reconcile_counters
 from django.core.exceptions import ValidationError
 
 # Create your tests here.
@@ -180,4 +182,118 @@ class PostModelTest(TestCase):
         post.full_clean()
 
 
+class ExternalURLTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        host = Host.objects.create(url='https://remote.example.com/api', username_password_base64='dXNlcjpwYXNz')
+        author = Author.objects.create(host=host, display_name='Remote Author', external_url='https://remote.example.com/api/authors/1/')
+        post = Post.objects.create(author=author, title='Remote Post', description='Remote Post Description', content_type='text/plain', content='Remote Post Content', visibility='PUBLIC', unlisted=False, categories='["test"]', external_url='https://remote.example.com/api/authors/1/posts/2')
+        Comment.objects.create(post=post, author=author, comment='Remote Comment', external_url='http://remote.example.com/api/authors/1/posts/2/comments/3')
+
+    def test_every_variant_is_found(self):
+        """External objects are found with any combination of insecure http/trailing slashes"""
+
+        for url in ['https://remote.example.com/api/authors/1', 'http://remote.example.com/api/authors/1/', 'https://REMOTE.example.com/api/authors/1/']:
+            self.assertEquals(Author.get_from_url(url).display_name, 'Remote Author')
+        for url in ['http://remote.example.com/api/authors/1/posts/2/', 'https://remote.example.com/api/authors/1/posts/2']:
+            self.assertEquals(Post.get_from_url(url).title, 'Remote Post')
+        for url in ['https://remote.example.com/api/authors/1/posts/2/comments/3/', 'http://remote.example.com/api/authors/1/posts/2/comments/3']:
+            self.assertEquals(Comment.get_from_url(url).comment, 'Remote Comment')
+
+    def test_single_lookup(self):
+        """Looking up an external author takes a single query"""
+
+        with CaptureQueriesContext(connection) as queries:
+            Author.get_from_url('http://remote.example.com/api/authors/1')
+        self.assertEquals(len(queries), 1)
+
+    def test_local_author_by_id(self):
+        """Local authors are found by the id at the end of the URL, remote ones are not"""
+
+        user = User.objects.create_user(username='rajan', password='badpassword')
+        local = Author.objects.create(user=user, display_name='Local Author')
+        remote = Author.objects.get(display_name='Remote Author')
+
+        self.assertEquals(Author.get_from_url(f'http://testserver/api/authors/{local.id}/'), local)
+        self.assertIsNone(Author.get_from_url(f'http://testserver/api/authors/{remote.id}/'))
+
+    def test_saving_unindexed_duplicate(self):
+        """Duplicates left without a normalized url by the migration can still be saved"""
+
+        author = Author.objects.get(display_name='Remote Author')
+        post = Post.objects.get(title='Remote Post')
+        comment = Comment.objects.get(comment='Remote Comment')
+
+        # the backfill leaves the later copies of an object unindexed
+        duplicates = [
+            Author.objects.create(host=author.host, display_name='Duplicate Author', external_url='http://remote.example.com/api/authors/2'),
+            Post.objects.create(author=author, title='Duplicate Post', description='', content_type='text/plain', content='', visibility='PUBLIC', unlisted=False, categories='[]', external_url='http://remote.example.com/api/authors/1/posts/4'),
+            Comment.objects.create(post=post, author=author, comment='Duplicate Comment', external_url='http://remote.example.com/api/authors/1/posts/2/comments/5'),
+        ]
+        for duplicate, original in zip(duplicates, [author, post, comment]):
+            type(duplicate).objects.filter(pk=duplicate.pk).update(external_url=f'http://{original.normalized_url}/', normalized_url=None)
+            duplicate.refresh_from_db()
+
+            duplicate.save()
+            self.assertIsNone(type(duplicate).objects.get(pk=duplicate.pk).normalized_url)
+            self.assertEquals(type(duplicate).get_from_url(original.external_url), original)
+
+
+class CounterTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author1 = Author.objects.create(user=User.objects.create_user(username='rajan', password='badpassword'), display_name='Author 1')
+        cls.author2 = Author.objects.create(user=User.objects.create_user(username='other', password='badpassword'), display_name='Author 2')
+        cls.post = Post.objects.create(author=cls.author1, title='My Post', description='My Post Description', content_type='text/plain', content='My Post Content', visibility='PUBLIC', unlisted=False, categories='["test"]')
+
+    def test_follow_counters(self):
+        """Following and unfollowing updates the counters of both authors"""
+
+        Follow.objects.create(follower=self.author2, following=self.author1)
+        self.author1.refresh_from_db()
+        self.author2.refresh_from_db()
+        self.assertEquals(self.author1.followers_count, 1)
+        self.assertEquals(self.author2.followings_count, 1)
+
+        # the counts are read from the counters without a query
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEquals(self.author1.follower_count(), 1)
+            self.assertEquals(self.author2.following_count(), 1)
+        self.assertEquals(len(queries), 0)
+
+        Follow.objects.filter(follower=self.author2).delete()
+        self.author1.refresh_from_db()
+        self.assertEquals(self.author1.followers_count, 0)
+
+    def test_post_counters(self):
+        """Liking and commenting on a post updates its counters, including queryset deletes and cascades"""
+
+        Like.objects.create(post=self.post, author=self.author2)
+        comment = Comment.objects.create(post=self.post, author=self.author2, comment='Nice')
+        CommentLike.objects.create(comment=comment, author=self.author1)
+        self.post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEquals(self.post.likes_count, 1)
+        self.assertEquals(self.post.comments_count, 1)
+        self.assertEquals(comment.likes_count, 1)
+
+        Like.objects.filter(post=self.post).delete()
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEquals(self.post.likes_count, 0)
+        self.assertEquals(self.post.comments_count, 0)
+
+    def test_reconcile(self):
+        """Counters that drifted are fixed by reconcile_counters"""
+
+        Like.objects.create(post=self.post, author=self.author2)
+        Post.objects.filter(id=self.post.id).update(likes_count=5, comments_count=2)
+
+        self.assertEquals(reconcile_counters(), 2)
+        self.post.refresh_from_db()
+        self.assertEquals(self.post.likes_count, 1)
+        self.assertEquals(self.post.comments_count, 0)
+        self.assertEquals(reconcile_counters(), 0)
 
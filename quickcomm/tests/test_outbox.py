@@ -0,0 +1,232 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from quickcomm.external_host_requests import InternalQCRequest
+from quickcomm.host_health import FAILURE_THRESHOLD, OPEN_TIMEOUT, get_breaker
+from quickcomm.models import Author, Follow, Host, Inbox, OutboxItem, Post
+from quickcomm.signals import deliver_pending_outbox_items
+
+
+class OutboxTests(TestCase):
+    """This set of tests checks that inbox items for remote authors are queued
+    in the outbox and delivered by the worker, not in the request."""
+
+    def setUp(self):
+        # the hosts without a shared inbox are remembered in the cache
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='badpassword')
+
+        self.host = Host.objects.create(url='https://remote.example.com/api',
+                                        serializer_class=Host.SerializerClass.INTERNAL,
+                                        username_password_base64='dXNlcjpwYXNz')
+
+        self.author1 = Author.objects.create(user=self.user1,
+                                             display_name='Local Author',
+                                             github='https://github.com/abramhindle',
+                                             profile_image='https://url.com')
+
+        self.remote = Author.objects.create(host=self.host,
+                                            display_name='Remote Author',
+                                            external_url='https://remote.example.com/api/authors/1')
+
+        Follow.objects.create(follower=self.remote, following=self.author1)
+
+        # the serializers need a request to build absolute urls
+        patcher = mock.patch('quickcomm.external_host_requests.get_request',
+                             return_value=RequestFactory().get('/'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_post(self):
+        return Post.objects.create(author=self.author1,
+                                   title='My Post',
+                                   description='My Post Description',
+                                   content_type='text/plain',
+                                   content='My Post Content',
+                                   visibility='PUBLIC',
+                                   unlisted=False,
+                                   categories='["test"]')
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_post_is_queued_not_sent(self, session):
+        """Test that saving a post for a remote follower queues it without
+        calling the remote host."""
+        post = self.create_post()
+
+        session.post.assert_not_called()
+
+        items = OutboxItem.objects.all()
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0].host, self.host)
+        self.assertEqual(items[0].inbox.author, self.remote)
+        self.assertEqual(items[0].status, OutboxItem.OutboxStatus.PENDING)
+        self.assertEqual(items[0].payload['object']['title'], post.title)
+
+    def test_local_items_are_not_queued(self):
+        """Test that inbox items for local authors never reach the outbox."""
+        Follow.objects.all().delete()
+        self.create_post()
+
+        self.assertEqual(Inbox.objects.count(), 1)
+        self.assertEqual(OutboxItem.objects.count(), 0)
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_delivery(self, session):
+        """Test that the worker delivers queued items, one by one to hosts
+        without a shared inbox."""
+        session.post.side_effect = [mock.Mock(status_code=404), mock.Mock(status_code=201)]
+        self.create_post()
+
+        claimed = deliver_pending_outbox_items()
+
+        self.assertEqual(claimed, 1)
+        self.assertEqual(session.post.call_count, 2)
+        self.assertEqual(session.post.call_args_list[0][0][0], 'https://remote.example.com/api/inbox/')
+        self.assertEqual(session.post.call_args[0][0], 'https://remote.example.com/api/authors/1/inbox/')
+
+        item = OutboxItem.objects.get()
+        self.assertEqual(item.status, OutboxItem.OutboxStatus.DELIVERED)
+        self.assertEqual(item.attempts, 1)
+
+        # delivered items are not sent again
+        self.assertEqual(deliver_pending_outbox_items(), 0)
+
+        # the host has no shared inbox, so the next item goes straight to the
+        # inbox of its author
+        session.post.side_effect = [mock.Mock(status_code=201)]
+        self.create_post()
+        self.assertEqual(deliver_pending_outbox_items(), 1)
+        self.assertEqual(session.post.call_count, 3)
+        self.assertEqual(session.post.call_args[0][0], 'https://remote.example.com/api/authors/1/inbox/')
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_failed_delivery_backs_off(self, session):
+        """Test that a failed delivery is retried later, and given up on after
+        the maximum number of attempts."""
+        session.post.side_effect = ConnectionError('Remote host is down')
+        self.create_post()
+
+        deliver_pending_outbox_items()
+
+        item = OutboxItem.objects.get()
+        self.assertEqual(item.status, OutboxItem.OutboxStatus.PENDING)
+        self.assertEqual(item.attempts, 1)
+        self.assertGreater(item.next_attempt, timezone.now())
+        self.assertEqual(item.last_error, 'Remote host is down')
+
+        # not due yet, so it is not claimed again
+        self.assertEqual(deliver_pending_outbox_items(), 0)
+
+        breaker = get_breaker(self.host)
+        for _ in range(OutboxItem.MAX_ATTEMPTS - 1):
+            OutboxItem.objects.update(next_attempt=timezone.now())
+            # let the open breaker try the host again, as it does after its
+            # timeout, so every attempt reaches the host
+            if breaker.state == Host.CircuitState.OPEN:
+                breaker.changed -= OPEN_TIMEOUT
+                Host.objects.update(circuit_changed=breaker.changed)
+            deliver_pending_outbox_items()
+
+        item.refresh_from_db()
+        self.assertEqual(item.status, OutboxItem.OutboxStatus.FAILED)
+        self.assertEqual(item.attempts, OutboxItem.MAX_ATTEMPTS)
+
+    def open_breaker(self):
+        breaker = get_breaker(self.host)
+        for _ in range(FAILURE_THRESHOLD):
+            breaker.record_failure()
+        return breaker
+
+    @mock.patch.object(InternalQCRequest, 'shared_inbox', False)
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_unavailable_host_does_not_use_attempts(self, session):
+        """Test that an item for a host that is down is put off until its
+        breaker lets calls through, without counting an attempt."""
+        breaker = self.open_breaker()
+        self.create_post()
+
+        self.assertEqual(deliver_pending_outbox_items(), 1)
+
+        session.post.assert_not_called()
+        item = OutboxItem.objects.get()
+        self.assertEqual(item.status, OutboxItem.OutboxStatus.PENDING)
+        self.assertEqual(item.attempts, 0)
+        self.assertEqual(item.next_attempt, breaker.retry_at())
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_unavailable_host_does_not_use_batch_attempts(self, session):
+        """Test that a batch for the shared inbox of a host that is down is
+        put off without counting an attempt."""
+        breaker = self.open_breaker()
+        self.create_post()
+
+        self.assertEqual(deliver_pending_outbox_items(), 1)
+
+        session.post.assert_not_called()
+        item = OutboxItem.objects.get()
+        self.assertEqual(item.status, OutboxItem.OutboxStatus.PENDING)
+        self.assertEqual(item.attempts, 0)
+        self.assertEqual(item.next_attempt, breaker.retry_at())
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_remote_followers_are_queued_together(self, session):
+        """Test that a post to many remote followers is serialized once and
+        queued for each of them."""
+        for i in range(2, 5):
+            remote = Author.objects.create(host=self.host,
+                                           display_name=f'Remote Author {i}',
+                                           external_url=f'https://remote.example.com/api/authors/{i}')
+            Follow.objects.create(follower=remote, following=self.author1)
+
+        with mock.patch('quickcomm.serializers.PostSerializer.get_comments_src', return_value={}) as serialize:
+            self.create_post()
+            self.assertEqual(serialize.call_count, 1)
+
+        self.assertEqual(OutboxItem.objects.count(), 4)
+        self.assertEqual(len(set(OutboxItem.objects.values_list('inbox__author', flat=True))), 4)
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_shared_inbox_delivery(self, session):
+        """Test that items for the followers on a QuickComm node are sent to
+        its shared inbox as one activity."""
+        for i in range(2, 5):
+            remote = Author.objects.create(host=self.host,
+                                           display_name=f'Remote Author {i}',
+                                           external_url=f'https://remote.example.com/api/authors/{i}')
+            Follow.objects.create(follower=remote, following=self.author1)
+        session.post.return_value = mock.Mock(status_code=200, json=lambda: {'results': [{'delivered': True}]})
+        self.create_post()
+
+        self.assertEqual(deliver_pending_outbox_items(), 4)
+
+        session.post.assert_called_once()
+        self.assertEqual(session.post.call_args[0][0], 'https://remote.example.com/api/inbox/')
+        activities = session.post.call_args[1]['json']
+        self.assertEqual(len(activities), 1)
+        self.assertEqual(sorted(activities[0]['authors']), ['1', '2', '3', '4'])
+        self.assertEqual(activities[0]['item']['type'].lower(), 'post')
+        self.assertEqual(OutboxItem.objects.filter(status=OutboxItem.OutboxStatus.DELIVERED).count(), 4)
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_permanent_shared_inbox_failure(self, session):
+        """Test that an activity the shared inbox turns away for good is not
+        sent again, and one it may accept later is."""
+        session.post.return_value = mock.Mock(status_code=202, json=lambda: {'results': [{'delivered': False, 'permanent': True, 'error': 'Author not found'}]})
+        self.create_post()
+
+        deliver_pending_outbox_items()
+        item = OutboxItem.objects.get()
+        self.assertEqual(item.status, OutboxItem.OutboxStatus.FAILED)
+        self.assertEqual(item.attempts, 1)
+        self.assertEqual(item.last_error, 'Author not found')
+
+        OutboxItem.objects.update(status=OutboxItem.OutboxStatus.PENDING, attempts=0, next_attempt=timezone.now())
+        session.post.return_value = mock.Mock(status_code=202, json=lambda: {'results': [{'delivered': False}]})
+        deliver_pending_outbox_items()
+        item = OutboxItem.objects.get()
+        self.assertEqual(item.status, OutboxItem.OutboxStatus.PENDING)
+        self.assertEqual(item.attempts, 1)
@@ -0,0 +1,63 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from django.contrib.auth.models import User
+from quickcomm.models import Author, Post
+
+class CursorPaginationTests(TestCase):
+    """This set of tests checks the opt-in cursor pages next to the numbered
+    ones."""
+
+    def setUp(self):
+        self.client = APIClient()
+
+        self.user = User.objects.create_user(username='rajan', password='badpassword')
+        self.author = Author.objects.create(user=self.user, display_name='My Real Cool Name', github='https://github.com/rajanmaghera', profile_image='https://url.com')
+        # posts made in one go share timestamps, so the id has to break ties
+        self.posts = Post.objects.bulk_create([Post(author=self.author, title=f'Post {i}', description='Description', content_type='text/plain', content='Content', visibility='PUBLIC', unlisted=False, categories='["test"]') for i in range(25)])
+        self.url = '/api/authors/{}/posts/'.format(self.author.id)
+
+    def get(self, url):
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            self.client.force_login(user=self.user)
+            return self.client.get(url)
+
+    def test_walk_cursor(self):
+        """Test that following the cursors returns every post once, newest first"""
+        ids = []
+        url = self.url + '?size=10&cursor='
+        while url:
+            req = self.get(url)
+            self.assertEqual(req.status_code, 200)
+            self.assertEqual(req.data['type'], 'posts')
+            self.assertEqual(req.data['size'], 10)
+            ids += [item['id'].rstrip('/').split('/')[-1] for item in req.data['items']]
+            url = req.data['next']
+
+        expected = sorted(Post.objects.filter(author=self.author), key=lambda post: (post.published, post.id), reverse=True)
+        self.assertEqual(ids, [str(post.id) for post in expected])
+
+    def test_no_count(self):
+        """Test that cursor pages do not count the list"""
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            self.client.force_login(user=self.user)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(self.url + '?size=5&cursor=')
+        self.assertFalse([query['sql'] for query in queries if 'COUNT(' in query['sql'] and 'quickcomm_post' in query['sql'] and 'MAX(' not in query['sql']])
+
+    def test_numbered_pages(self):
+        """Test that numbered pages keep working, in the same order as cursors"""
+        numbered = self.get(self.url + '?page=2&size=10').data
+        self.assertEqual(numbered['page'], 2)
+        self.assertNotIn('next', numbered)
+
+        first = self.get(self.url + '?size=10&cursor=').data
+        second = self.get(first['next']).data
+        self.assertEqual(numbered['items'], second['items'])
+
+    def test_invalid_cursor(self):
+        """Test that a broken cursor is not found"""
+        self.assertEqual(self.get(self.url + '?cursor=bm90IGEgY3Vyc29y').status_code, 404)
+        self.assertEqual(self.get(self.url + '?cursor=WyJub3QgYSBkYXRlIiwgIngiXQ==').status_code, 404)
@@ -0,0 +1,111 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from quickcomm.external_host_deserializers import PostDeserializer
+from quickcomm.models import Author, Host, Post, PostContent
+
+CONTENT = 'word ' * 1000
+
+
+class PostContentTests(TestCase):
+    """This set of tests checks that the content of posts is kept out of the
+    post rows, and only loaded where the whole post is shown."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='pass1')
+        self.author = Author.objects.create(user=self.user, display_name='user1')
+        self.post = Post.objects.create(author=self.author,
+                                        title='My Post',
+                                        description='My Post Description',
+                                        content_type=Post.PostType.TEXT,
+                                        content=CONTENT,
+                                        visibility='PUBLIC',
+                                        unlisted=False,
+                                        categories='["test"]')
+
+    def test_content_is_stored_apart(self):
+        """Test that the content is written to its own table, and that the
+        post keeps its start as the excerpt."""
+        self.assertEqual(PostContent.objects.get(post=self.post).data, CONTENT)
+
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(len(post.excerpt), Post.EXCERPT_LENGTH)
+        self.assertTrue(CONTENT.startswith(post.excerpt[:-1]))
+        self.assertEqual(post.content, CONTENT)
+
+        post.content = 'Shorter content'
+        post.save()
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.excerpt, 'Shorter content')
+        self.assertEqual(post.content, 'Shorter content')
+
+    def test_saving_without_content_does_not_write_it(self):
+        """Test that saving a post whose content was not set leaves the
+        content alone."""
+        post = Post.objects.get(pk=self.post.pk)
+        post.title = 'New Title'
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+        self.assertFalse([query for query in queries if 'postcontent' in query['sql']])
+        self.assertEqual(Post.objects.get(pk=self.post.pk).content, CONTENT)
+
+    def test_lists_do_not_load_content(self):
+        """Test that the lists of posts show the excerpt without loading the
+        content."""
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            self.client.login(username='user1', password='pass1')
+            for url in ['/all_posts/', f'/authors/{self.author.id}/', f'/authors/{self.author.id}/posts']:
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'My Post')
+                self.assertNotContains(response, CONTENT)
+                self.assertFalse([query for query in queries if 'postcontent' in query['sql']], url)
+
+    def test_api_serializes_content(self):
+        """Test that the API returns the whole content of every post."""
+        for i in range(3):
+            Post.objects.create(author=self.author, title=f'Post {i}', description='', content_type=Post.PostType.TEXT,
+                                content=f'Content {i}', visibility='PUBLIC', unlisted=False, categories='[]')
+
+        client = APIClient()
+        client.force_login(self.user)
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            response = client.get(f'/api/authors/{self.author.id}/posts/')
+            self.assertEqual(response.status_code, 200)
+            contents = {item['title']: item['content'] for item in response.data['items']}
+            self.assertEqual(contents, {'My Post': CONTENT, 'Post 0': 'Content 0', 'Post 1': 'Content 1', 'Post 2': 'Content 2'})
+
+            response = client.get(f'/api/authors/{self.author.id}/posts/{self.post.id}/')
+            self.assertEqual(response.data['content'], CONTENT)
+
+    def test_synced_content_is_stored(self):
+        """Test that the content of remote posts saved in a batch is written
+        to its own table too."""
+        host = Host.objects.create(url='https://remote.example.com/api', username_password_base64='dXNlcjpwYXNz')
+        remote = Author.objects.create(host=host, display_name='Remote Author', external_url='https://remote.example.com/api/authors/1')
+        data = {'title': 'Remote Post', 'source': None, 'origin': None, 'description': 'Remote Post Description',
+                'content_type': Post.PostType.TEXT, 'content': 'Remote content',
+                'published': self.post.published, 'visibility': 'PUBLIC', 'unlisted': False,
+                'external_url': 'https://remote.example.com/api/authors/1/posts/1'}
+
+        PostDeserializer.save_batch([data], author=remote)
+        post = Post.objects.get(author=remote)
+        self.assertEqual(post.excerpt, 'Remote content')
+        self.assertEqual(post.content, 'Remote content')
+
+        # a post whose content did not change does not write it again
+        data['title'] = 'Renamed Remote Post'
+        with CaptureQueriesContext(connection) as queries:
+            PostDeserializer.save_batch([data], author=remote)
+        self.assertFalse([query for query in queries if query['sql'].startswith(('INSERT', 'UPDATE')) and 'postcontent' in query['sql']])
+        self.assertEqual(Post.objects.get(author=remote).title, 'Renamed Remote Post')
+
+        data['content'] = 'Edited remote content'
+        PostDeserializer.save_batch([data], author=remote)
+        post = Post.objects.get(author=remote)
+        self.assertEqual(post.excerpt, 'Edited remote content')
+        self.assertEqual(post.content, 'Edited remote content')
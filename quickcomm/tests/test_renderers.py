@@ -0,0 +1,49 @@
+import datetime
+import decimal
+import io
+import json
+import uuid
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from quickcomm import renderers
+from quickcomm.renderers import FastJSONParser, FastJSONRenderer
+
+class FastJSONTests(TestCase):
+    """This set of tests checks that the fast JSON renderer and parser give
+    the same results as DRF's own."""
+
+    def setUp(self):
+        self.data = {
+            'id': uuid.uuid4(),
+            'published': timezone.now(),
+            'local': datetime.datetime(2023, 3, 1, 12, 30, 15, 250, tzinfo=datetime.timezone(datetime.timedelta(hours=-7))),
+            'naive': datetime.datetime(2023, 3, 1, 12, 30),
+            'date': datetime.date(2023, 3, 1),
+            'price': decimal.Decimal('1.5'),
+            'text': 'Ünïcode   and "quotes"',
+            'items': [{'count': 1, 'unlisted': False, 'nothing': None}],
+        }
+
+    def test_same_output(self):
+        """Test that the rendered JSON is the same as DRF's"""
+        fast = FastJSONRenderer().render(self.data)
+        self.assertEqual(json.loads(fast), json.loads(JSONRenderer().render(self.data)))
+
+    def test_fallback(self):
+        """Test that the stdlib is used when orjson is not installed"""
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+            self.assertEqual(FastJSONParser().parse(io.BytesIO(b'{"a": [1, 2]}')), {'a': [1, 2]})
+
+    def test_parse(self):
+        """Test that parsing gives the same data as DRF's parser, and the same error"""
+        body = JSONRenderer().render(self.data)
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(io.BytesIO(b'{"a": '))
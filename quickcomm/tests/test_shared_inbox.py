@@ -0,0 +1,130 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from quickcomm.external_host_deserializers import import_http_inbox_item
+from quickcomm.inbound import process_pending_inbox_items
+from quickcomm.models import Author, Host, Inbox, Like, Post, RawInboxItem
+
+
+class SharedInboxTests(TestCase):
+    """This set of tests checks that the shared inbox journals each activity
+    with its target authors, and that the worker imports it once and adds it
+    to all of their inboxes."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='rajan', password='badpassword')
+        self.authors = [Author.objects.create(user=self.user if i == 0 else None, display_name=f'Local {i}', profile_image='https://url.com') for i in range(3)]
+        self.post = Post.objects.create(author=self.authors[0], title='Post', description='Description', content_type='text/plain', content='Content', visibility='PUBLIC', unlisted=False, categories='[]')
+        self.host = Host.objects.create(url='https://remote.example.com/api')
+
+    def like(self):
+        return {
+            'type': 'Like',
+            'summary': 'Remote likes your post',
+            'author': {
+                'type': 'author',
+                'id': 'https://remote.example.com/api/authors/1',
+                'url': 'https://remote.example.com/api/authors/1',
+                'host': 'https://remote.example.com/api/',
+                'displayName': 'Remote',
+                'github': None,
+                'profileImage': None,
+            },
+            'object': 'http://testserver/api/authors/{}/posts/{}'.format(self.authors[0].id, self.post.id),
+        }
+
+    def send(self, activities, process=True):
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            self.client.force_login(user=self.user)
+            req = self.client.post('/api/inbox/', activities, format='json')
+        if process:
+            process_pending_inbox_items()
+        return req
+
+    def test_activity_goes_to_every_target(self):
+        """Test that one activity is imported once for all of its authors"""
+        req = self.send([{'authors': [str(author.id) for author in self.authors], 'item': self.like()}])
+        self.assertEqual(req.status_code, 202)
+        self.assertEqual(req.json()['results'], [{'delivered': True}])
+        self.assertEqual(Like.objects.count(), 1)
+        self.assertEqual(set(Inbox.objects.values_list('author', flat=True)), {author.id for author in self.authors})
+
+    def test_activities_are_journaled(self):
+        """Test that the endpoint only journals the activities with their
+        targets, and the worker imports them"""
+        req = self.send([{'authors': [str(author.id) for author in self.authors[1:]], 'item': self.like()}], process=False)
+        self.assertEqual(req.status_code, 202)
+        self.assertEqual(Like.objects.count(), 0)
+
+        item = RawInboxItem.objects.get()
+        self.assertEqual(item.targets, [str(author.id) for author in self.authors[1:]])
+        self.assertEqual(item.status, RawInboxItem.RawInboxStatus.PENDING)
+
+        self.assertEqual(process_pending_inbox_items(), 1)
+        item.refresh_from_db()
+        self.assertEqual(item.status, RawInboxItem.RawInboxStatus.DONE)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_results_are_per_activity(self):
+        """Test that a bad activity does not stop the others"""
+        req = self.send([
+            {'authors': ['not-an-id'], 'item': self.like()},
+            {'authors': [str(self.authors[1].id)], 'item': self.like()},
+            {'item': self.like()},
+            {'authors': [str(self.authors[2].id)], 'item': {'summary': 'no type'}},
+        ])
+        self.assertEqual(req.status_code, 202)
+        self.assertEqual([result['delivered'] for result in req.json()['results']], [False, True, False, False])
+        self.assertEqual([result.get('permanent') for result in req.json()['results']], [True, None, True, True])
+        self.assertEqual(RawInboxItem.objects.count(), 1)
+        # the post author also gets the like in their inbox when it is saved
+        self.assertEqual(set(Inbox.objects.values_list('author', flat=True)), {self.authors[0].id, self.authors[1].id})
+
+    def test_unexpected_error_fails_one_activity(self):
+        """Test that an activity whose import raises any error fails alone"""
+        def import_item(author, data, host):
+            if author == self.authors[1]:
+                raise ValueError('broken')
+            return import_http_inbox_item(author, data, host)
+
+        with mock.patch('quickcomm.external_host_deserializers.import_http_inbox_item', side_effect=import_item):
+            with self.assertLogs(level='ERROR'):
+                req = self.send([
+                    {'authors': [str(self.authors[1].id)], 'item': self.like()},
+                    {'authors': [str(self.authors[2].id)], 'item': self.like()},
+                ])
+        self.assertEqual(req.status_code, 202)
+        items = {item.targets[0]: item for item in RawInboxItem.objects.all()}
+        self.assertEqual(items[str(self.authors[1].id)].last_error, 'broken')
+        self.assertEqual(items[str(self.authors[2].id)].status, RawInboxItem.RawInboxStatus.DONE)
+        self.assertFalse(Inbox.objects.filter(author=self.authors[1]).exists())
+        self.assertTrue(Inbox.objects.filter(author=self.authors[2]).exists())
+
+    def test_not_a_list(self):
+        """Test that the body must be a list of activities"""
+        self.assertEqual(self.send({'authors': [], 'item': {}}).status_code, 400)
+
+    def test_duplicates_are_dropped(self):
+        """Test that an activity sent again only goes to the authors that did
+        not get it yet"""
+        self.send([{'authors': [str(self.authors[1].id)], 'item': self.like()}])
+        req = self.send([{'authors': [str(author.id) for author in self.authors[1:]], 'item': self.like()}])
+        self.assertEqual(req.json()['results'], [{'delivered': True}])
+        self.assertEqual(RawInboxItem.objects.order_by('received').last().targets, [str(self.authors[2].id)])
+        self.assertEqual(Inbox.objects.filter(author=self.authors[1]).count(), 1)
+        self.assertEqual(Inbox.objects.filter(author=self.authors[2]).count(), 1)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_copy_sent_while_pending_is_imported_once(self):
+        """Test that a copy sent before the first one was imported does not
+        import the activity again"""
+        activities = [{'authors': [str(self.authors[1].id)], 'item': self.like()}]
+        self.send(activities, process=False)
+        self.send(activities)
+        self.assertEqual(RawInboxItem.objects.filter(status=RawInboxItem.RawInboxStatus.DONE).count(), 2)
+        self.assertEqual(Inbox.objects.filter(author=self.authors[1]).count(), 1)
+        self.assertEqual(Like.objects.count(), 1)
@@ -0,0 +1,237 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from quickcomm.external_host_deserializers import Deserializers, InboxSerializers
+from quickcomm.external_host_requests import InternalQCRequest
+from quickcomm.models import Author, Host, SyncState
+
+
+class FakeResponse:
+
+    def __init__(self, items, status_code=200, headers=None):
+        self.status_code = status_code
+        self.items = items
+        self.headers = headers or {}
+
+    def json(self):
+        return {'items': self.items}
+
+
+class FakeDeserializer:
+    """Records the items that would have been saved."""
+
+    saved = []
+    # the ids of items that cannot be saved
+    failing = set()
+
+    def __init__(self, data):
+        self.data = data
+
+    def is_valid(self, raise_exception=False):
+        return True
+
+    def save(self, **kwargs):
+        if self.data.get('id') in FakeDeserializer.failing:
+            raise ValueError('Could not save the item.')
+        FakeDeserializer.saved.append(self.data)
+        return self.data
+
+
+class PagedSyncTests(TestCase):
+    """This set of tests checks that lists from remote hosts are fetched page
+    by page and saved in order."""
+
+    def setUp(self):
+        self.host = Host(url='https://remote.example.com/api', username_password_base64='dXNlcjpwYXNz')
+        self.req = InternalQCRequest(self.host, Deserializers, InboxSerializers)
+        FakeDeserializer.saved = []
+
+    def sync(self, session, page_count):
+        def get(endpoint, params=None, headers=None):
+            page = params['page']
+            if page > page_count:
+                return FakeResponse([])
+            return FakeResponse([{'page': page, 'item': i} for i in range(2)])
+
+        session.get.side_effect = get
+        self.req._get_list_response(FakeDeserializer, 'https://remote.example.com/api/authors',
+                                    lambda item: item, lambda data: data['items'])
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_pages_are_saved_in_order(self, session):
+        """Test that every item of every page is saved, in page order, when
+        full pages are fetched in parallel."""
+        self.req.PAGINATED_SIZE = 2
+        self.sync(session, 9)
+
+        self.assertEqual(len(FakeDeserializer.saved), 18)
+        self.assertEqual([item['page'] for item in FakeDeserializer.saved], sorted(item['page'] for item in FakeDeserializer.saved))
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_short_list_is_not_over_fetched(self, session):
+        """Test that a list with a single page only costs one extra request to
+        find its end, like fetching one page at a time would."""
+        self.sync(session, 1)
+
+        self.assertEqual(len(FakeDeserializer.saved), 2)
+        self.assertEqual(session.get.call_count, 2)
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_empty_list(self, session):
+        """Test that an empty list saves nothing."""
+        self.sync(session, 0)
+
+        self.assertEqual(len(FakeDeserializer.saved), 0)
+        self.assertEqual(session.get.call_count, 1)
+
+
+class BatchedSyncTests(TestCase):
+    """This set of tests checks that a page of remote authors is saved with a
+    fixed number of queries, however many authors it has."""
+
+    def setUp(self):
+        self.host = Host.objects.create(url='https://remote.example.com/api',
+                                        serializer_class=Host.SerializerClass.INTERNAL,
+                                        username_password_base64='dXNlcjpwYXNz')
+        self.req = InternalQCRequest(self.host, Deserializers, InboxSerializers)
+
+    def raw_authors(self, count, name='Author'):
+        return [{'type': 'author',
+                 'url': f'https://remote.example.com/api/authors/{i}',
+                 'displayName': f'{name} {i}'} for i in range(count)]
+
+    def sync(self, session, raw_authors):
+        self.req.PAGINATED_SIZE = len(raw_authors) + 1
+        session.get.side_effect = [FakeResponse(raw_authors), FakeResponse([])]
+        with CaptureQueriesContext(connection) as queries:
+            self.req.update_authors()
+        return len(queries)
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_query_count_does_not_grow_with_page(self, session):
+        """Test that saving 50 authors costs as many queries as saving 5."""
+        small = self.sync(session, self.raw_authors(5))
+        Author.objects.all().delete()
+        large = self.sync(session, self.raw_authors(50))
+
+        self.assertEqual(small, large)
+        self.assertEqual(Author.objects.filter(host=self.host).count(), 50)
+
+    @mock.patch('quickcomm.external_host_requests.session')
+    def test_resync_updates_authors(self, session):
+        """Test that syncing the same authors again updates them instead of
+        adding duplicates."""
+        self.sync(session, self.raw_authors(5))
+        self.sync(session, self.raw_authors(5, name='Renamed'))
+
+        self.assertEqual(Author.objects.count(), 5)
+        self.assertEqual(set(Author.objects.values_list('display_name', flat=True)),
+                         {f'Renamed {i}' for i in range(5)})
+
+
+class DeltaSyncTests(TestCase):
+    """This set of tests checks that syncing a list again only fetches and
+    saves what changed since the last sync."""
+
+    ENDPOINT = 'https://remote.example.com/api/authors/1/posts'
+
+    def setUp(self):
+        self.host = Host.objects.create(url='https://remote.example.com/api', username_password_base64='dXNlcjpwYXNz')
+        self.req = InternalQCRequest(self.host, Deserializers, InboxSerializers)
+        self.req.PAGINATED_SIZE = 2
+        FakeDeserializer.saved = []
+        FakeDeserializer.failing = set()
+
+    def posts(self, *days):
+        return [{'id': f'post-{day}', 'published': f'2023-03-{day:02d}T12:00:00Z'} for day in days]
+
+    def sync(self, session, pages, headers=None):
+        """Syncs a list with the given pages, returning the pages asked for."""
+        asked = []
+        def get(endpoint, params=None, headers=None):
+            asked.append((params['page'], headers))
+            if 'If-None-Match' in headers:
+                return FakeResponse([], status_code=304)
+            items = pages[params['page'] - 1] if params['page'] <= len(pages) else []
+            return FakeResponse(items, headers=response_headers)
+
+        response_headers = headers
+        session.get.side_effect = get
+        self.req._get_list_response(FakeDeserializer, self.ENDPOINT, lambda item: item, lambda data: data['items'], delta=True)
+        return asked
+
+    @mock.patch('quickcomm.external_host_requests.sync_session')
+    def test_not_modified(self, session):
+        """Test that a peer answering 304 costs one request and saves nothing"""
+        self.sync(session, [self.posts(3, 2), self.posts(1)], headers={'ETag': '"v1"'})
+        self.assertEqual(SyncState.objects.get(resource=self.ENDPOINT).etag, '"v1"')
+        FakeDeserializer.saved = []
+
+        asked = self.sync(session, [self.posts(3, 2), self.posts(1)])
+        self.assertEqual(len(asked), 1)
+        self.assertEqual(asked[0][1]['If-None-Match'], '"v1"')
+        self.assertEqual(FakeDeserializer.saved, [])
+
+    @mock.patch('quickcomm.external_host_requests.sync_session')
+    def test_unchanged_newest_first(self, session):
+        """Test that an unchanged list without validators costs one request"""
+        self.sync(session, [self.posts(3, 2), self.posts(1)])
+        self.assertEqual(len(FakeDeserializer.saved), 3)
+        FakeDeserializer.saved = []
+
+        asked = self.sync(session, [self.posts(3, 2), self.posts(1)])
+        self.assertEqual(len(asked), 1)
+        self.assertEqual(FakeDeserializer.saved, [])
+
+    @mock.patch('quickcomm.external_host_requests.sync_session')
+    def test_new_items(self, session):
+        """Test that new items are saved, and the pager stops at the old ones"""
+        self.sync(session, [self.posts(3, 2), self.posts(1)])
+        FakeDeserializer.saved = []
+
+        # page 3 may already be on its way, but it is not saved
+        self.sync(session, [self.posts(5, 4), self.posts(3, 2), self.posts(1)])
+        self.assertEqual([item['id'] for item in FakeDeserializer.saved], ['post-5', 'post-4'])
+        self.assertEqual(SyncState.objects.get(resource=self.ENDPOINT).last_published.day, 5)
+
+    @mock.patch('quickcomm.external_host_requests.sync_session')
+    def test_edited_old_items(self, session):
+        """Test that the pager goes past old items that changed"""
+        self.sync(session, [self.posts(3, 2), self.posts(1)])
+        FakeDeserializer.saved = []
+
+        first, second = self.posts(3, 2), self.posts(1)
+        first[1]['title'] = 'Edited'
+        second[0]['title'] = 'Edited'
+        self.sync(session, [first, second])
+        self.assertEqual([item['id'] for item in FakeDeserializer.saved], ['post-3', 'post-2', 'post-1'])
+
+    @mock.patch('quickcomm.external_host_requests.sync_session')
+    def test_failed_page_is_saved_again(self, session):
+        """Test that a page that could not be saved is not skipped next time"""
+        FakeDeserializer.failing = {'post-1'}
+        self.sync(session, [self.posts(3, 2), self.posts(1)])
+        FakeDeserializer.saved = []
+        FakeDeserializer.failing = set()
+
+        self.sync(session, [self.posts(3, 2), self.posts(1)])
+        self.assertEqual([item['id'] for item in FakeDeserializer.saved], ['post-3', 'post-2', 'post-1'])
+        FakeDeserializer.saved = []
+
+        # once every page was saved, the list is not saved again
+        asked = self.sync(session, [self.posts(3, 2), self.posts(1)])
+        self.assertEqual(len(asked), 1)
+        self.assertEqual(FakeDeserializer.saved, [])
+
+    @mock.patch('quickcomm.external_host_requests.sync_session')
+    def test_oldest_first(self, session):
+        """Test that a list that is oldest first is read to the end, saving only the pages that changed"""
+        self.sync(session, [self.posts(1, 2), self.posts(3)])
+        FakeDeserializer.saved = []
+
+        asked = self.sync(session, [self.posts(1, 2), self.posts(3, 4)])
+        self.assertEqual([page for page, _ in asked], [1, 2, 3])
+        self.assertEqual([item['id'] for item in FakeDeserializer.saved], ['post-3', 'post-4'])
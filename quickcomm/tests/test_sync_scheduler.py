@@ -0,0 +1,76 @@
+import datetime
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from quickcomm.models import Author, Host, Post, SyncSchedule
+from quickcomm.sync_scheduler import MAX_INTERVAL, MIN_INTERVAL, claim_sync, hurry_author_syncs, run_sync, update_sync_schedules
+
+
+class SyncSchedulerTests(TestCase):
+    """This set of tests checks that remote hosts and authors are synced on
+    schedules that adapt to how often they change."""
+
+    def setUp(self):
+        self.host = Host.objects.create(url='https://remote.example.com/api/')
+        self.author = Author.objects.create(host=self.host, external_url='https://remote.example.com/api/authors/1', display_name='Remote', profile_image='https://url.com')
+
+    def test_schedules_are_created_once(self):
+        """Test that every host and remote author gets its schedules"""
+        update_sync_schedules()
+        update_sync_schedules()
+        self.assertEqual(set(SyncSchedule.objects.values_list('kind', 'host', 'author')), {
+            (SyncSchedule.Kind.HOST_AUTHORS, self.host.id, None),
+            (SyncSchedule.Kind.AUTHOR_POSTS, None, self.author.id),
+            (SyncSchedule.Kind.AUTHOR_FOLLOWERS, None, self.author.id),
+        })
+
+    @mock.patch('quickcomm.sync_scheduler.sync_posts')
+    def test_idle_schedule_backs_off(self, sync_posts):
+        """Test that the interval doubles when nothing changed, up to the maximum"""
+        schedule = SyncSchedule.objects.create(kind=SyncSchedule.Kind.AUTHOR_POSTS, author=self.author, interval=MAX_INTERVAL // 2 + 1)
+        self.assertFalse(run_sync(schedule))
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.interval, MAX_INTERVAL)
+        self.assertIsNotNone(schedule.last_duration)
+        self.assertGreater(schedule.next_run, timezone.now())
+        sync_posts.assert_called_once_with(self.author)
+
+    @mock.patch('quickcomm.sync_scheduler.sync_posts')
+    def test_busy_schedule_speeds_up(self, sync_posts):
+        """Test that the interval halves when the sync saved changes"""
+        sync_posts.side_effect = lambda author: Post.objects.create(author=author, title='New', description='', content_type='text/plain', content='Content', visibility='PUBLIC', unlisted=False, categories='[]')
+        schedule = SyncSchedule.objects.create(kind=SyncSchedule.Kind.AUTHOR_POSTS, author=self.author, interval=MIN_INTERVAL + 1)
+        self.assertTrue(run_sync(schedule))
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.interval, MIN_INTERVAL)
+        self.assertIsNotNone(schedule.last_changed)
+
+    @mock.patch('quickcomm.sync_scheduler.sync_authors')
+    def test_failed_sync_backs_off(self, sync_authors):
+        """Test that errors are recorded and the schedule backs off"""
+        sync_authors.side_effect = Exception('Host is down')
+        schedule = SyncSchedule.objects.create(kind=SyncSchedule.Kind.HOST_AUTHORS, host=self.host, interval=300)
+        with self.assertLogs(level='ERROR'):
+            run_sync(schedule)
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.interval, 600)
+        self.assertEqual(schedule.last_error, 'Host is down')
+
+    def test_claim_once(self):
+        """Test that a due schedule can only be claimed by one scheduler"""
+        schedule = SyncSchedule.objects.create(kind=SyncSchedule.Kind.HOST_AUTHORS, host=self.host)
+        self.assertTrue(claim_sync(schedule))
+        self.assertFalse(claim_sync(schedule))
+
+    def test_hurry_author_syncs(self):
+        """Test that viewing an author makes their syncs due, unless they just ran"""
+        later = timezone.now() + datetime.timedelta(hours=1)
+        posts = SyncSchedule.objects.create(kind=SyncSchedule.Kind.AUTHOR_POSTS, author=self.author, next_run=later)
+        followers = SyncSchedule.objects.create(kind=SyncSchedule.Kind.AUTHOR_FOLLOWERS, author=self.author, next_run=later, last_run=timezone.now())
+        hurry_author_syncs(self.author)
+        posts.refresh_from_db()
+        followers.refresh_from_db()
+        self.assertLessEqual(posts.next_run, timezone.now())
+        self.assertEqual(followers.next_run, later)
@@ -0,0 +1,33 @@
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+
+from django.contrib.auth.models import User
+from quickcomm.models import Author, Like, Post
+from quickcomm.serializers import LikeActivitySerializer
+from quickcomm.urlbuilder import API_URLS, api_url
+
+class URLBuilderTests(TestCase):
+    """This set of tests checks that API urls built from templates match the
+    ones from reverse()."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='rajan', password='badpassword')
+        self.author = Author.objects.create(user=self.user, display_name='My Real Cool Name', github='https://github.com/rajanmaghera', profile_image='https://url.com')
+        self.post = Post.objects.create(author=self.author, title='My Post', description='My Post Description', content_type='text/plain', content='My Post Content', visibility='PUBLIC', unlisted=False, categories='["test"]')
+
+    def test_matches_reverse(self):
+        """Test that every url matches the one reverse() builds for the request"""
+        request = RequestFactory().get('/', secure=True, HTTP_HOST='social.example.com')
+        for name, ids in API_URLS.items():
+            kwargs = {key: self.post.id for key in ids}
+            self.assertEqual(api_url(name, request, **kwargs), request.build_absolute_uri(reverse(name, kwargs=kwargs)))
+
+    def test_without_request(self):
+        """Test that urls are built from the configured base url outside of a request"""
+        with self.settings(API_BASE_URL='https://social.example.com/'):
+            self.assertEqual(api_url('api:author-detail', pk=self.author.id), f'https://social.example.com/api/authors/{self.author.id}/')
+
+            liker = Author.objects.create(display_name='Liker', profile_image='https://url.com')
+            like = Like.objects.create(post=self.post, author=liker)
+            data = LikeActivitySerializer(like, context={'request': None}).data
+            self.assertEqual(data['object'], f'https://social.example.com/api/authors/{self.author.id}/posts/{self.post.id}/')
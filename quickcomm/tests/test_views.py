@@ -1,7 +1,9 @@
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from django.urls import reverse
-from quickcomm.models import Author, Post, RegistrationSettings, Comment
+from quickcomm.models import Author, Follow, FollowRequest, Inbox, Post, RegistrationSettings, Comment
 
 class LoginViewTest(TestCase):
     def setUp(self):
@@ -213,6 +215,7 @@ class LikeCommentTestCase(TestCase):
             response = c.post('http://testserver/authors/'+str(self.author1.id)+'/posts/'+str(self.post.id)+"/" + str(self.comment.id) +"/like_comment")
 
             self.assertEqual(response.status_code, 200)
+            self.comment.refresh_from_db()
             self.assertEqual(self.comment.like_count(), 1)
 
 class EditProfileViewTest(TestCase):
@@ -334,3 +337,69 @@ class ViewPostTest(TestCase):
 
             response = c.get('http://testserver/authors/'+str(self.author1.id)+'/posts/'+str(self.post.id)+"/")
             self.assertEqual(response.status_code, 403)
+
+
+class StreamViewTest(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass1')
+        self.user2 = User.objects.create_user(username='user2', password='pass2')
+        self.author1 = Author.objects.create(user=self.user1, display_name='user1')
+        self.author2 = Author.objects.create(user=self.user2, display_name='user2')
+        Follow.objects.create(follower=self.author1, following=self.author2)
+
+    def create_posts(self, count):
+        for i in range(count):
+            Post.objects.create(author=self.author2,
+                                title=f'Post {i}',
+                                description='My Post Description',
+                                content_type='text/plain',
+                                content='My Post Content',
+                                visibility='PUBLIC',
+                                unlisted=False,
+                                categories='["test"]')
+
+    def get_stream(self, cursor=None):
+        with self.settings(SECURE_SSL_REDIRECT = False):
+            self.client.login(username='user1', password='pass1')
+            return self.client.get(reverse('index'), {'cursor': cursor} if cursor else {})
+
+    def test_pages(self):
+        """The stream is split into pages that follow each other without gaps or repeats"""
+        self.create_posts(Inbox.STREAM_PAGE_SIZE + 5)
+
+        first = self.get_stream()
+        self.assertEqual(len(first.context['inbox']), Inbox.STREAM_PAGE_SIZE)
+        self.assertIsNotNone(first.context['next_cursor'])
+
+        second = self.get_stream(first.context['next_cursor'])
+        self.assertEqual(len(second.context['inbox']), 5)
+        self.assertIsNone(second.context['next_cursor'])
+
+        seen = [item.id for item in first.context['inbox']] + [item.id for item in second.context['inbox']]
+        self.assertEqual(len(set(seen)), Inbox.STREAM_PAGE_SIZE + 5)
+
+    def test_query_count_does_not_grow_with_page(self):
+        """Showing a full page of the stream costs as many queries as showing a few items"""
+        self.create_posts(3)
+
+        # the first request also logs in and warms up the content type cache
+        self.get_stream()
+        with CaptureQueriesContext(connection) as small:
+            self.get_stream()
+
+        self.create_posts(Inbox.STREAM_PAGE_SIZE)
+        with CaptureQueriesContext(connection) as large:
+            self.get_stream()
+
+        self.assertEqual(len(small), len(large))
+
+    def test_follow_state(self):
+        """The follow state of every follow request on a page is loaded at once"""
+        FollowRequest.objects.create(from_user=self.author2, to_user=self.author1)
+
+        items, next_cursor = Inbox.stream(self.author1)
+        self.assertFalse(items[0].content_object.is_following)
+
+        Follow.objects.create(follower=self.author2, following=self.author1)
+        items, next_cursor = Inbox.stream(self.author1)
+        self.assertTrue(items[0].content_object.is_following)
@@ -1,5 +1,5 @@
 import json
-from threading import Thread
+import uuid
 from dateutil import parser
 from django.db.models import Q, Count
 from django.template.defaulttags import register
@@ -11,7 +11,8 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
 from django.core.paginator import Paginator
 from django.urls import reverse
-from quickcomm.external_host_deserializers import sync_comment_likes, sync_comments, sync_followers, sync_post_likes, sync_posts, sync_authors
+from quickcomm.external_host_deserializers import sync_comment_likes, sync_comments, sync_post_likes
+from quickcomm.sync_scheduler import hurry_author_syncs
 from quickcomm.forms import CreateImageForm, CreateMarkdownForm, CreatePlainTextForm, CreateLoginForm, EditProfileForm
 from quickcomm.models import Author, Host, Post, Like, Comment, RegistrationSettings, Inbox
 from django.contrib.auth.forms import UserCreationForm
@@ -19,10 +20,10 @@ from django.db.models import Q
 from django.template.loader import render_to_string
 from django.forms import Form
 
-from quickcomm.models import Author, Follow, Inbox
+from quickcomm.models import Author, Follow, GitHubEvent, Inbox
 from quickcomm.models import Author, Post, Like, Comment, RegistrationSettings, Inbox, CommentLike, Follow, FollowRequest
 from django.contrib.auth.forms import UserCreationForm
-from .external_requests import get_github_stream
+from .external_requests import get_github_username
 from django.contrib import messages
 
 # Create your views here.
@@ -78,44 +79,57 @@ def friend_required(func):
 def index(request):
 
     author = request.author
-    inbox = list(Inbox.objects.filter(author=author).order_by('-added'))
+    cursor = decode_stream_cursor(request.GET.get('cursor'))
+    inbox, next_cursor = Inbox.stream(author, cursor)
 
-    # Get the GitHub stream for all of the author's followed users
-    following = [ follow.following for follow in Follow.objects.filter(follower=author) ]
+    # Add the GitHub events of the author and their followed users. Only the
+    # events between this page and the next one are shown, so every event
+    # shows up on exactly one page.
+    following = [ follow.following for follow in Follow.objects.filter(follower=author).select_related('following') ]
     following.append(author)
+    github_authors = {}
     for follow in following:
-        try:
-            github = get_github_stream(follow.github)
-            if 'message' in github:
-                if github['message'] == 'Not Found':
-                    continue
-            github = [dict(item, **{
-                'format': 'github',
-                'localAuthor': follow,
-                'added': parser.parse(item["created_at"])
-                                    }) for item in github]
-            inbox.extend(github)
-        except:
-            continue
-
-    def get_date(item):
-        """Get the date of the item, regardless of whether it's a dict or an object."""
-        if isinstance(item, dict):
-            return item['added']
-        else:
-            return item.added
+        username = get_github_username(follow.github)
+        if username is not None:
+            github_authors.setdefault(username.lower(), follow)
+
+    events = GitHubEvent.objects.filter(feed__username__in=github_authors.keys()).select_related('feed')
+    if cursor is not None:
+        events = events.filter(created__lt=cursor[0])
+    if next_cursor is not None:
+        events = events.filter(created__gte=next_cursor[0])
+    for event in events:
+        event.local_author = github_authors[event.feed.username]
+        inbox.append(event)
 
     # Sort the inbox by date, most recent first
-    inbox.sort(key=lambda x: get_date(x), reverse=True)
-
+    inbox.sort(key=lambda item: item.added, reverse=True)
 
     context = {
         'inbox': inbox,
         'current_author': author,
+        'next_cursor': encode_stream_cursor(next_cursor),
     }
     return render(request, 'quickcomm/index.html', context)
 
 
+def encode_stream_cursor(cursor):
+    """Returns the cursor of a stream page as a string for the page URL."""
+    if cursor is None:
+        return None
+    added, id = cursor
+    return added.isoformat() + '_' + str(id)
+
+def decode_stream_cursor(cursor):
+    """Returns the cursor of a stream page from the page URL, or None if it is
+    missing or invalid."""
+    try:
+        added, id = cursor.rsplit('_', 1)
+        return parser.isoparse(added), uuid.UUID(id)
+    except Exception:
+        return None
+
+
 @author_required
 def create_post(request):
     current_author = request.author
@@ -140,7 +154,7 @@ def share_post(request, post_id, author_id):
     current_attributes = {
         "title": post.title,
         "description": post.description,
-        "content": post.content,
+        "content": post.content_formatted,
         "visibility": post.visibility,
         "unlisted": post.unlisted,
         "origin": post.origin,
@@ -239,37 +253,13 @@ def post_view(request, post_id, author_id):
     else:
         post_comments = Comment.objects.filter(post=post).order_by("-published")
     
-    #dictionary with likes for each comment
-    result = CommentLike.objects.values('comment__id').annotate(num_authors=Count('author', distinct=True))
-    comment_dict = {}
-    for item in result:
-        comment_dict[item['comment__id']] = item['num_authors']
-
-    #dictionary with each comment and the authors who liked it
-    comment_like_list = CommentLike.objects.select_related('author').values('comment_id', 'author__id').annotate(count=Count('author'))
-    comment_author_dict = {}
-    for item in comment_like_list:
-        comment_id = item['comment_id']
-        author_id_t = item['author__id']
-        if comment_id not in comment_author_dict:
-            comment_author_dict[comment_id] = []
-        comment_author_dict[comment_id].append(author_id_t)
-
-    #dictionary with likes for each post
-    result = Like.objects.values('post_id').annotate(num_authors=Count('author', distinct=True))
-    post_dict = {}
-    for item in result:
-        post_dict[item['post_id']] = item['num_authors']
-
-    #dictionary with each post and the authors who liked it
-    post_like_list = Like.objects.select_related('author').values('post_id', 'author__id').annotate(count=Count('author'))
-    post_author_dict = {}
-    for item in post_like_list:
-        post_id_t = item['post_id']
-        author_id_t = item['author__id']
-        if post_id_t not in post_author_dict:
-            post_author_dict[post_id_t] = []
-        post_author_dict[post_id_t].append(author_id_t)
+    # the like counts are stored on the post and its comments, so only the
+    # likes of the current author on this post are needed
+    post_comments = list(post_comments.select_related('author', 'post__author'))
+    liked_comments = set(CommentLike.objects.filter(comment__post=post, author=current_author).values_list('comment_id', flat=True))
+    for each_comment in post_comments:
+        each_comment.is_liked = each_comment.id in liked_comments
+    post_liked = Like.objects.filter(post=post, author=current_author).exists()
 
     if post.content_type == Post.PostType.TEXT:
         form = CreatePlainTextForm()
@@ -312,7 +302,7 @@ def post_view(request, post_id, author_id):
 
     #getting updated post
     post = get_object_or_404(Post, pk=post_id)
-    context = {"form":form, "post": post, "post_comments":post_comments, "current_author": current_author,"comment_dict":comment_dict, "comment_author_dict":comment_author_dict,"post_dict":post_dict, "post_author_dict":post_author_dict}
+    context = {"form":form, "post": post, "post_comments":post_comments, "current_author": current_author, "post_liked": post_liked}
     return render(request, "quickcomm/post.html", context)
 
 @register.filter
@@ -341,7 +331,7 @@ def post_like(request, post_id, author_id):
             like_key = f"post_like_{post_id}"
             request.session[like_key] = author == post.author
 
-    like_count = Like.objects.filter(post__id=post_id).count()
+    like_count = Post.objects.values_list('likes_count', flat=True).get(pk=post_id)
     button = render_to_string("quickcomm/likebutton.html", {"is_liked": is_liked, "like_count": like_count }, request=request)
     return JsonResponse({"is_liked": button}) 
 
@@ -364,7 +354,7 @@ def like_comment(request, post_id, author_id, comment_id):
             comment_like_key = f"comment_like_{comment_id}"
             request.session[comment_like_key] = author == main_comment.author
 
-    like_count = CommentLike.objects.filter(comment__id=comment_id).count()
+    like_count = Comment.objects.values_list('likes_count', flat=True).get(pk=comment_id)
     button = render_to_string("quickcomm/likebutton.html", {"is_liked": is_liked, "like_count": like_count }, request=request)
     return JsonResponse({"is_liked": button })
 
@@ -408,7 +398,7 @@ def register(request):
             author = Author(user=user, display_name=user, github='https://github.com/', profile_image='https://cdn.pixabay.com/photo/2015/10/05/22/37/blank-profile-picture-973460_1280.png')
             author.save()
             # either log the user in or set their account to inactve
-            admin_approved = RegistrationSettings.objects.first().are_new_users_active
+            admin_approved = RegistrationSettings.get_cached().are_new_users_active
             if admin_approved:
                 auth_login(request, user)
             else:
@@ -422,35 +412,10 @@ def register(request):
         }
     return render(request, 'quickcomm/register.html', context)
 
-author_update_thread = None
-
 @author_required
 def view_authors(request):
-    global author_update_thread
     current_author = request.author
 
-    all_hosts = Host.objects.all()
-
-    def sync_all_authors():
-        for host in all_hosts:
-            sync_authors(host)
-
-        # get all authors from the database
-        authors = Author.objects.all()
-        for author in authors:
-            # if the author is remote, sync their posts
-            if author.is_remote and not author.is_temporary:
-                sync_followers(author)
-        # when we're done, set the thread to None so we can start it again
-        global author_update_thread
-        author_update_thread = None
-
-    if author_update_thread is None or not author_update_thread.is_alive():
-        # start the thread to update the author list
-        author_update_thread = Thread(target=sync_all_authors, daemon=True)
-        author_update_thread.start()
-
-
     authors = Author.frontend_queryset().order_by('display_name')
 
     size = request.GET.get('size', '30')
@@ -474,8 +439,7 @@ def view_profile(request, author_id):
     form = EditProfileForm()
 
     if author.is_remote and not author.is_temporary:
-        Thread(target=sync_posts, args=(author,), daemon=True).start()
-        Thread(target=sync_followers, args=(author,), daemon=True).start()
+        hurry_author_syncs(author)
 
     current_attributes = {"display_name": current_author.display_name, "github": current_author.github, "profile_image": current_author.profile_image}
     if current_author.user == author.user:
@@ -500,7 +464,9 @@ def view_profile(request, author_id):
         posts = Post.objects.filter(Q(author=author) , Q(visibility = 'PUBLIC') | Q(visibility = 'FRIENDS') | Q(visibility = 'PRIVATE', recipient = current_author.id) | Q(visibility = 'PRIVATE', author=author), Q(unlisted = False) | Q(unlisted = True, author=current_author)).order_by('-published')
     else:
         posts = Post.objects.filter(Q(author=author) , Q(visibility = 'PUBLIC') | Q(visibility = 'PRIVATE', recipient = current_author.id) | Q(visibility = 'PRIVATE', author=author), Q(unlisted = False) | Q(unlisted = True, author=current_author)).order_by('-published')
-    
+
+    # lists of posts only show the excerpt, so the content is not loaded
+    posts = posts.only(*Post.LIST_FIELDS)
 
 
     return render(request, 'quickcomm/profile.html', {
@@ -654,29 +620,14 @@ def decline_request(request,author_id):
     to_user=get_object_or_404(Author,pk=author_id)
     pass
 
-all_posts_thread = None
-
 @author_required
 def all_posts(request):
     """View all public posts on a server"""
 
     current_author = request.author
 
-    def sync_all_authors2():
-        global all_posts_thread
-        for author in Author.objects.all():
-            if author.is_remote and not author.is_temporary:
-                sync_posts(author)
-                sync_followers(author)
-
-        all_posts_thread = None
-
-    global all_posts_thread
-    if all_posts_thread is None or not all_posts_thread.is_alive():
-        all_posts_thread = Thread(target=sync_all_authors2, daemon=True)
-        all_posts_thread.start()
-
-    posts = Post.objects.filter(visibility=Post.PostVisibility.PUBLIC, unlisted=False).order_by('-published')
+    # lists of posts only show the excerpt, so the content is not loaded
+    posts = Post.objects.filter(visibility=Post.PostVisibility.PUBLIC, unlisted=False).order_by('-published').select_related('author').only(*Post.LIST_FIELDS)
 
     size = request.GET.get('size', '10')
     paginator = Paginator(posts, size)
@@ -698,9 +649,10 @@ def view_author_posts(request, author_id):
     current_author = request.author
 
     if author.is_remote and not author.is_temporary:
-        Thread(target=sync_posts, args=(author,), daemon=True).start()
+        hurry_author_syncs(author)
 
-    posts = Post.objects.filter(author=author, visibility=Post.PostVisibility.PUBLIC)
+    # lists of posts only show the excerpt, so the content is not loaded
+    posts = Post.objects.filter(author=author, visibility=Post.PostVisibility.PUBLIC).only(*Post.LIST_FIELDS)
 
     size = request.GET.get('size', '10')
     paginator = Paginator(posts, size)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 import django_on_heroku
 
@@ -28,6 +29,10 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# The scheme and host of this server, used to build the urls of API objects
+# outside of a request (e.g. in the background workers).
+API_BASE_URL = os.environ.get('API_BASE_URL', 'http://localhost:8000')
+
 STATIC_ROOT = BASE_DIR / 'static'
 
 # Application definition
@@ -100,6 +105,38 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+# The API page cache is kept in the database, as the web and worker processes
+# must see the same versions for a change in one to invalidate pages cached
+# by another. Run `python manage.py createcachetable` after migrating.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'quickcomm_api_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+# Responses from remote hosts are cached in the memory of each process, over
+# files shared by the processes on the same machine (see quickcomm/http_cache).
+# Set HTTP_CACHE_DIR to an empty string to only cache them in memory.
+HTTP_CACHE_DIR = os.environ.get('HTTP_CACHE_DIR', str(BASE_DIR / 'http_cache'))
+if HTTP_CACHE_DIR:
+    CACHES['http'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': HTTP_CACHE_DIR,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -162,6 +199,19 @@ MARTOR_TOOLBAR_BUTTONS = [
 ]
 
 
+# API rendering and parsing, see quickcomm/renderers.py
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'quickcomm.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'quickcomm.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
 
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {